@@ -1,22 +1,150 @@
 from XValue import *
+import numpy as np
+
+class ActorStore:
+    """
+    Array backed store of actor properties shared by all actors with the same declared
+    properties. Every declared property is a column of growable NumPy array and every actor
+    is a row, so fleet-wide reads are vectorised slices (see column and liveRows).
+    Rows of unregistered actors are recycled.
+    """
+    def __init__(self, names, capacity = 64):
+        self.names = tuple(names)
+        self.columns = {name : i for i, name in enumerate(self.names)}
+        self.data = np.zeros((capacity, len(self.names)))
+        self.actorIndex = np.full(capacity, -1, dtype=np.int64) #owning actor (-1 = free row)
+        self.free = []
+        self.size = 0 #number of used rows (incl. free ones)
+
+    def allocate(self, actorIndex, values):
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = self.size
+            self.size += 1
+            if row >= len(self.data):
+                self.data = np.concatenate((self.data, np.zeros_like(self.data)))
+                self.actorIndex = np.concatenate((self.actorIndex,
+                                                  np.full_like(self.actorIndex, -1)))
+        self.data[row] = values
+        self.actorIndex[row] = actorIndex
+        return row
+
+    def release(self, row):
+        self.actorIndex[row] = -1
+        self.free.append(row)
+
+    def liveRows(self):
+        return np.nonzero(self.actorIndex[:self.size] >= 0)[0]
+
+    def column(self, name):
+        "values of property for all used rows (use liveRows for selection of live actors)"
+        return self.data[:self.size, self.columns[name]]
+
+
+class ActorStateView:
+    """
+    Thin dict-like view of one row of ActorStore (replacement of dict of actor properties).
+    Undeclared and time dependent properties are kept in (lazily created) dict.
+    """
+    __slots__ = ("store", "row", "extra")
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+        self.extra = None
+
+    def __getitem__(self, key):
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        column = self.store.columns.get(key)
+        if column is None or self.row < 0:
+            raise KeyError(key)
+        return float(self.store.data[self.row, column])
+
+    def __setitem__(self, key, value):
+        column = self.store.columns.get(key)
+        if column is None or self.row < 0 or (self.extra is not None and key in self.extra):
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+        else:
+            self.store.data[self.row, column] = value
+
+    def setExtra(self, key, value):
+        "sets value kept outside of store (e.g. string), it overrides column of declared property"
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __contains__(self, key):
+        return (self.row >= 0 and key in self.store.columns) or (
+                    self.extra is not None and key in self.extra)
+
+    def get(self, key, default = None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        keys = list(self.store.names) if self.row >= 0 else []
+        if self.extra is not None:
+            keys.extend(key for key in self.extra if key not in self.store.columns)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def detach(self):
+        "moves values to private dict and releases row of store"
+        if self.row >= 0:
+            extra = dict(self.items())
+            self.store.release(self.row)
+            self.row = -1
+            self.extra = extra
+
 
 class Actor:
     def __init__(self, simulation, xmlSource = None, extraProperties = False):
-        self.xcontext = XValueContext(lambda: self.simulation.now() - self.startTime)
+        self.xcontext = XValueContext(self.localTime)
         self.simulation = simulation
         self.xmlSource = xmlSource
+        self.extraProperties = extraProperties
+        self.transaction = None #owning (top level) transaction
+        self.initialValues = None #x-values of properties (created once, reset by context)
+        self.reset()
+
+    def reset(self):
+        "registers actor and sets initial values of properties (also for recycled actors)"
         self.startTime = self.simulation.now()
-        self.props = {}
-        if extraProperties:
-            for element in xmlSource:
-                tag = element.tag
-                self.props[tag] = getXValue(xmlSource, tag, self.xcontext)
+        self.xcontext.resetContext()
+        self.index = self.simulation.registerActor(self)
+        if self.initialValues is None:
+            self.initialValues = ([(element.tag, getXValue(self.xmlSource, element.tag,
+                                                           self.xcontext))
+                                      for element in self.xmlSource]
+                                  if self.extraProperties else [])
+        names, values, extra = [], [], {}
+        for tag, value in self.initialValues:
+            if isinstance(value, XValue) and value.type == XValueType.TIME_DEPENDENT:
+                extra[tag] = value
+            else:
+                names.append(tag)
+                values.append(float(value))
+        store = self.simulation.actorStore(names)
+        self.props = ActorStateView(store, store.allocate(self.index, values))
+        for key, value in extra.items():
+            self.props[key] = value
+
+    def localTime(self):
+        return self.simulation.now() - self.startTime
         
     def __str__(self):
         return ",".join(str(val) for val in self.props.values())
-
-        
-        
-
-
-
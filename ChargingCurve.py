@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import numpy as np
+from XValue import number, InvalidXMLException
+from UrlUtil import resolveUrl, etree
+
+class ChargingCurve:
+    """
+    Tabulated charging curve: state of charge (0-1) as nondecreasing function of charging
+    time, evaluated by linear interpolation of precomputed arrays. Session starting
+    at state of charge s follows the curve from time of s, i.e. soc(time(s) + duration).
+
+    Time is in seconds or (normalized curve) in multiples of ideal charging time
+    capacity / (efficiency * power), so one curve can serve batteries and chargers
+    of different size (see scale). All methods accept numpy arrays (vectorised
+    evaluation of many sessions).
+    """
+    def __init__(self, times, socs, normalized = False, efficiency = 0.9, name = None):
+        order = np.argsort(np.asarray(times, dtype=np.float64), kind="stable")
+        self.times = np.asarray(times, dtype=np.float64)[order]
+        self.socs = np.maximum.accumulate(np.asarray(socs, dtype=np.float64)[order])
+        if len(self.times) < 2:
+            raise InvalidXMLException("charging curve {0} needs at least two points".format(name))
+        #inverse function needs strictly increasing soc (first time of every level)
+        levels, first = np.unique(self.socs, return_index=True)
+        self.inverseSocs = levels
+        self.inverseTimes = self.times[first]
+        self.normalized = normalized
+        self.efficiency = efficiency
+        self.name = name
+
+    @property
+    def maxSoc(self):
+        return self.socs[-1]
+
+    def scale(self, capacity, power):
+        "seconds per time unit of curve for capacity (kWh) and power (kW)"
+        if not self.normalized:
+            return 1.0
+        return np.asarray(capacity) * 3600.0 / (self.efficiency * np.asarray(power))
+
+    def timeAt(self, soc, scale = 1.0):
+        "charging time from the start of curve to soc"
+        return np.interp(soc, self.inverseSocs, self.inverseTimes) * scale
+
+    def socAt(self, time, scale = 1.0):
+        return np.interp(np.asarray(time) / scale, self.times, self.socs)
+
+    def charge(self, soc, duration, scale = 1.0):
+        "state of charge after charging from soc for duration (sec)"
+        return np.maximum(self.socAt(self.timeAt(soc, scale) + duration, scale), soc)
+
+    def timeTo(self, soc, target, scale = 1.0):
+        "charging time (sec) from soc to target (maximal soc of curve at most)"
+        return np.maximum(self.timeAt(np.minimum(target, self.maxSoc), scale)
+                             - self.timeAt(soc, scale), 0.0)
+
+def cubicCurve(points = 201):
+    "tabulated polynomial of ECarModel.charging (soc over normalized time from empty battery)"
+    polynomial = [0.168, -0.78, 1.38, 0.0]
+    full = min(root.real for root in np.roots(np.subtract(polynomial, [0, 0, 0, 1]))
+                   if abs(root.imag) < 1e-9 and root.real > 0)
+    times = np.linspace(0.0, full, points)
+    return ChargingCurve(times, np.minimum(np.polyval(polynomial, times), 1.0), True, 0.9,
+                         "cubic")
+
+builtinCurves = {"cubic" : cubicCurve}
+
+def _curvesFromCsv(path):
+    "CSV with header curve,time,soc (time in seconds or h:mm) or curve,x,soc (normalized)"
+    points = {}
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        normalized = "x" in reader.fieldnames
+        for row in reader:
+            if row["curve"].startswith("#"):
+                continue
+            time = float(row["x"]) if normalized else number(row["time"])
+            points.setdefault(row["curve"].strip(), []).append((time, float(row["soc"])))
+    return {name : ChargingCurve([p[0] for p in curve], [p[1] for p in curve], normalized,
+                                 name=name)
+                for name, curve in points.items()}
+
+def _curvesFromXml(path):
+    """
+    XML with elements <curve id="..." normalized="false" efficiency="0.9"> containing
+    <point time="0:30" soc="0.45"/> (time is x for normalized curves)
+    """
+    curves = {}
+    for element in etree.parse(path).getroot().iter("curve"):
+        normalized = element.get("normalized", "false").lower() == "true"
+        points = [(number(point.get("time")), float(point.get("soc")))
+                      for point in element.iter("point")]
+        name = element.get("id")
+        curves[name] = ChargingCurve([p[0] for p in points], [p[1] for p in points], normalized,
+                                     float(element.get("efficiency", 0.9)), name)
+    return curves
+
+curveFiles = {} #loaded libraries (path -> (mtime, name -> ChargingCurve))
+
+def loadCurves(path):
+    "curves of library file (CSV or XML, reloaded if the file is changed)"
+    mtime = os.path.getmtime(path)
+    cached = curveFiles.get(path)
+    if cached is None or cached[0] != mtime:
+        curves = _curvesFromXml(path) if path.endswith(".xml") else _curvesFromCsv(path)
+        cached = (mtime, curves)
+        curveFiles[path] = cached
+    return cached[1]
+
+def getCurve(url, base = None):
+    "curve given by builtin name (e.g. cubic) or url of library with fragment (file.csv#name)"
+    if url in builtinCurves:
+        if not isinstance(builtinCurves[url], ChargingCurve):
+            builtinCurves[url] = builtinCurves[url]()
+        return builtinCurves[url]
+    target, path, name = resolveUrl(url, base)
+    curves = loadCurves(path)
+    if not name:
+        if len(curves) != 1:
+            raise InvalidXMLException("curve name is required in {0}".format(url))
+        return next(iter(curves.values()))
+    if name not in curves:
+        raise InvalidXMLException("unknown charging curve {0}".format(url))
+    return curves[name]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+from SimPy.Simulation import Resource
+
+class HubSession:
+    "charging session of transaction in hub (energy in kWh, power in kW)"
+    def __init__(self, transaction, energy, target, maxPower, priority, departure, order):
+        self.transaction = transaction
+        self.energy = energy
+        self.target = target
+        self.maxPower = maxPower
+        self.priority = priority
+        self.departure = departure
+        self.order = order
+        self.power = 0.0
+        self.end = departure
+
+class ChargingHub(Resource):
+    """
+    Charging hub: sockets (resource of given capacity) sharing grid connection of maxPower
+    (kW). Power is split among active sessions by policy "equal" (equal shares capped by
+    session limits, the rest is redistributed) or "priority" (sessions with higher priority
+    are served first) and it is reallocated only when session starts or ends. Energy is
+    integrated analytically (power is constant between these events), sessions end at
+    departure or when target energy is reached (holding transactions are rescheduled).
+    """
+    def __init__(self, simulation, sockets, maxPower, policy = "equal", efficiency = 0.9,
+                 loadCurve = None):
+        super().__init__(sockets, sim=simulation)
+        if policy not in ("equal", "priority"):
+            raise ValueError("unknown power sharing policy {0}".format(policy))
+        self.simulation = simulation
+        self.maxPower = maxPower
+        self.policy = policy
+        self.efficiency = efficiency
+        self.loadCurve = loadCurve #category of load curve collector (total power)
+        self.sessions = []
+        self.lastUpdate = simulation.now()
+        self.counter = 0
+        self.reallocations = 0
+
+    @property
+    def power(self):
+        return sum(session.power for session in self.sessions)
+
+    def _advance(self):
+        "integrates energy of sessions from last event to now"
+        now = self.simulation.now()
+        dt = now - self.lastUpdate
+        if dt > 0:
+            for session in self.sessions:
+                session.energy = min(session.energy + session.power * self.efficiency * dt / 3600.0,
+                                     session.target)
+            if self.loadCurve is not None and self.sessions:
+                self.simulation.collector.collectInterval(self.loadCurve, self.lastUpdate, now,
+                                                          self.power)
+        self.lastUpdate = now
+
+    def _allocate(self, current = None):
+        "new powers and ends of sessions, rescheduling of transactions with changed end"
+        now = self.simulation.now()
+        waiting = [session for session in self.sessions if session.energy < session.target]
+        for session in self.sessions:
+            session.power = 0.0
+        remaining = self.maxPower
+        if self.policy == "equal":
+            waiting.sort(key=lambda session: session.maxPower) #water filling
+            for i, session in enumerate(waiting):
+                session.power = min(session.maxPower, remaining / (len(waiting) - i))
+                remaining -= session.power
+        else:
+            waiting.sort(key=lambda session: (-session.priority, session.order))
+            for session in waiting:
+                session.power = min(session.maxPower, remaining)
+                remaining -= session.power
+        self.reallocations += 1
+        for session in self.sessions:
+            end = session.departure
+            if session.energy >= session.target:
+                end = now
+            elif session.power > 0:
+                end = min(end, now + (session.target - session.energy)
+                                     / (session.power * self.efficiency) * 3600.0)
+            if end != session.end:
+                session.end = end
+                if session.transaction is not current: #current transaction holds until end
+                    self.simulation.reactivate(session.transaction, at=end)
+
+    def join(self, transaction, energy, target, maxPower, priority, departure):
+        "starts session of transaction (owning socket), returns HubSession (see end)"
+        self._advance()
+        session = HubSession(transaction, energy, target, maxPower, priority, departure,
+                             self.counter)
+        self.counter += 1
+        self.sessions.append(session)
+        self._allocate(transaction)
+        return session
+
+    def leave(self, session):
+        "ends session (session.energy is final energy of battery)"
+        self._advance()
+        self.sessions.remove(session)
+        self._allocate()
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+
+import sys
+import math
+import random
+import numpy as np
+from SimPy.Simulation import Process, hold, passivate
+from UrlUtil import xmlLoader, XmlSource
+from XValue import number, distributionParams, InvalidXMLException
+from Collector import Collector
+from Entity import Measure
+from TimeUtil import dtstr
+from Actor import Actor
+import Transaction
+
+IDLE = 0     #member is advanced by cohort
+BARRIER = 1  #member is executed by individual transaction
+FINISHED = 2
+
+#vector backend of distribution elements (function (rng, n, parameters) -> array),
+#parameters are parsed by XValue.distributionParams
+vectorSamplers = {
+    "normal" : lambda rng, n, mu, sigma: rng.normal(mu, sigma, n),
+    "pnormal" : lambda rng, n, mu, sigma: np.maximum(rng.normal(mu, sigma, n), 0.0),
+    "uniform" : lambda rng, n, mn, mx: rng.uniform(mn, mx, n),
+    "triangular" : lambda rng, n, low, high, mode: rng.triangular(low, mode, high, n),
+    "beta" : lambda rng, n, alpha, beta: rng.beta(alpha, beta, n),
+    "gamma" : lambda rng, n, alpha, beta: rng.gamma(alpha, beta, n),
+    "lognormal" : lambda rng, n, mu, sigma: rng.lognormal(mu, sigma, n),
+    "vonmises" : lambda rng, n, mu, kappa: np.mod(rng.vonmises(mu, kappa, n), 2 * math.pi),
+    "pareto" : lambda rng, n, alpha: rng.pareto(alpha, n) + 1.0,
+    "weibull" : lambda rng, n, alpha, beta: alpha * rng.weibull(beta, n),
+    "exponential" : lambda rng, n, lamda: rng.exponential(1.0 / lamda, n)
+}
+
+def sampler(subNode):
+    "vectorised generator of distribution element, function (rng, n) -> array"
+    params = distributionParams(subNode)
+    sample = vectorSamplers[subNode.tag]
+    return lambda rng, n: sample(rng, n, *params)
+
+class ArrayValue:
+    """
+    X-value of element (number, $parameter or distribution) evaluated for array of members.
+    Random values of entity context are drawn for every visit, values of transaction
+    and actor context once per member and values of simulation context once per cohort.
+    """
+    def __init__(self, cohort, xmlSource, tag, default = None):
+        self.cohort = cohort
+        self.constant = None
+        self.parameter = None
+        self.sampler = None
+        self.cache = None
+        node = xmlSource.findNode(tag)
+        if node is None:
+            if default is None:
+                raise InvalidXMLException("undefined attribute {0}".format(tag))
+            self.constant = float(default)
+            return
+        self.context = node.get("context", "entity")
+        subNode = node.find("*")
+        if subNode is not None:
+            self.sampler = sampler(subNode)
+        elif node.text.strip().startswith("$"):
+            self.parameter = cohort.simulation.getParameter(node.text.strip()[1:])
+        else:
+            self.constant = number(node.text)
+
+    def __call__(self, members):
+        n = len(members)
+        if self.constant is not None:
+            return np.full(n, self.constant)
+        if self.parameter is not None:
+            return np.full(n, float(self.parameter))
+        rng = self.cohort.rng
+        if self.context == "entity":
+            return self.sampler(rng, n)
+        if self.context == "simulation":
+            if self.cache is None:
+                self.cache = float(self.sampler(rng, 1)[0])
+            return np.full(n, self.cache)
+        if self.cache is None or len(self.cache) < self.cohort.size:
+            cache = np.full(len(self.cohort.clock), np.nan)
+            if self.cache is not None:
+                cache[:len(self.cache)] = self.cache
+            self.cache = cache
+        values = self.cache[members]
+        missing = np.isnan(values)
+        if missing.any():
+            values[missing] = self.sampler(rng, int(missing.sum()))
+            self.cache[members[missing]] = values[missing]
+        return values
+
+class Instruction:
+    "instruction of cohort program, execute processes members with the same program counter"
+    def __init__(self, cohort):
+        self.cohort = cohort
+
+    def execute(self, members):
+        raise NotImplementedError("Abstract method")
+
+class Jump(Instruction):
+    def __init__(self, cohort, target = None):
+        super().__init__(cohort)
+        self.target = target
+
+    def execute(self, members):
+        self.cohort.pc[members] = self.target
+
+class Branch(Instruction):
+    "with probability (members continue by next instruction or jump to elsePc)"
+    def __init__(self, cohort, probability):
+        super().__init__(cohort)
+        self.probability = probability
+        self.elsePc = None
+
+    def execute(self, members):
+        test = self.cohort.rng.random(len(members)) < self.probability(members)
+        self.cohort.pc[members] = np.where(test, self.cohort.pc[members] + 1, self.elsePc)
+
+class LoopStart(Instruction):
+    "start of counted loop (number of iterations is evaluated once per entry)"
+    def __init__(self, cohort, slot, count):
+        super().__init__(cohort)
+        self.slot = slot
+        self.count = count
+
+    def execute(self, members):
+        counter, limit = self.cohort.counters[self.slot]
+        counter[members] = 0
+        limit[members] = self.count(members)
+        self.cohort.pc[members] += 1
+
+class LoopTest(Instruction):
+    def __init__(self, cohort, slot):
+        super().__init__(cohort)
+        self.slot = slot
+        self.exitPc = None
+
+    def execute(self, members):
+        counter, limit = self.cohort.counters[self.slot]
+        test = counter[members] < limit[members]
+        counter[members[test]] += 1
+        self.cohort.pc[members] = np.where(test, self.cohort.pc[members] + 1, self.exitPc)
+
+class End(Instruction):
+    def execute(self, members):
+        cohort = self.cohort
+        cohort.state[members] = FINISHED
+        cohort.idle -= len(members)
+        for member in members.tolist():
+            cohort.simulation.unregisterActor(cohort.actors[member])
+            cohort.actors[member] = None
+
+class Barrier(Instruction):
+    """
+    Entities which are not vectorised (shared resources, unsupported control entities).
+    Every member is executed by its own transaction (see CohortTransaction) started
+    at clock of member, the member returns to cohort after the transaction.
+    """
+    def __init__(self, cohort):
+        super().__init__(cohort)
+        self.nodes = [] #(node, base) of entities
+
+    def execute(self, members):
+        cohort = self.cohort
+        cohort.state[members] = BARRIER
+        cohort.idle -= len(members)
+        now = cohort.simulation.now()
+        for member, clock in zip(members.tolist(), cohort.clock[members].tolist()):
+            t = CohortTransaction(cohort, member, self)
+            cohort.simulation.activate(t, t.run(), at=max(clock, now))
+
+class Kernel(Instruction):
+    """
+    Vectorised entity: run(members) advances clocks of members and returns dictionary
+    of arrays of output properties (see outputs). Outputs are kept per member only
+    if the entity is refered by checkpoint.
+    """
+    outputs = ()
+    def __init__(self, cohort, xmlSource):
+        super().__init__(cohort)
+        self.values = None #output name -> array of values of members
+
+    @staticmethod
+    def supports(xmlSource):
+        return True
+
+    def run(self, members):
+        raise NotImplementedError("Abstract method")
+
+    def keepOutputs(self):
+        self.values = {name : np.zeros(len(self.cohort.clock)) for name in self.outputs}
+
+    def execute(self, members):
+        outputs = self.run(members)
+        if self.values is not None:
+            for name, values in outputs.items():
+                if len(self.values[name]) < self.cohort.size:
+                    grown = np.zeros(len(self.cohort.clock))
+                    grown[:len(self.values[name])] = self.values[name]
+                    self.values[name] = grown
+                self.values[name][members] = values
+        self.cohort.pc[members] += 1
+
+class PauseKernel(Kernel):
+    entityTag = "pause"
+    def __init__(self, cohort, xmlSource):
+        super().__init__(cohort, xmlSource)
+        self.duration = cohort.value(xmlSource, "duration")
+
+    def run(self, members):
+        self.cohort.clock[members] += self.duration(members)
+        return {}
+
+class PauseToKernel(Kernel):
+    "pause_to with (default) epoch s.t"
+    entityTag = "pause_to"
+    def __init__(self, cohort, xmlSource):
+        super().__init__(cohort, xmlSource)
+        self.period = xmlSource.get("period", None)
+        if self.period is not None:
+            self.period = number(self.period)
+        self.time = cohort.value(xmlSource, "time")
+
+    @staticmethod
+    def supports(xmlSource):
+        return xmlSource.get("epoch", "s.t") == "s.t"
+
+    def durations(self, members):
+        ptime = self.time(members)
+        atime = self.cohort.clock[members] + self.cohort.simulation.startTime
+        if self.period is not None:
+            start = np.floor(atime / self.period) * self.period
+            start = np.where(ptime < atime - start, start + self.period, start)
+            ptime = start + ptime
+        return np.maximum(ptime - atime, 0.0)
+
+    def run(self, members):
+        self.cohort.clock[members] += self.durations(members)
+        return {}
+
+class SetKernel(Kernel):
+    "set of actor property"
+    entityTag = "set"
+    def __init__(self, cohort, xmlSource):
+        super().__init__(cohort, xmlSource)
+        self.name = xmlSource.get("property").split(".")[1]
+        self.value = cohort.value(xmlSource, "value")
+
+    @staticmethod
+    def supports(xmlSource):
+        return xmlSource.get("property", "").startswith("a.")
+
+    def run(self, members):
+        self.cohort.set(self.name, members, self.value(members))
+        return {}
+
+class CheckpointKernel(Kernel):
+    """
+    Checkpoint collecting actor properties (a.*), output properties of refered kernel (e.*)
+    and transaction id (t.id, id of member). Values are collected when simulation time
+    reaches clock of member (at most epoch ahead).
+    """
+    entityTag = "checkpoint"
+    def __init__(self, cohort, xmlSource, referedEntity = None):
+        super().__init__(cohort, xmlSource)
+        self.measures = [Measure(node) for node in xmlSource]
+        self.referedEntity = referedEntity
+        outputs = referedEntity.outputs if referedEntity is not None else ()
+        if not CheckpointKernel.supports(xmlSource, outputs):
+            raise InvalidXMLException("checkpoint {0} is not supported in cohort mode"
+                                      .format(xmlSource.commonId))
+        if referedEntity is not None:
+            referedEntity.keepOutputs()
+
+    @staticmethod
+    def supports(xmlSource, outputs = ()):
+        for node in xmlSource:
+            for spec in (node.get("property"), node.get("key")):
+                if spec is None or spec.startswith("a.") or spec == "t.id":
+                    continue
+                if not (spec.startswith("e.") and spec[2:] in outputs):
+                    return False
+        return True
+
+    def get(self, prop, members):
+        if prop.locator == "a":
+            return self.cohort.get(prop.propName, members)
+        if prop.locator == "t":
+            return self.cohort.tids[members]
+        return self.referedEntity.values[prop.propName][members]
+
+    def run(self, members):
+        simulation = self.cohort.simulation
+        for measure in self.measures:
+            values = self.get(measure.property, members).tolist()
+            keys = (self.get(measure.key, members).tolist()
+                        if measure.key is not None else [None] * len(values))
+            if measure.kind == Collector.LOG:
+                if simulation.logging:
+                    for clock, value, key in zip(self.cohort.clock[members].tolist(), values, keys):
+                        keystr = "({0})".format(key) if key is not None else ""
+                        print("{0}: {1} {2}={3} {4}".format(dtstr(clock + simulation.startTime),
+                                                            measure.category, measure.propSpec,
+                                                            value, keystr),
+                              file=sys.stderr)
+            else:
+                for value, key in zip(values, keys):
+                    simulation.collector.collect(measure.category, value, measure.kind, key)
+        return {}
+
+kernels = {} #vectorised entities (tag -> subclass of Kernel)
+
+def registerKernel(cls):
+    kernels[cls.entityTag] = cls
+
+def registerModule(module):
+    "registers kernels of module (subclasses of Kernel with attribute entityTag)"
+    for cls in module.__dict__.values():
+        if isinstance(cls, type) and issubclass(cls, Kernel) and hasattr(cls, "entityTag"):
+            registerKernel(cls)
+
+registerModule(sys.modules[__name__])
+
+class CohortTransaction(Transaction.Transaction):
+    "individual execution of entities of barrier by member of cohort (with actor of member)"
+    def __init__(self, cohort, member, barrier):
+        super().__init__(cohort.transactionNode, cohort.simulation, tid=cohort.tids[member],
+                         entitiesXmlNode=cohort.entitiesNode, actor=cohort.actors[member],
+                         entities=[])
+        self.cohort = cohort
+        self.member = member
+        factory = Transaction.EntityFactory(self.entitiesXmlNode)
+        self.entities = Transaction.linkReferedEntities(
+                            [factory.createFromXml(node, self, base) for node, base in barrier.nodes])
+
+    def run(self):
+        yield from super().run()
+        self.cohort.resume(self.member)
+
+class Cohort(Process):
+    """
+    Cohort execution of top level transactions of one template (see Simulation.enableCohorts).
+    The template is compiled to flat program of vectorised entities (kernels, see
+    registerModule) and barriers. Members of cohort (cars) with the same program counter
+    are advanced together as NumPy arrays, every member has own clock and actor (row
+    of shared ActorStore). Cohort process wakes up every epoch and advances members until
+    their clocks reach the next wake up time, so members never run behind simulation time.
+    Member which reaches barrier (entity with shared object) is executed by individual
+    transaction at its clock and it returns to cohort after the transaction.
+
+    Approximations: kernels use own NumPy random stream, values of vectorised checkpoints
+    are collected up to one epoch ahead of simulation time and exceptions (incl. exit)
+    raised in barriers end only the barrier transaction, not the member.
+    """
+    def __init__(self, simulation, transactionNode, entitiesNode, epoch = 3600.0):
+        super().__init__(sim=simulation)
+        self.simulation = simulation
+        self.transactionNode = transactionNode
+        self.entitiesNode = entitiesNode
+        self.epoch = float(epoch)
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        path, base = transactionNode.getWithBase("actor")
+        self.actorSource = xmlLoader(path, base=base) if path is not None else None
+        entities = XmlSource([entitiesNode])
+        path, base = transactionNode.getWithBase("entities")
+        if path is not None:
+            entities.append(xmlLoader(path, base=base))
+        self.factory = Transaction.EntityFactory(entities)
+        self.size = 0
+        self.clock = np.zeros(64)
+        self.pc = np.zeros(64, dtype=np.int64)
+        self.state = np.full(64, FINISHED, dtype=np.int8)
+        self.tids = np.zeros(64, dtype=np.int64)
+        self.rows = np.zeros(64, dtype=np.int64)
+        self.counters = []
+        self.program = []
+        self.last = None #instruction of previous entity (target of referedEntity="prev")
+        self.compile(transactionNode)
+        self.program.append(End(self))
+        self.actors = []
+        self.store = None
+        self.pending = []
+        self.idle = 0 #number of members advanced by cohort
+        self.tick = simulation.now() #time of the next regular wake up
+        self.wakeup = None #time of scheduled wake up (None = passive)
+
+    def value(self, xmlSource, tag, default = None):
+        return ArrayValue(self, xmlSource, tag, default)
+
+    def compile(self, xmlSource, skip = ()):
+        for node, base in xmlSource.iterWithBased():
+            if node.tag not in skip:
+                self.compileNode(node, base)
+
+    def barrier(self, node, base):
+        if not isinstance(self.last, Barrier):
+            self.last = Barrier(self)
+            self.program.append(self.last)
+        self.last.nodes.append((node, base))
+
+    def compileNode(self, node, base):
+        source = self.factory.entitySource(node, base)
+        tag = node.tag
+        if tag == "checkpoint" and source.get("referedEntity") is not None:
+            if source.get("referedEntity") != "prev":
+                raise InvalidXMLException("only checkpoints refering to previous entity are supported in cohort mode")
+            if isinstance(self.last, Barrier):
+                self.last.nodes.append((node, base))
+            elif isinstance(self.last, Kernel):
+                self.last = CheckpointKernel(self, source, self.last)
+                self.program.append(self.last)
+            else:
+                raise InvalidXMLException("Invalid referention to refered entity [checkpoint]")
+        elif tag in ("transaction", "block") and source.get("entityUrl") is None:
+            path, pathBase = source.getWithBase("transactionUrl")
+            self.last = None
+            self.compile(xmlLoader(path, base=pathBase) if path is not None else source)
+        elif tag == "infinity_loop" and source.get("restart") is None:
+            self.last = None
+            start = len(self.program)
+            self.compile(source)
+            self.program.append(Jump(self, start))
+            self.last = None
+        elif tag == "counted_loop" and source.get("restart") is None:
+            self.last = None
+            slot = len(self.counters)
+            self.counters.append((np.zeros(64, dtype=np.int64), np.zeros(64)))
+            self.program.append(LoopStart(self, slot, self.value(source, "count")))
+            test = LoopTest(self, slot)
+            self.program.append(test)
+            self.compile(source, ("count",))
+            self.program.append(Jump(self, self.program.index(test)))
+            test.exitPc = len(self.program)
+            self.last = None
+        elif tag == "with":
+            self.last = None
+            branch = Branch(self, self.value(source, "probability"))
+            self.program.append(branch)
+            sections = [(child, childBase) for child, childBase in source.iterWithBased()
+                            if child.tag != "probability"]
+            self.compileNode(*sections[0])
+            if len(sections) == 2:
+                jump = Jump(self)
+                self.program.append(jump)
+                branch.elsePc = len(self.program)
+                self.last = None
+                self.compileNode(*sections[1])
+                jump.target = len(self.program)
+            else:
+                branch.elsePc = len(self.program)
+            self.last = None
+        elif tag in kernels and kernels[tag].supports(source):
+            self.last = kernels[tag](self, source)
+            self.program.append(self.last)
+        else:
+            self.barrier(node, base)
+
+    def _grow(self):
+        capacity = 2 * len(self.clock)
+        for name, fill in (("clock", 0.0), ("pc", 0), ("state", FINISHED), ("tids", 0),
+                           ("rows", 0)):
+            array = getattr(self, name)
+            grown = np.full(capacity, fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+        for i, (counter, limit) in enumerate(self.counters):
+            self.counters[i] = (np.concatenate((counter, np.zeros_like(counter))),
+                                np.concatenate((limit, np.zeros_like(limit))))
+
+    def add(self):
+        "new member (new top level transaction) starting at current time, returns its index"
+        member = self.size
+        if member >= len(self.clock):
+            self._grow()
+        if self.actorSource is not None:
+            actor = Actor(self.simulation, self.actorSource, extraProperties=True)
+        else:
+            actor = Actor(self.simulation, XmlSource())
+        self.store = actor.props.store
+        self.actors.append(actor)
+        self.rows[member] = actor.props.row
+        self.tids[member] = self.simulation.getTId()
+        self.clock[member] = self.simulation.now()
+        self.pc[member] = 0
+        self.state[member] = IDLE
+        self.idle += 1
+        self.size += 1
+        self.pending.append(member)
+        self.wake()
+        return member
+
+    def resume(self, member):
+        "return of member from barrier (at current time)"
+        self.clock[member] = self.simulation.now()
+        self.pc[member] += 1
+        self.state[member] = IDLE
+        self.idle += 1
+        self.pending.append(member)
+        self.wake()
+
+    def wake(self):
+        now = self.simulation.now()
+        if self.wakeup != now:
+            self.wakeup = now
+            self.simulation.reactivate(self, at=now)
+
+    def get(self, name, members):
+        "values of actor property of members"
+        column = self.store.columns.get(name)
+        if column is None: #undeclared or time dependent property
+            return np.array([float(self.actors[member].props[name]) for member in members.tolist()])
+        return self.store.data[self.rows[members], column]
+
+    def set(self, name, members, values):
+        column = self.store.columns.get(name)
+        if column is None:
+            for member, value in zip(members.tolist(), np.broadcast_to(values, members.shape).tolist()):
+                self.actors[member].props[name] = value
+        else:
+            self.store.data[self.rows[members], column] = values
+
+    def advance(self, members):
+        "executes instructions of members until barrier, end or the next wake up"
+        while len(members):
+            members = members[(self.state[members] == IDLE) & (self.clock[members] < self.tick)]
+            if not len(members):
+                break
+            pcs = self.pc[members]
+            if len(members) == 1 or pcs.min() == pcs.max(): #typical for flushed members
+                self.program[int(pcs[0])].execute(members)
+                continue
+            order = np.argsort(pcs, kind="stable")
+            members, pcs = members[order], pcs[order]
+            starts = np.flatnonzero(pcs[1:] != pcs[:-1]) + 1
+            for start, end in zip([0] + starts.tolist(), starts.tolist() + [len(members)]):
+                self.program[int(pcs[start])].execute(members[start:end])
+
+    def run(self):
+        while True:
+            now = self.simulation.now()
+            if now >= self.tick:
+                self.tick = now + self.epoch
+                members = np.flatnonzero(self.state[:self.size] == IDLE)
+            else:
+                members = np.array(self.pending, dtype=np.int64)
+            self.pending = []
+            self.advance(members)
+            if self.idle > 0:
+                self.wakeup = self.tick
+                yield hold, self, self.tick - now
+            else:
+                self.wakeup = None
+                yield passivate, self
+
+    @property
+    def live(self):
+        "number of unfinished members"
+        return int(np.count_nonzero(self.state[:self.size] != FINISHED))
@@ -1,6 +1,68 @@
 #!/usr/bin/env python3
 import collections
-from math import sqrt
+import copy
+from math import sqrt, ceil, floor, atan, sin, cos, pi
+from statistics import NormalDist
+import numpy as np
+
+try:
+    from scipy.stats import t as studentT
+except ImportError:
+    studentT = None
+
+def tDistribution(x, df):
+    "cumulative distribution function of Student's t-distribution with integral df (exact)"
+    theta = atan(x / sqrt(df))
+    c2 = cos(theta)**2
+    term, total = 1.0, 1.0
+    if df % 2 == 1:
+        for k in range(1, (df - 1) // 2):
+            term *= 2 * k / (2 * k + 1) * c2
+            total += term
+        a = 2 / pi * (theta + (sin(theta) * cos(theta) * total if df > 1 else 0.0))
+    else:
+        for k in range(1, df // 2):
+            term *= (2 * k - 1) / (2 * k) * c2
+            total += term
+        a = sin(theta) * total
+    return 0.5 + a / 2
+
+def tQuantile(p, df):
+    """
+    quantile of Student's t-distribution (without scipy: inversion of exact distribution
+    function for df <= 30, Cornish-Fisher approximation for higher df)
+    """
+    if studentT is not None:
+        return float(studentT.ppf(p, df))
+    if df <= 30 and df == int(df):
+        df = int(df)
+        low, high = -1.0, 1.0
+        while tDistribution(low, df) > p:
+            low *= 2
+        while tDistribution(high, df) < p:
+            high *= 2
+        for i in range(100): #bisection
+            middle = (low + high) / 2
+            if tDistribution(middle, df) < p:
+                low = middle
+            else:
+                high = middle
+        return (low + high) / 2
+    z = NormalDist().inv_cdf(p)
+    return (z + (z**3 + z) / (4 * df) + (5*z**5 + 16*z**3 + 3*z) / (96 * df**2)
+              + (3*z**7 + 19*z**5 + 17*z**3 - 15*z) / (384 * df**3))
+
+def confidenceInterval(values, level = 0.95):
+    "returns (mean, half-width) of confidence interval of mean of independent values"
+    values = [float(value) for value in values]
+    n = len(values)
+    if n == 0:
+        return (float('nan'), float('inf'))
+    mean = sum(values) / n
+    if n < 2:
+        return (mean, float('inf'))
+    variance = sum((value - mean)**2 for value in values) / (n - 1)
+    return (mean, tQuantile(0.5 + level / 2, n - 1) * sqrt(variance / n))
 
 class Statistics:
     def __init__(self):
@@ -35,17 +97,272 @@ class Statistics:
     def sum(self):
         return self.s1
 
+    def reset(self):
+        self.__init__()
+
+    def merge(self, other):
+        self.s0 += other.s0
+        self.s1 += other.s1
+        self.s2 += other.s2
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        return self
+
     def __str__(self):
         return "count: {0.count}, mean: {0.mean} stddev:{0.standardDeviation}, min: {0.min}, {0.max}".format(self)
 
+class LoadCurve:
+    """
+    Aggregate power (or any other rate) of overlapping intervals over a fixed time grid.
+    Every interval is recorded in O(1) into a difference array (partially covered grid
+    steps get only their covered fraction), the curve is obtained by one cumulative sum.
+
+    Attributes:
+        step -- length of grid step (sec)
+        start -- simulation time of the beginning of grid
+        size -- number of grid steps
+    """
+    def __init__(self, step, horizon, start = 0.0):
+        self.step = float(step)
+        self.start = float(start)
+        self.size = int(ceil(float(horizon) / self.step))
+        self.diff = np.zeros(self.size + 2)
+        self.count = 0
+        self._curve = None
+
+    def _add(self, position, value):
+        self.diff[position] += value
+        self.diff[position + 1] -= value
+
+    def add(self, start, end, power):
+        "adds interval <start, end) with constant power"
+        i0 = min(max((float(start) - self.start) / self.step, 0.0), self.size)
+        i1 = min(max((float(end) - self.start) / self.step, 0.0), self.size)
+        self.count += 1
+        if i1 <= i0:
+            return
+        self._curve = None
+        power = float(power)
+        b0, b1 = int(floor(i0)), int(floor(i1))
+        if b0 == b1:
+            self._add(b0, power * (i1 - i0))
+            return
+        self._add(b0, power * (b0 + 1 - i0)) #partial first step
+        self.diff[b0 + 1] += power           #fully covered steps
+        self.diff[b1] -= power
+        self._add(b1, power * (i1 - b1))     #partial last step
+
+    @property
+    def curve(self):
+        "mean power in grid steps"
+        if self._curve is None:
+            self._curve = np.cumsum(self.diff)[:self.size]
+        return self._curve
+
+    @property
+    def times(self):
+        "start times of grid steps"
+        return self.start + self.step * np.arange(self.size)
+
+    @property
+    def peak(self):
+        return float(self.curve.max()) if self.size > 0 else 0.0
+
+    @property
+    def mean(self):
+        return float(self.curve.mean()) if self.size > 0 else 0.0
+
+    @property
+    def energy(self):
+        "integral of curve (power * sec)"
+        return float(self.curve.sum() * self.step)
+
+    def percentile(self, q):
+        return float(np.percentile(self.curve, q))
+
+    def reset(self):
+        self.diff[:] = 0.0
+        self.count = 0
+        self._curve = None
+
+    def merge(self, other):
+        "sums other load curve with the same grid"
+        if (other.step, other.start, other.size) != (self.step, self.start, self.size):
+            raise ValueError("load curves with different grids")
+        self.diff += other.diff
+        self.count += other.count
+        self._curve = None
+        return self
+
+    def __str__(self):
+        return "count: {0.count}, mean: {0.mean}, peak: {0.peak}, p95: {1}".format(
+                    self, self.percentile(95))
+
+class BatchMeans:
+    """
+    Batches of observations of one stat category of a single long run. Batches are
+    defined by number of observations (batchSize) or by simulation time (batchLength).
+    Batch values (means or sums of batches) are approximately independent if batches
+    are long enough (see correlation), their variance gives confidence interval.
+
+    Attributes:
+        key -- only observations with this key are recorded (None = unkeyed category)
+        start -- simulation time of beginning of the first batch
+        batches -- list of Statistics of batches
+    """
+    def __init__(self, batchSize = None, batchLength = None, key = None, start = 0.0):
+        if (batchSize is None) == (batchLength is None):
+            raise RuntimeError("either batch size or batch length must be specified")
+        self.batchSize = batchSize
+        self.batchLength = float(batchLength) if batchLength is not None else None
+        self.key = key
+        self.reset(start)
+
+    def reset(self, start = 0.0):
+        self.start = float(start)
+        self.batches = []
+        self.observations = 0
+
+    def update(self, v, time):
+        if self.batchSize is not None:
+            index = self.observations // self.batchSize
+        else:
+            index = int((time - self.start) // self.batchLength)
+        while len(self.batches) <= index:
+            self.batches.append(Statistics())
+        self.batches[index].update(v)
+        self.observations += 1
+
+    def completed(self):
+        "statistics of completed (nonempty) batches, the last batch is still open"
+        return [batch for batch in self.batches[:-1] if batch.count > 0]
+
+    def values(self, attribute = "mean"):
+        return [getattr(batch, attribute) for batch in self.completed()]
+
+    def correlation(self, attribute = "mean", lag = 1):
+        "lag autocorrelation of batch values"
+        values = np.array(self.values(attribute))
+        if len(values) <= lag + 1:
+            return float('nan')
+        deviations = values - values.mean()
+        denominator = float(np.dot(deviations, deviations))
+        if denominator == 0.0:
+            return 0.0
+        return float(np.dot(deviations[:-lag], deviations[lag:])) / denominator
+
+    def confidenceInterval(self, attribute = "mean", level = 0.95):
+        "(mean, half-width) of confidence interval of batch values"
+        return confidenceInterval(self.values(attribute), level)
+
+    def coarsen(self):
+        "merges pairs of adjacent batches (doubles batch size or length)"
+        self.batches = [self.batches[i].merge(self.batches[i + 1])
+                           if i + 1 < len(self.batches) else self.batches[i]
+                           for i in range(0, len(self.batches), 2)]
+        if self.batchSize is not None:
+            self.batchSize *= 2
+        else:
+            self.batchLength *= 2
+
+    def __str__(self):
+        mean, halfWidth = self.confidenceInterval()
+        return "batches: {0}, mean: {1} +- {2}, correlation: {3}".format(
+                    len(self.completed()), mean, halfWidth, self.correlation())
+
 class Collector:
     STAT=0
     COUNTER=1
     LIST=2
     LOG=3
     types = ["stat", "counter", "list", "log"]
-    def __init__(self):
+    def __init__(self, clock = None):
         self.categories = dict()
+        self.replications = [] #snapshots of replications (only for merged collectors)
+        self.batchMeans = dict() #batch means of stat categories (category -> BatchMeans)
+        self.clock = clock #function returning current simulation time
+
+    def snapshot(self):
+        "compact (picklable) copy of collected data (simulation bound categories are skipped)"
+        snapshot = Collector()
+        for category, container in self.categories.items():
+            if isinstance(container, (Statistics, LoadCurve, collections.Counter, list, dict)):
+                snapshot.categories[category] = copy.deepcopy(container)
+        snapshot.batchMeans = copy.deepcopy(self.batchMeans)
+        return snapshot
+
+    def reset(self, time = 0.0):
+        "discards all collected data (warm-up deletion), batches start at time"
+        for container in self.categories.values():
+            if isinstance(container, (Statistics, LoadCurve)):
+                container.reset()
+            elif isinstance(container, (collections.Counter, list, dict)):
+                container.clear()
+        for batchMeans in self.batchMeans.values():
+            batchMeans.reset(time)
+
+    def addBatchMeans(self, category, batchSize = None, batchLength = None, key = None):
+        start = self.clock() if self.clock is not None else 0.0
+        self.batchMeans[category] = BatchMeans(batchSize, batchLength, key, start)
+        return self.batchMeans[category]
+
+    @staticmethod
+    def _mergeContainers(container, other):
+        if isinstance(container, (Statistics, LoadCurve)):
+            return container.merge(other)
+        if isinstance(container, collections.Counter):
+            container.update(other)
+        elif isinstance(container, list):
+            container.extend(other)
+        elif isinstance(container, dict):
+            for key, value in other.items():
+                container[key] = (Collector._mergeContainers(container[key], value)
+                                    if key in container else copy.deepcopy(value))
+        return container
+
+    @staticmethod
+    def merge(snapshots):
+        """
+        Merges snapshots of (independent) replications to one collector (pooled
+        observations). Snapshots are kept for confidence intervals across replications.
+        """
+        merged = Collector()
+        for snapshot in snapshots:
+            merged.replications.append(snapshot)
+            for category, container in snapshot.categories.items():
+                if category in merged.categories:
+                    Collector._mergeContainers(merged.categories[category], container)
+                else:
+                    merged.categories[category] = copy.deepcopy(container)
+        return merged
+
+    def confidenceInterval(self, category, attribute = "mean", level = 0.95):
+        """
+        Confidence interval of value of category across replications (mean, half-width).
+        The value is given by attribute name of container or by function of container.
+        """
+        getter = attribute if callable(attribute) else (
+                    lambda container: getattr(container, attribute))
+        return confidenceInterval([getter(replication.categories[category])
+                                   for replication in self.replications
+                                   if category in replication.categories], level)
+
+    def confidenceIntervals(self, level = 0.95):
+        "confidence intervals of means of all stat categories"
+        return {category : self.confidenceInterval(category, "mean", level)
+                    for category, container in self.categories.items()
+                    if isinstance(container, Statistics)}
+
+    def addLoadCurve(self, category, step, horizon, start = 0.0):
+        self.categories[category] = LoadCurve(step, horizon, start)
+        return self.categories[category]
+
+    def collectInterval(self, category, start, end, power):
+        if not isinstance(self.categories.get(category), LoadCurve):
+            raise KeyError("undeclared load curve {0}".format(category))
+        self.categories[category].add(start, end, power)
         
     def collect(self, category, prop, kind, key):
         if not category in self.categories:
@@ -54,6 +371,9 @@ class Collector:
             else:
                 self.categories[category] = Collector._newContainer(kind)
         self._set(category, prop, kind, key)
+        batchMeans = self.batchMeans.get(category)
+        if batchMeans is not None and kind == Collector.STAT and key == batchMeans.key:
+            batchMeans.update(float(prop), self.clock() if self.clock is not None else 0.0)
         
     @staticmethod    
     def _newContainer(kind):
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import heapq
+import hashlib
+import numpy as np
+
+ARRAYS = ("rank", "upIndptr", "upTargets", "upWeights", "upMiddle",
+          "downIndptr", "downSources", "downWeights", "downMiddle")
+
+def fileDigest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _witness(out, source, excluded, limit, maxSettled):
+    "distances from source in remaining graph without excluded node (limited search)"
+    distance = {source : 0.0}
+    heap = [(0.0, source)]
+    settled = 0
+    while heap and settled < maxSettled:
+        d, node = heapq.heappop(heap)
+        if d > distance.get(node, float('inf')):
+            continue
+        if d > limit:
+            break
+        settled += 1
+        for target, w in out[node].items():
+            if target == excluded:
+                continue
+            alt = d + w
+            if alt < distance.get(target, float('inf')):
+                distance[target] = alt
+                heapq.heappush(heap, (alt, target))
+    return distance
+
+def _shortcuts(out, inc, node, maxSettled):
+    "shortcuts (source, target, weight) needed after contraction of node"
+    shortcuts = []
+    for source, w1 in inc[node].items():
+        if not out[node]:
+            break
+        limit = w1 + max(out[node].values())
+        distance = _witness(out, source, node, limit, maxSettled)
+        for target, w2 in out[node].items():
+            if target != source and distance.get(target, float('inf')) > w1 + w2:
+                shortcuts.append((source, target, w1 + w2))
+    return shortcuts
+
+def _csr(size, keys, others, weights, middles):
+    order = np.argsort(np.asarray(keys, dtype=np.int64), kind="stable")
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np.asarray(keys, dtype=np.int64), minlength=size), out=indptr[1:])
+    return (indptr, np.asarray(others, dtype=np.int64)[order],
+            np.asarray(weights, dtype=np.float64)[order], np.asarray(middles, dtype=np.int64)[order])
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy of CompiledGraph for one weight attribute. Nodes are contracted
+    in order of edge difference (with lazy updates), shortcuts keep shortest distances
+    among remaining nodes. Point to point queries are bidirectional Dijkstra searches
+    in upward graph (from source) and downward graph (to target) with stall on demand,
+    which settle only small part of nodes.
+
+    Index is saved as directory of .npy files (memory mapped on load) with meta.json
+    (digest of graph file, the index is rebuilt if the file is changed).
+    """
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self._lists = None
+
+    @staticmethod
+    def build(graph, attr, maxSettled = 500, estimateSettled = 30):
+        n = len(graph)
+        out = [dict() for i in range(n)]
+        inc = [dict() for i in range(n)]
+        middle = {}
+        weights = graph.weights[attr]
+        for source in range(n):
+            for i in range(graph.indptr[source], graph.indptr[source + 1]):
+                target, w = int(graph.targets[i]), float(weights[i])
+                if target != source and w < out[source].get(target, float('inf')):
+                    out[source][target] = w
+                    inc[target][source] = w
+        contractedNeighbours = [0] * n
+        level = [0] * n #depth in hierarchy (keeps contraction uniform)
+
+        def priority(node):
+            shortcuts = len(_shortcuts(out, inc, node, estimateSettled))
+            return (2 * (shortcuts - len(out[node]) - len(inc[node]))
+                        + contractedNeighbours[node] + level[node])
+
+        heap = [(priority(node), node) for node in range(n)]
+        heapq.heapify(heap)
+        rank = np.zeros(n, dtype=np.int64)
+        up = ([], [], [], [])   #source, target, weight, middle
+        down = ([], [], [], []) #target, source, weight, middle
+        order = 0
+        while heap:
+            p, node = heapq.heappop(heap)
+            current = priority(node)
+            if heap and current > heap[0][0]: #lazy update
+                heapq.heappush(heap, (current, node))
+                continue
+            rank[node] = order
+            order += 1
+            for target, w in out[node].items():
+                for column, value in zip(up, (node, target, w, middle.get((node, target), -1))):
+                    column.append(value)
+            for source, w in inc[node].items():
+                for column, value in zip(down, (node, source, w, middle.get((source, node), -1))):
+                    column.append(value)
+            for source, target, w in _shortcuts(out, inc, node, maxSettled):
+                if w < out[source].get(target, float('inf')):
+                    out[source][target] = w
+                    inc[target][source] = w
+                    middle[(source, target)] = node
+            for target in out[node]:
+                del inc[target][node]
+                contractedNeighbours[target] += 1
+                level[target] = max(level[target], level[node] + 1)
+            for source in inc[node]:
+                del out[source][node]
+                contractedNeighbours[source] += 1
+                level[source] = max(level[source], level[node] + 1)
+            out[node] = {}
+            inc[node] = {}
+        arrays = dict(rank=rank)
+        (arrays["upIndptr"], arrays["upTargets"], arrays["upWeights"],
+             arrays["upMiddle"]) = _csr(n, *up)
+        (arrays["downIndptr"], arrays["downSources"], arrays["downWeights"],
+             arrays["downMiddle"]) = _csr(n, *down)
+        return ContractionHierarchy(arrays)
+
+    def save(self, directory, meta):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "wt") as f:
+            json.dump(meta, f)
+
+    @staticmethod
+    def load(directory, meta = None):
+        "memory mapped index or None (missing or built for different meta data)"
+        try:
+            with open(os.path.join(directory, "meta.json"), "rt") as f:
+                if meta is not None and json.load(f) != meta:
+                    return None
+            return ContractionHierarchy({name : np.load(os.path.join(directory, name + ".npy"),
+                                                        mmap_mode="r") for name in ARRAYS})
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def forFile(path, graph, attr):
+        "index of graph loaded from file path (stored beside the file, rebuilt on change)"
+        directory = "{0}.{1}.ch".format(path, attr)
+        meta = dict(digest=fileDigest(path), attr=attr, nodes=len(graph))
+        hierarchy = ContractionHierarchy.load(directory, meta)
+        if hierarchy is None:
+            hierarchy = ContractionHierarchy.build(graph, attr)
+            hierarchy.save(directory, meta)
+        return hierarchy
+
+    def _adjacency(self):
+        if self._lists is None:
+            self._lists = tuple(getattr(self, name).tolist() for name in ARRAYS)
+        return self._lists
+
+    def query(self, source, target):
+        "(distance, meeting node) of the shortest path (inf, -1 if unreachable)"
+        return self._search(source, target)[:2]
+
+    def _search(self, source, target):
+        (rank, upIndptr, upTargets, upWeights, upMiddle,
+             downIndptr, downSources, downWeights, downMiddle) = self._adjacency()
+        distances = ({source : 0.0}, {target : 0.0})
+        previous = ({source : -1}, {target : -1})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        adjacency = ((upIndptr, upTargets, upWeights), (downIndptr, downSources, downWeights))
+        best, meeting = float('inf'), -1
+        while heaps[0] or heaps[1]:
+            for direction in (0, 1):
+                heap = heaps[direction]
+                if not heap:
+                    continue
+                d, node = heapq.heappop(heap)
+                if d > distances[direction].get(node, float('inf')):
+                    continue
+                if d >= best:
+                    heap.clear()
+                    continue
+                other = distances[1 - direction].get(node)
+                if other is not None and d + other < best:
+                    best, meeting = d + other, node
+                indptr, others, weights = adjacency[direction]
+                distance, predecessor = distances[direction], previous[direction]
+                stallIndptr, stallOthers, stallWeights = adjacency[1 - direction]
+                if any(distance.get(stallOthers[i], float('inf')) + stallWeights[i] < d
+                          for i in range(stallIndptr[node], stallIndptr[node + 1])):
+                    continue #stall on demand (node is reached by shorter path from above)
+                for i in range(indptr[node], indptr[node + 1]):
+                    neighbour = others[i]
+                    alt = d + weights[i]
+                    if alt < distance.get(neighbour, float('inf')):
+                        distance[neighbour] = alt
+                        predecessor[neighbour] = node
+                        heapq.heappush(heap, (alt, neighbour))
+        return best, meeting, previous
+
+    def _middle(self, source, target):
+        (rank, upIndptr, upTargets, upWeights, upMiddle,
+             downIndptr, downSources, downWeights, downMiddle) = self._adjacency()
+        if rank[source] < rank[target]:
+            edges = range(upIndptr[source], upIndptr[source + 1])
+            return next(upMiddle[i] for i in edges if upTargets[i] == target)
+        edges = range(downIndptr[target], downIndptr[target + 1])
+        return next(downMiddle[i] for i in edges if downSources[i] == source)
+
+    def _unpack(self, source, target, path):
+        middle = self._middle(source, target)
+        if middle < 0:
+            path.append(target)
+        else:
+            self._unpack(source, middle, path)
+            self._unpack(middle, target, path)
+
+    def path(self, source, target):
+        "(distance, list of nodes of original graph) or (inf, [])"
+        distance, meeting, (forward, backward) = self._search(source, target)
+        if meeting < 0:
+            return float('inf'), []
+        hierarchyPath = [meeting]
+        while forward[hierarchyPath[0]] >= 0:
+            hierarchyPath.insert(0, forward[hierarchyPath[0]])
+        while backward[hierarchyPath[-1]] >= 0:
+            hierarchyPath.append(backward[hierarchyPath[-1]])
+        path = [source]
+        for u, v in zip(hierarchyPath, hierarchyPath[1:]):
+            self._unpack(u, v, path)
+        return distance, path
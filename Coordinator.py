@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import socket
+import threading
+import collections
+from multiprocessing.managers import BaseManager
+from Replication import parameterKey
+
+class Coordinator:
+    """
+    Distribution of jobs (parameter dictionaries) to remote workers. Workers lease jobs
+    in batches and must send heartbeats; jobs leased by worker without heartbeat for
+    leaseTimeout seconds are returned to the queue. Results are returned in batches
+    and written to resumable store (see Sweep.ResultStore), already stored jobs
+    are not distributed again. coordinatorTest.py tests it with local worker processes.
+
+    Attributes:
+        maxAttempts -- maximal number of leases of one job (repeatedly failing jobs are
+                       given up, they are retried only after restart)
+    """
+    def __init__(self, jobs, store, leaseTimeout = 60.0, maxAttempts = 3):
+        self.store = store
+        self.leaseTimeout = leaseTimeout
+        self.maxAttempts = maxAttempts
+        self.jobs = {}
+        for params in jobs:
+            key = parameterKey(params)
+            if key not in store:
+                self.jobs[key] = params
+        self.queue = collections.deque(self.jobs)
+        self.leases = {} #job key -> worker id
+        self.attempts = collections.Counter()
+        self.failed = set()
+        self.workers = {} #worker id -> time of last heartbeat
+        self.lock = threading.Lock()
+
+    def _expire(self):
+        deadline = time.time() - self.leaseTimeout
+        dead = {worker for worker, last in self.workers.items() if last < deadline}
+        for key, worker in list(self.leases.items()):
+            if worker in dead:
+                del self.leases[key]
+                if self.attempts[key] >= self.maxAttempts:
+                    self.failed.add(key)
+                else:
+                    self.queue.appendleft(key)
+        for worker in dead:
+            del self.workers[worker]
+
+    def expire(self):
+        "returns jobs of dead workers to the queue"
+        with self.lock:
+            self._expire()
+
+    def lease(self, worker, count = 1):
+        "leases at most count jobs to worker, returns list of (key, params)"
+        with self.lock:
+            self.workers[worker] = time.time()
+            self._expire()
+            jobs = []
+            while self.queue and len(jobs) < count:
+                key = self.queue.popleft()
+                if key in self.store:
+                    continue
+                self.leases[key] = worker
+                self.attempts[key] += 1
+                jobs.append((key, self.jobs[key]))
+            return jobs
+
+    def heartbeat(self, worker):
+        "keeps leases of worker alive, returns False if all jobs are finished"
+        with self.lock:
+            self.workers[worker] = time.time()
+            return not self._finished()
+
+    def complete(self, worker, results):
+        "stores batch of results [(key, result, wall time)], late duplicates are ignored"
+        with self.lock:
+            self.workers[worker] = time.time()
+            for key, result, wallTime in results:
+                #late result of expired lease ends also the lease of the next worker
+                self.leases.pop(key, None)
+                if key in self.store or key not in self.jobs:
+                    continue
+                self.store.append(self.jobs[key], result, wallTime, worker=worker)
+                self.failed.discard(key)
+
+    def _finished(self):
+        return not self.queue and not self.leases
+
+    @property
+    def finished(self):
+        with self.lock:
+            return self._finished()
+
+    def status(self):
+        with self.lock:
+            return dict(total=len(self.jobs), done=sum(key in self.store for key in self.jobs),
+                        queued=len(self.queue), leased=len(self.leases),
+                        failed=len(self.failed), workers=len(self.workers))
+
+class CoordinatorManager(BaseManager):
+    pass
+
+def serve(coordinator, port, authkey):
+    "serves coordinator in background thread of current process"
+    CoordinatorManager.register("coordinator", callable=lambda: coordinator)
+    server = CoordinatorManager(address=("", port), authkey=authkey).get_server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def connect(host, port, authkey):
+    "returns proxy of remote coordinator"
+    CoordinatorManager.register("coordinator")
+    manager = CoordinatorManager(address=(host, port), authkey=authkey)
+    manager.connect()
+    return manager.coordinator()
+
+def workerId():
+    return "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+def work(host, port, authkey, evaluate, batchSize = 4, heartbeatInterval = 10.0, idle = 2.0):
+    """
+    Worker loop: leases batches of jobs, evaluates them by function evaluate (params ->
+    JSON compatible result) and returns results per batch. Heartbeats are sent by
+    background thread. Returns after all jobs are finished or coordinator is gone.
+    """
+    coordinator = connect(host, port, authkey)
+    worker = workerId()
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(heartbeatInterval):
+            try:
+                coordinator.heartbeat(worker)
+            except (OSError, EOFError):
+                return
+
+    threading.Thread(target=beat, daemon=True).start()
+    try:
+        while True:
+            jobs = coordinator.lease(worker, batchSize)
+            if not jobs:
+                if not coordinator.heartbeat(worker):
+                    return
+                time.sleep(idle) #other workers still run leased jobs (which may return)
+                continue
+            results = []
+            for key, params in jobs:
+                start = time.time()
+                results.append((key, evaluate(params), time.time() - start))
+            coordinator.complete(worker, results)
+    except (OSError, EOFError):
+        return #coordinator is finished
+    finally:
+        stop.set()
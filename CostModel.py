@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import numpy as np
+
+class CostModel:
+    """
+    Persistent database of costs of finished jobs (events and wall time) with simple
+    model of cost over (numeric) parameters: log(events) is fitted as linear function
+    of parameters and logarithms of parameters (separately for every model).
+    Database is shared by sweeps (one JSON object per line).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records = {} #model -> list of (params, events, wall time)
+        self.fits = {}
+        if os.path.exists(path):
+            with open(path, "rt") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.records.setdefault(record["model"], []).append(
+                        (record["params"], record["events"], record["time"]))
+        self.file = open(path, "at")
+
+    def record(self, model, params, events, wallTime):
+        record = dict(model=model, params=params, events=events, time=wallTime)
+        self.file.write(json.dumps(record, sort_keys=True) + "\n")
+        self.file.flush()
+        self.records.setdefault(model, []).append((params, events, wallTime))
+        self.fits.pop(model, None)
+
+    @staticmethod
+    def _features(params, names):
+        row = [1.0]
+        for name in names:
+            value = float(params.get(name, 0.0))
+            row.extend((value, np.log1p(abs(value))))
+        return row
+
+    def _fit(self, model):
+        if model in self.fits:
+            return self.fits[model]
+        records = [record for record in self.records.get(model, []) if record[1] > 0]
+        names = sorted({name for params, events, wallTime in records for name, value in
+                            params.items() if isinstance(value, (int, float))})
+        fit = None
+        if len(records) >= 2 * len(names) + 2:
+            x = np.array([self._features(params, names) for params, events, wallTime in records])
+            y = np.log([events for params, events, wallTime in records])
+            scale = np.maximum(np.abs(x).max(axis=0), 1e-12)
+            ridge = 1e-3 * np.eye(x.shape[1]) #keeps fit stable for unvarying parameters
+            coefficients = np.linalg.solve((x / scale).T @ (x / scale) + ridge, (x / scale).T @ y)
+            secondsPerEvent = np.median([wallTime / events
+                                            for params, events, wallTime in records])
+            fit = (names, coefficients / scale, secondsPerEvent)
+        self.fits[model] = fit
+        return fit
+
+    def predict(self, model, params):
+        "expected wall time (sec) of job or None (not enough data)"
+        fit = self._fit(model)
+        if fit is None:
+            return None
+        names, coefficients, secondsPerEvent = fit
+        return float(np.exp(np.dot(self._features(params, names), coefficients))
+                        * secondsPerEvent)
+
+    def order(self, model, points):
+        "points sorted by expected cost (longest first), unknown order is kept without data"
+        if self._fit(model) is None:
+            return list(points)
+        return sorted(points, key=lambda point: -self.predict(model, point))
+
+    def close(self):
+        self.file.close()
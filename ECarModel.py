@@ -4,38 +4,163 @@ from Entity import *
 from XValue import getXValue, number, XValueHelper
 from Pause import PauseTo
 from CommonShared import LimitedWaitingResourceEntity, Alarm
+from UrlUtil import resolveUrl
+import Graph
+from SpatialIndex import StationGrid, loadStations
+from ChargingCurve import getCurve
+from ChargingHub import ChargingHub
+from Cohort import Kernel, PauseToKernel
+import numpy as np
 
-class Route(SimpleEntity):
-    tag="route"
+class Travel(SimpleEntity):
+    "base class of routes (driving and energy consumption of car)"
     def __init__(self, transaction, xmlSource):
         super().__init__(transaction, xmlSource)
-        self.distance = getXValue(xmlSource, "distance", XValueHelper(self)) #km 
-        self.velocity = getXValue(xmlSource, "velocity", XValueHelper(self)) #km/h
-        
         self.limit = getXValue(xmlSource, "limit", XValueHelper(self), 0.0) #0.0-1.0
         self.delay = getXValue(xmlSource, "delay", XValueHelper(self)) #sec
         # output properties
         self.duration = None
         self.consumedEnergy = None
         self.batteryOut = False
-        
-    def action(self):
-        duration = self.distance / self.velocity * 60 * 60
+
+    def drive(self, distance, duration):
         self.duration = duration        
         yield self.hold(duration)
-        
+        yield from self.consume(distance)
+
+    def consume(self, distance):
+        "energy consumption of driven distance (with battery out handling)"
         actor = self.transaction.actor.props
-        energy = self.distance /  actor["consumption"]
-        
-        cEnergy = actor["consumption"] * self.distance
+        cEnergy = actor["consumption"] * distance
         self.consumedEnergy = min(cEnergy, actor["energy"])
         actor["energy"] -= cEnergy
         
-        if (actor["energy"] <= 0 or actor["energy"] / actor["capacity"] <= self.limit):
+        if (actor["energy"] <= 0 or actor["energy"] / actor["capacity"] <= float(self.limit)):
             yield self.hold(self.delay)
             actor["energy"] = 0.5 *  actor["capacity"]
             actor["batteryOutEvent"] = 1.0
             self.batteryOut = True
+
+class Route(Travel):
+    tag="route"
+    def __init__(self, transaction, xmlSource):
+        super().__init__(transaction, xmlSource)
+        self.distance = getXValue(xmlSource, "distance", XValueHelper(self)) #km 
+        self.velocity = getXValue(xmlSource, "velocity", XValueHelper(self)) #km/h
+        
+    def action(self):
+        return self.drive(self.distance, self.distance / self.velocity * 60 * 60)
+
+class RouteKernel(Kernel):
+    "vectorised Route (cohort execution)"
+    entityTag = "route"
+    outputs = ("duration", "consumedEnergy", "batteryOut", "distance")
+    def __init__(self, cohort, xmlSource):
+        super().__init__(cohort, xmlSource)
+        self.limit = cohort.value(xmlSource, "limit", 0.0)
+        self.delay = cohort.value(xmlSource, "delay")
+        self.distance = cohort.value(xmlSource, "distance")
+        self.velocity = cohort.value(xmlSource, "velocity")
+
+    def run(self, members):
+        cohort = self.cohort
+        distance = self.distance(members)
+        duration = distance / self.velocity(members) * 60 * 60
+        energy = cohort.get("energy", members)
+        capacity = cohort.get("capacity", members)
+        cEnergy = cohort.get("consumption", members) * distance
+        consumedEnergy = np.minimum(cEnergy, energy)
+        energy = energy - cEnergy
+        batteryOut = (energy <= 0) | (energy / capacity <= self.limit(members))
+        energy[batteryOut] = 0.5 * capacity[batteryOut]
+        cohort.set("energy", members, energy)
+        cohort.set("batteryOutEvent", members[batteryOut], 1.0)
+        cohort.clock[members] += duration + np.where(batteryOut, self.delay(members), 0.0)
+        return dict(duration=duration, consumedEnergy=consumedEnergy, batteryOut=batteryOut,
+                    distance=distance)
+
+class NetworkRoute(Travel):
+    """
+    Route along the shortest path (by weight attribute, default "time") in road network
+    given by CSV edge list (attribute network, see Graph.loadEdgeList) from origin node
+    (default: actor property "position") to destination node. Distance (km) is sum of
+    "length" attribute, duration is sum of "time" attribute (sec) or distance / velocity.
+    Actor property "position" is set to destination (node id is kept outside of float
+    columns of actor store). Paths are cached per process, attribute index="ch" enables
+    contraction hierarchy of the network. Time dependent
+    weights (profile columns of edge list) are evaluated for departure at current absolute
+    time (paths are shared by departures in the same 15 minutes bucket).
+
+    Attribute congestion="bpr" enables congestion feedback (see Graph.TrafficState): car
+    drives edge by edge, its load of edges increases travel times (weight is travel time,
+    edges need "capacity" attribute) and changed paths are repaired incrementally.
+    """
+    tag="networkRoute"
+    fileAttributes=("network",) #urls of data files (see ResultCache.modelDigest)
+    def __init__(self, transaction, xmlSource):
+        super().__init__(transaction, xmlSource)
+        path, base = xmlSource.getWithBase("network")
+        if path is None:
+            raise InvalidXMLException("undefined network of route")
+        self.network = Graph.loadNetwork(resolveUrl(path, base)[1])
+        self.weight = xmlSource.get("weight", "time")
+        if xmlSource.get("index") == "ch":
+            self.network.useHierarchy(self.weight)
+        self.traffic = (self.network.useTraffic(self.simulation, self.weight)
+                            if xmlSource.get("congestion") == "bpr" else None)
+        self.origin = self.nodeId(xmlSource, "origin")
+        self.destination = self.nodeId(xmlSource, "destination")
+        if self.destination is None:
+            raise InvalidXMLException("undefined destination of route")
+        self.velocity = getXValue(xmlSource, "velocity", XValueHelper(self), 50.0) #km/h
+        # output properties
+        self.distance = None
+        self.path = None
+
+    def nodeId(self, xmlSource, tag):
+        "id of node (text of element or $parameter)"
+        node = xmlSource.findNode(tag)
+        if node is None:
+            return None
+        text = node.text.strip()
+        return int(float(self.simulation.getParameter(text[1:]))) if text.startswith("$") else text
+
+    def action(self):
+        actor = self.transaction.actor.props
+        origin = self.origin if self.origin is not None else actor["position"]
+        if self.traffic is not None:
+            yield from self.driveCongested(origin)
+            actor.setExtra("position", self.destination) #node id (also string)
+            return
+        path, totals = self.network.route(origin, self.destination, self.weight,
+                                          self.simulation.now() + self.simulation.startTime)
+        if not path:
+            raise RuntimeError("no path from {0} to {1}".format(origin, self.destination))
+        self.path = path
+        self.distance = totals["length"]
+        duration = (totals["time"] if "time" in totals
+                        else self.distance / float(self.velocity) * 60 * 60)
+        yield from self.drive(self.distance, duration)
+        actor.setExtra("position", self.destination) #node id (also string)
+
+    def driveCongested(self, origin):
+        source, target = self.network.node(origin), self.network.node(self.destination)
+        nodes, edges = self.traffic.route(source, target)
+        if not nodes:
+            raise RuntimeError("no path from {0} to {1}".format(origin, self.destination))
+        graph = self.network.graph
+        self.path = [graph.nodeIds[node] for node in nodes]
+        self.distance = (float(graph.weights["length"][edges].sum())
+                            if "length" in graph.weights else 0.0)
+        self.duration = 0.0
+        for edge in edges:
+            duration = self.traffic.enter(edge)
+            try:
+                yield self.hold(duration)
+            finally: #load is released also by closed (interrupted) transaction
+                self.traffic.leave(edge)
+            self.duration += duration
+        yield from self.consume(self.distance)
     
 def simpleCharging(voltage, current, energy, capacity, duration):
         energy += 0.8 * voltage * current * (duration / 3600.0) / 1000.0 #v kWh
@@ -46,45 +171,147 @@ def charging(voltage, current, energy, capacity, duration):
 	d = duration / 3600.0 #to hour
 	ideal_time = c / (voltage * current * 0.9)
 	x = d / ideal_time
-	renergy = min(energy/capacity + 0.168*x*x*x - 0.78*x*x +1.38*x, 1.0)
+	renergy = np.minimum(energy/capacity + 0.168*x*x*x - 0.78*x*x +1.38*x, 1.0) #also for arrays
 	return capacity*renergy
+
+def chargingInterval(power, duration, chargedEnergy):
+    "charging time (sec) at nominal power (kW) until chargedEnergy (kWh), at most duration"
+    return np.minimum(duration, chargedEnergy / power * 3600.0)
+
+def feedLoadCurve(entity, duration, chargedEnergy, start = None):
+    """
+    records charging power (kW) of finished session into load curve of entity (if any):
+    car charges at nominal power (voltage x current x efficiency) until chargedEnergy
+    is reached (at most for duration of session)
+    """
+    if entity.loadCurve is None or duration <= 0 or chargedEnergy <= 0:
+        return
+    start = entity.simulation.now() - duration if start is None else start
+    efficiency = entity.curve.efficiency if entity.curve is not None else 0.9
+    power = float(entity.voltage) * float(entity.current) * efficiency / 1000.0
+    interval = float(chargingInterval(power, duration, chargedEnergy))
+    entity.simulation.collector.collectInterval(entity.loadCurve, start, start + interval,
+                                                chargedEnergy / (interval / 3600.0))
+
+def chargingParameters(entity, xmlSource):
+    """
+    common attributes of charging entities: voltage, current, optional charging curve
+    (attribute curve, see ChargingCurve.getCurve) and targetSoc (charging stops at given
+    state of charge, requires curve)
+    """
+    entity.voltage = getXValue(xmlSource, "voltage", XValueHelper(entity))
+    entity.current = getXValue(xmlSource, "current", XValueHelper(entity))
+    entity.loadCurve = xmlSource.get("loadCurve", None) #category of load curve collector
+    url, base = xmlSource.getWithBase("curve")
+    entity.curve = getCurve(url, base) if url is not None else None
+    entity.targetSoc = (getXValue(xmlSource, "targetSoc", XValueHelper(entity))
+                            if xmlSource.findNode("targetSoc") is not None else None)
+    if entity.targetSoc is not None and entity.curve is None:
+        raise InvalidXMLException("targetSoc requires charging curve")
+
+def chargingSession(entity, duration):
+    """
+    (charging time, energy after charging) of session of at most duration (sec)
+    by charging curve of entity (or polynomial of function charging)
+    """
+    actor = entity.transaction.actor.props
+    if entity.curve is None:
+        return duration, charging(entity.voltage, entity.current, actor["energy"],
+                                  actor["capacity"], duration)
+    scale = entity.curve.scale(actor["capacity"],
+                               float(entity.voltage) * float(entity.current) / 1000.0)
+    soc = actor["energy"] / actor["capacity"]
+    if entity.targetSoc is not None:
+        duration = min(duration, float(entity.curve.timeTo(soc, float(entity.targetSoc), scale)))
+    return duration, actor["capacity"] * float(entity.curve.charge(soc, duration, scale))
     
 class HomeCharging (PauseTo):
     tag="homeCharging"
+    fileAttributes=("curve",)
     def __init__(self, transaction, xmlSource):
         super().__init__(transaction, xmlSource)
-        self.voltage = getXValue(xmlSource, "voltage", XValueHelper(self))
-        self.current = getXValue(xmlSource, "current", XValueHelper(self))
+        chargingParameters(self, xmlSource)
         #output properties
         self.chargedEnergy = None
         
     def action(self):
         duration = self.duration()
+        start = self.simulation.now()
         yield self.hold(duration)
         
         actor= self.transaction.actor.props
         initialEnergy = actor["energy"]
-        actor["energy"] = charging(self.voltage, self.current, actor["energy"],
-                                   actor["capacity"], duration)
+        chargingTime, actor["energy"] = chargingSession(self, duration)
         self.chargedEnergy = actor["energy"] - initialEnergy
+        feedLoadCurve(self, chargingTime, self.chargedEnergy, start)
+
+
+class HomeChargingKernel(PauseToKernel):
+    "vectorised HomeCharging (cohort execution)"
+    entityTag = "homeCharging"
+    outputs = ("chargedEnergy",)
+    def __init__(self, cohort, xmlSource):
+        super().__init__(cohort, xmlSource)
+        self.voltage = cohort.value(xmlSource, "voltage")
+        self.current = cohort.value(xmlSource, "current")
+        self.loadCurve = xmlSource.get("loadCurve", None)
+        url, base = xmlSource.getWithBase("curve")
+        self.curve = getCurve(url, base) if url is not None else None
+        self.targetSoc = (cohort.value(xmlSource, "targetSoc")
+                              if xmlSource.findNode("targetSoc") is not None else None)
+        if self.targetSoc is not None and self.curve is None:
+            raise InvalidXMLException("targetSoc requires charging curve")
 
+    def run(self, members):
+        cohort = self.cohort
+        start = cohort.clock[members]
+        duration = self.durations(members)
+        cohort.clock[members] += duration
+        energy = cohort.get("energy", members)
+        capacity = cohort.get("capacity", members)
+        voltage, current = self.voltage(members), self.current(members)
+        chargingTime = duration
+        if self.curve is None:
+            charged = charging(voltage, current, energy, capacity, duration)
+        else:
+            scale = self.curve.scale(capacity, voltage * current / 1000.0)
+            soc = energy / capacity
+            if self.targetSoc is not None:
+                chargingTime = np.minimum(duration,
+                                          self.curve.timeTo(soc, self.targetSoc(members), scale))
+            charged = capacity * self.curve.charge(soc, chargingTime, scale)
+        cohort.set("energy", members, charged)
+        chargedEnergy = charged - energy
+        if self.loadCurve is not None: #see feedLoadCurve
+            efficiency = self.curve.efficiency if self.curve is not None else 0.9
+            with np.errstate(divide="ignore", invalid="ignore"):
+                interval = chargingInterval(voltage * current * efficiency / 1000.0,
+                                            chargingTime, chargedEnergy)
+            for s, d, e in zip(start.tolist(), interval.tolist(), chargedEnergy.tolist()):
+                if d > 0 and e > 0:
+                    cohort.simulation.collector.collectInterval(self.loadCurve, s, s + d,
+                                                                e / (d / 3600.0))
+        return dict(chargedEnergy=chargedEnergy)
         
 class FastCharging(LimitedWaitingResourceEntity):
+    "charging at shared station (socket is held for duration or until targetSoc is reached)"
     tag="fastCharging"
+    fileAttributes=("curve",)
     def __init__(self, transaction, xmlSource):
         super().__init__(transaction, xmlSource)
-        self.voltage = getXValue(xmlSource, "voltage", XValueHelper(self))
-        self.current = getXValue(xmlSource, "current", XValueHelper(self))
+        chargingParameters(self, xmlSource)
         #output properties
         self.chargedEnergy = None
     
     def action(self):
         # yield from super().action()
         shopTime = float(self.duration)
+        self.usedResource = False #entity is reused by next visits
         self.alarm = Alarm(self.transaction)
         self.simulation.activate(self.alarm, self.alarm.wakeup(delay=float(self.maxWaiting)))
         yield self.request()
         if self.gotResource():
+            shopTime = chargingSession(self, shopTime)[0] #until targetSoc
             yield self.hold(shopTime)
             yield self.release()
             self.usedResource = True
@@ -94,14 +321,136 @@ class FastCharging(LimitedWaitingResourceEntity):
         if self.usedResource:    
             actor = self.transaction.actor.props
             initialEnergy = actor["energy"]
-            actor["energy"] = charging(self.voltage, self.current, actor["energy"],
-                                   actor["capacity"], shopTime)
+            actor["energy"] = chargingSession(self, shopTime)[1]
             self.chargedEnergy = actor["energy"] - initialEnergy
+            feedLoadCurve(self, shopTime, self.chargedEnergy)
         else:
             self.chargedEnergy = 0.0
-        
-        
-        
-        
-        
-        
+
+class ChargingStations:
+    "charging stations of region (resource per station) with spatial index of free sockets"
+    def __init__(self, stations, simulation):
+        self.ids = [station[0] for station in stations]
+        self.grid = StationGrid([station[1] for station in stations],
+                                [station[2] for station in stations],
+                                [station[3] for station in stations])
+        self.resources = [Resource(station[3], sim=simulation) for station in stations]
+
+    def update(self, station):
+        "propagates occupancy of station resource into spatial index"
+        resource = self.resources[station]
+        self.grid.setFree(station, resource.capacity - len(resource.activeQ))
+
+class NearestCharging(SharedEntity):
+    """
+    Fast charging at the nearest station with free socket (or queueing at the nearest
+    station if all stations within maxDistance are full). Stations are given by CSV file
+    (attribute stations, header id,x,y,sockets), position of car by actor properties
+    x and y (km). Stations with the same entity id share sockets.
+    """
+    tag="nearestCharging"
+    fileAttributes=("stations", "curve")
+    def __init__(self, transaction, xmlSource):
+        super().__init__(transaction, xmlSource)
+        chargingParameters(self, xmlSource)
+        self.duration = getXValue(xmlSource, "duration", XValueHelper(self))
+        self.maxWaiting = getXValue(xmlSource, "queue_waiting", XValueHelper(self))
+        self.maxDistance = getXValue(xmlSource, "maxDistance", XValueHelper(self), float('inf'))
+        #output properties
+        self.station = None
+        self.stationDistance = None
+        self.usedResource = False
+        self.chargedEnergy = None
+
+    def createSharedObject(self, xmlSource):
+        path, base = xmlSource.getWithBase("stations")
+        if path is None:
+            raise InvalidXMLException("undefined stations of charging")
+        return ChargingStations(loadStations(resolveUrl(path, base)[1]), self.simulation)
+
+    def action(self):
+        actor = self.transaction.actor.props
+        stations = self.sharedObject
+        x, y, maxDistance = float(actor["x"]), float(actor["y"]), float(self.maxDistance)
+        found = (stations.grid.nearest(x, y, 1, True, maxDistance)
+                    or stations.grid.nearest(x, y, 1, False, maxDistance))
+        if not found:
+            self.chargedEnergy = 0.0
+            return
+        self.stationDistance, station = found[0]
+        self.station = stations.ids[station]
+        resource = stations.resources[station]
+        shopTime = float(self.duration)
+        self.usedResource = False #entity is reused by next visits
+        self.alarm = Alarm(self.transaction)
+        self.simulation.activate(self.alarm, self.alarm.wakeup(delay=float(self.maxWaiting)))
+        yield request, self.transaction, resource
+        if self.transaction in resource.activeQ:
+            self.transaction.cancel(self.alarm)
+            stations.update(station)
+            shopTime = chargingSession(self, shopTime)[0] #until targetSoc
+            yield self.hold(shopTime)
+            yield release, self.transaction, resource
+            stations.update(station)
+            self.usedResource = True
+        else:
+            resource.waitQ.remove(self.transaction)
+            yield self.hold(shopTime)
+
+        if self.usedResource:
+            initialEnergy = actor["energy"]
+            actor["energy"] = chargingSession(self, shopTime)[1]
+            self.chargedEnergy = actor["energy"] - initialEnergy
+            feedLoadCurve(self, shopTime, self.chargedEnergy)
+        else:
+            self.chargedEnergy = 0.0
+
+class HubCharging(LimitedWaitingResourceEntity):
+    """
+    Charging in hub with shared grid connection (see ChargingHub): sockets (resources)
+    share maxPower (kW) by policy (attribute policy="equal" or "priority"), power of one
+    session is at most voltage x current. Car leaves after duration or when targetSoc
+    (default 1.0) is reached. Hub parameters are given by the first entity of given id.
+    """
+    tag="hubCharging"
+    def __init__(self, transaction, xmlSource):
+        super().__init__(transaction, xmlSource)
+        self.voltage = getXValue(xmlSource, "voltage", XValueHelper(self))
+        self.current = getXValue(xmlSource, "current", XValueHelper(self))
+        self.targetSoc = getXValue(xmlSource, "targetSoc", XValueHelper(self), 1.0)
+        self.priority = getXValue(xmlSource, "priority", XValueHelper(self), 0.0)
+        #output properties
+        self.chargedEnergy = None
+        self.chargingTime = None
+
+    def createSharedObject(self, xmlSource):
+        helper = XValueHelper(self, XValueHelper.SIMULATION_CONTEXT)
+        return ChargingHub(self.simulation, int(getXValue(xmlSource, "resources", helper)),
+                           float(getXValue(xmlSource, "maxPower", helper)),
+                           xmlSource.get("policy", "equal"),
+                           float(getXValue(xmlSource, "efficiency", helper, 0.9)),
+                           xmlSource.get("loadCurve", None))
+
+    def action(self):
+        duration = float(self.duration)
+        self.alarm = Alarm(self.transaction)
+        self.simulation.activate(self.alarm, self.alarm.wakeup(delay=float(self.maxWaiting)))
+        yield self.request()
+        if not self.gotResource():
+            self.chargedEnergy = 0.0
+            yield self.hold(duration)
+            return
+        actor = self.transaction.actor.props
+        hub = self.sharedObject
+        start = self.simulation.now()
+        session = hub.join(self.transaction, actor["energy"],
+                           float(self.targetSoc) * actor["capacity"],
+                           float(self.voltage) * float(self.current) / 1000.0,
+                           float(self.priority), start + duration)
+        yield self.hold(session.end - start) #rescheduled by hub after reallocation
+        hub.leave(session)
+        yield self.release()
+        self.usedResource = True
+        self.chargingTime = self.simulation.now() - start
+        self.chargedEnergy = max(session.energy - actor["energy"], 0.0)
+        actor["energy"] = max(session.energy, actor["energy"])
@@ -7,6 +7,7 @@ from Collector import Collector
 import sys
 from TimeUtil import *
 from PropertyGetter import Property
+from UrlUtil import NodeCache
         
 class EntityError:
     def __init__(self, msg):
@@ -20,9 +21,15 @@ class Entity:
         self.transaction = transaction
         self.simulation = transaction.simulation
         self.actor = transaction.actor
-        self.xcontext = XValueContext(lambda: self.simulation.now() - self.startTime)
+        self.xcontext = XValueContext(self.localTime)
         self.startTime = None
-        self.t = self.xcontext.t
+
+    def localTime(self):
+        return self.simulation.now() - self.startTime
+
+    @property
+    def t(self):
+        return self.xcontext.t
 
     def setTransaction(self, transaction):
         self.transaction = transaction
@@ -128,9 +135,14 @@ class Checkpoint(SimpleEntity):
     Collected values and mechanisms of collecting are specified by measure subelements
     (see class Measure)
     """
+    measureCache = NodeCache() #measures are immutable, shared by all instances of template
     def __init__(self, transaction, xmlSource):
         super().__init__(transaction, xmlSource)
-        self.measures = [Measure(node) for node in xmlSource]
+        key = tuple(xmlSource.elements)
+        self.measures = Checkpoint.measureCache.get(key)
+        if self.measures is None:
+            self.measures = [Measure(node) for node in xmlSource]
+            Checkpoint.measureCache[key] = self.measures
         self.referedEntity = xmlSource.get("referedEntity", None)
     
     def action(self):
@@ -1,36 +1,76 @@
 #!/usr/bin/env python3
 
+import os
+import gc
+import random
+import tracemalloc
+import multiprocessing
+import numpy as np
 import SimPy.Simulation
 import Transaction
 import Entity
-from UrlUtil import xmlLoader, xmlStringLoader
+import Cohort
+from UrlUtil import xmlLoader, xmlStringLoader, XmlSource
 from XValue import *
 from Collector import Collector
+from Sampler import Sampler
+from Actor import ActorStore
 
 class Simulation (SimPy.Simulation.Simulation):
     def __init__(self, startTime = 0, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.sharedObjects = {}
         self.startTime = startTime
         self.xcontext = XValueContext(lambda: self.now() + self.startTime)
         self.t = self.xcontext.t
-        self.collector = Collector()
-        self.tcounter = 0
+        self.transactionPool = None #optional recycling of finished transactions
+        self.cohorts = None #optional cohort execution of started transactions (key -> Cohort)
+        self.cohortEpoch = 3600.0
+        self.arrivalProfiles = None #optional recording of arrivals at entities (id -> profile)
+        self.logging = True
+        self.reset()
+
+    def reset(self):
+        """
+        Discards state of previous run (events, shared objects, actors, collected data
+        and parameters). Parsed models and entity templates (process wide caches) are kept,
+        so the simulation can run job after job with new parameters.
+        """
         self.initialize()
+        self.sharedObjects = {}
+        self.stopped = False #run was stopped by model (see stopSimulation)
+        self.collector = Collector(self.now)
+        self.tcounter = 0
+        self.acounter = 0
+        self.liveActors = {} #registry of live actors (actor index -> actor)
+        self.actorStores = {} #array backed stores of actor properties (names -> ActorStore)
+        if self.transactionPool is not None:
+            self.transactionPool = Transaction.TransactionPool(self.transactionPool.maxSize)
+        if self.cohorts is not None:
+            self.cohorts = {}
+        if self.arrivalProfiles is not None:
+            self.recordArrivals(list(self.arrivalProfiles), self.arrivalBinSize,
+                                self.arrivalStart)
         self.xvalues = {}
-        self.logging = True
+        self.xcontext.resetContext()
 
 
     def start(self, transaction, duration = 0xFFFFFFFF, actor = None):
+        "transaction is url, xml string, loaded xml source or Transaction instance"
         if isinstance(transaction, str):
-            transaction = Transaction.Transaction(
-                xmlStringLoader(transaction) if transaction.strip().startswith("<")
-                    else xmlLoader(transaction),
-                self, actor=actor)
+            transaction = (xmlStringLoader(transaction) if transaction.strip().startswith("<")
+                              else xmlLoader(transaction))
+        if isinstance(transaction, XmlSource):
+            transaction = Transaction.Transaction(transaction, self, actor=actor)
         self.activate(transaction, transaction.run())
         self.simulate(until=int(duration))
         
 
+    @staticmethod
+    def replicate(model, params, n, workers = None, **kwargs):
+        "runs n replications in process pool, returns merged collector (see Replication)"
+        import Replication
+        return Replication.replicate(model, params, n, workers, **kwargs)
+
     def setParameter(self, key, value):
         self.xvalues[key] = value if isinstance(value, XValue) else XValue(value)
         
@@ -38,6 +78,19 @@ class Simulation (SimPy.Simulation.Simulation):
         for key, value in kwargs.items():
             self.setParameter(key, value)
         
+    def updateParameters(self, **kwargs):
+        "changes values of parameters in place (values already used by entities are changed)"
+        for key, value in kwargs.items():
+            if key not in self.xvalues:
+                self.setParameter(key, value)
+                continue
+            xvalue = self.xvalues[key]
+            update = value if isinstance(value, XValue) else XValue(value)
+            xvalue.type, xvalue.fval, xvalue.rval, xvalue.time = (update.type, update.fval,
+                                                                  update.rval, None)
+            if xvalue.context is not None:
+                xvalue.context.addValue(xvalue)
+
     def getParameter(self, key):
         return self.xvalues[key]
 
@@ -51,11 +104,246 @@ class Simulation (SimPy.Simulation.Simulation):
         self.tcounter += 1
         return self.tcounter
     
+    def enablePooling(self, maxSize = 1000):
+        "enables recycling of finished transactions started by start_transaction"
+        self.transactionPool = Transaction.TransactionPool(maxSize)
+        return self.transactionPool
+
+    def enableCohorts(self, epoch = 3600.0):
+        """
+        Transactions started by start_transaction are executed in cohorts (one per template):
+        entities without shared objects are vectorised, entities with shared objects are
+        executed by individual transactions (see Cohort). Members of cohort are advanced
+        ahead of simulation time by at most epoch (sec).
+        """
+        self.cohorts = {}
+        self.cohortEpoch = epoch
+        return self.cohorts
+
+    def cohort(self, transactionNode, entitiesNode):
+        "cohort of template (created and activated on the first start)"
+        key = Transaction.TransactionPool.key(transactionNode, entitiesNode)
+        cohort = self.cohorts.get(key)
+        if cohort is None:
+            cohort = Cohort.Cohort(self, transactionNode, entitiesNode, self.cohortEpoch)
+            self.cohorts[key] = cohort
+            cohort.wakeup = self.now()
+            self.activate(cohort, cohort.run())
+        return cohort
+
+    def recordArrivals(self, entityIds, binSize = 900.0, start = 0.0):
+        """
+        Records arrivals of transactions at entities with given ids (from simulation time
+        start) into arrival profiles (see Fluid.ArrivalProfile), returns id -> profile.
+        """
+        import Fluid
+        self.arrivalProfiles = {entityId : Fluid.ArrivalProfile(entityId, binSize)
+                                    for entityId in entityIds}
+        self.arrivalBinSize = binSize
+        self.arrivalStart = start
+        return self.arrivalProfiles
+
+    def recordArrival(self, entity, transaction):
+        profile = self.arrivalProfiles.get(entity.id)
+        if profile is not None and self.now() >= self.arrivalStart:
+            profile.record(self.now() + self.startTime, transaction.actor.props)
+
+    def addFluidFleet(self, profile, cars, template = None):
+        """
+        Adds background fleet of cars represented by arrival profile of entity
+        (see Fluid.FluidFleet), template is url of transaction of cars (default: template
+        of calibration run).
+        """
+        import Fluid
+        fleet = Fluid.FluidFleet(self, profile, cars, template)
+        self.activate(fleet, fleet.run())
+        return fleet
+
+    def registerActor(self, actor):
+        index = self.acounter
+        self.acounter += 1
+        self.liveActors[index] = actor
+        return index
+
+    def unregisterActor(self, actor):
+        if self.liveActors.pop(actor.index, None) is not None:
+            actor.props.detach()
+
+    def actorStore(self, names):
+        names = tuple(names)
+        if names not in self.actorStores:
+            self.actorStores[names] = ActorStore(names)
+        return self.actorStores[names]
+
+    def addSampler(self, category, properties, interval, horizon):
+        """
+        Starts periodic sampling of actor/transaction properties (e.g. ["a.energy"]) of all
+        live actors; samples are accessible as collector category.
+        """
+        sampler = Sampler(self, properties, interval, horizon)
+        self.collector.categories[category] = sampler
+        self.activate(sampler, sampler.run())
+        return sampler
+
+    def setWarmup(self, time):
+        "discards all data collected before simulation time (warm-up deletion)"
+        reset = CollectorReset(self)
+        self.activate(reset, reset.run(), at=time)
+
+    def addBatchMeans(self, category, batchSize = None, batchLength = None, key = None):
+        """
+        Records batch means of stat category in one long run, batches are given by
+        number of observations or by simulation time (sec).
+        """
+        return self.collector.addBatchMeans(category, batchSize, batchLength, key)
+
+    def extendBatchMeans(self, category, maxDuration, correlation = 0.2, minBatches = 10,
+                         maxBatches = 40, attribute = "mean"):
+        """
+        Continues the (already started) run until absolute lag 1 correlation of batch
+        values of category is lower or equal to correlation. The run is doubled
+        in every step, batches are merged to keep their number between minBatches
+        and maxBatches. Returns True if the correlation criterion is met.
+        """
+        batchMeans = self.collector.batchMeans[category]
+        while True:
+            while len(batchMeans.completed()) > maxBatches:
+                batchMeans.coarsen()
+            if (len(batchMeans.completed()) >= minBatches
+                    and abs(batchMeans.correlation(attribute)) <= correlation):
+                return True
+            now = self.now()
+            if now >= maxDuration:
+                return False
+            if not self.resume(min(batchMeans.start + 2 * max(now - batchMeans.start, 1),
+                                   maxDuration)):
+                return False
+            if self.now() <= now: #no more events
+                return False
+
+    @property
+    def events(self):
+        "number of events scheduled in the current run (machine independent cost)"
+        return -self._sortpr
+
+    def fork(self, continuations, until, workers = None, seeds = None, resetCollector = False):
+        """
+        What-if continuations of current state of simulation: every continuation (parameter
+        dictionary, see updateParameters, or function of simulation) is applied in a forked copy of the process
+        (events, live transactions, actors, shared objects, collectors and RNG state are
+        inherited) which runs until simulation time. At most workers continuations run
+        in parallel. Returns list of collector snapshots (in order of continuations).
+
+        seeds -- optional seeds of continuations (default: common random numbers)
+        resetCollector -- collected data of common prefix are discarded
+        """
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("fork of simulation is not supported on this platform")
+        context = multiprocessing.get_context("fork")
+        continuations = list(continuations)
+        workers = workers or os.cpu_count()
+        results = [None] * len(continuations)
+        running = []
+
+        def collect(index, process, connection):
+            status, value = connection.recv()
+            connection.close()
+            process.join()
+            if status != "ok":
+                raise RuntimeError("continuation {0} failed: {1}".format(index, value))
+            results[index] = value
+
+        for index, continuation in enumerate(continuations):
+            if len(running) >= workers:
+                collect(*running.pop(0))
+            receiver, sender = context.Pipe(duplex=False)
+            seed = seeds[index] if seeds is not None else random.getstate()
+            process = context.Process(target=self._continue,
+                                      args=(sender, continuation, until, seed, resetCollector))
+            process.start()
+            sender.close()
+            running.append((index, process, receiver))
+        while running:
+            collect(*running.pop(0))
+        return results
+
+    def _continue(self, connection, continuation, until, seed, resetCollector):
+        "body of forked continuation (see fork)"
+        try:
+            if isinstance(seed, tuple): #state of parent (random module is reseeded after fork)
+                random.setstate(seed)
+            else:
+                random.seed(seed)
+                np.random.seed(seed % 2**32)
+            if resetCollector:
+                self.collector.reset(self.now())
+            if callable(continuation):
+                continuation(self)
+            else:
+                self.updateParameters(**continuation)
+            self.resume(until)
+            connection.send(("ok", self.collector.snapshot()))
+        except BaseException as e:
+            connection.send(("error", repr(e)))
+        finally:
+            connection.close()
+
+    def stopSimulation(self):
+        "stops run (the run is ended by model, it can't be resumed)"
+        self.stopped = True
+        super().stopSimulation()
+
+    def resume(self, until):
+        """
+        continues simulation which reached its end time until (later) simulation time,
+        returns False if the run was stopped by model (stop_simulation or exception)
+        """
+        if self.stopped:
+            return False
+        self._stop = False
+        self.simulate(until=int(until))
+        return True
+
+    def memoryPerTransaction(self, transaction, count = 1000, duration = 0):
+        """
+        Creates and activates count top level transactions (url or xml string) and runs
+        them for duration (sec). Returns mean memory allocated per live transaction (bytes).
+        """
+        node = (xmlStringLoader(transaction) if transaction.strip().startswith("<")
+                    else xmlLoader(transaction))
+        warmup = Transaction.Transaction(node, self) #warm-up (caches, shared objects)
+        self.unregisterActor(warmup.actor)
+        tracemalloc.start()
+        try:
+            gc.collect()
+            before = tracemalloc.get_traced_memory()[0]
+            transactions = []
+            for i in range(count):
+                t = Transaction.Transaction(node, self)
+                self.activate(t, t.run(), at=self.now())
+                transactions.append(t)
+            self.simulate(until=self.now() + int(duration))
+            gc.collect()
+            return (tracemalloc.get_traced_memory()[0] - before) / count
+        finally:
+            tracemalloc.stop()
+
     def disableLog(self):
         self.logging = False
     
+class CollectorReset(SimPy.Simulation.Process):
+    "resets collector of simulation at its activation time"
+    def __init__(self, simulation):
+        super().__init__(sim=simulation)
+        self.simulation = simulation
+
+    def run(self):
+        self.simulation.collector.reset(self.simulation.now())
+        yield SimPy.Simulation.hold, self, 0
+
 def registerModule(module):
     Transaction.EntityFactory.registerModule(module)
+    Cohort.registerModule(module)
 
     
 
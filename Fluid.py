@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+from SimPy.Simulation import Process, hold
+from UrlUtil import xmlLoader, XmlSource
+from XValue import number, InvalidXMLException
+from Collector import Statistics, LoadCurve
+import collections
+import Transaction
+import Replication
+import Etos
+
+class ArrivalProfile:
+    """
+    Arrivals of cars at entity (given by id) as periodic piecewise constant intensity
+    (bins of binSize seconds within period) per car and second. Marks are actor properties
+    of arriving cars (empirical distribution of state of cars at arrival).
+    """
+    def __init__(self, entityId, binSize = 900.0, period = 86400.0, template = None):
+        self.entityId = entityId
+        self.binSize = float(binSize)
+        self.period = float(period)
+        self.template = template #url of transaction of cars
+        bins = int(round(self.period / self.binSize))
+        self.counts = np.zeros(bins)
+        self.exposure = np.zeros(bins) #car-seconds of observation per bin
+        self.marks = []
+
+    def bin(self, time):
+        return int((time % self.period) // self.binSize)
+
+    def record(self, time, props):
+        self.counts[self.bin(time)] += 1
+        self.marks.append({key : float(props[key]) for key in props.keys()})
+
+    def observe(self, start, end, cars):
+        "adds observation of cars from start to end (simulation time incl. start time)"
+        edges = np.arange(len(self.counts) + 1) * self.binSize
+        first = np.floor(start / self.period) * self.period
+        while first < end:
+            lower = np.clip(edges[:-1] + first, start, end)
+            upper = np.clip(edges[1:] + first, start, end)
+            self.exposure += cars * (upper - lower)
+            first += self.period
+
+    def rates(self):
+        "intensity per car and second in bins"
+        return np.divide(self.counts, self.exposure, out=np.zeros_like(self.counts),
+                         where=self.exposure > 0)
+
+    def toDict(self):
+        return dict(entityId=self.entityId, binSize=self.binSize, period=self.period,
+                    template=self.template, counts=self.counts.tolist(),
+                    exposure=self.exposure.tolist(), marks=self.marks)
+
+    @staticmethod
+    def fromDict(data):
+        profile = ArrivalProfile(data["entityId"], data["binSize"], data["period"],
+                                 data["template"])
+        profile.counts = np.array(data["counts"])
+        profile.exposure = np.array(data["exposure"])
+        profile.marks = data["marks"]
+        return profile
+
+def saveProfiles(profiles, path):
+    with open(path, "wt") as f:
+        json.dump([profile.toDict() for profile in profiles.values()], f)
+
+def loadProfiles(path):
+    with open(path, "rt") as f:
+        return {data["entityId"] : ArrivalProfile.fromDict(data) for data in json.load(f)}
+
+def entityNodes(transactionNode, entityId):
+    "(node, base) of first entity with id in template and of checkpoints refering to it"
+    for element, base in zip(transactionNode.elements, transactionNode.bases):
+        for parent in element.iter():
+            children = list(parent)
+            for i, child in enumerate(children):
+                if child.get("id") != entityId or child.tag == "checkpoint":
+                    continue
+                nodes = [(child, base)]
+                for sibling in children[i + 1:]:
+                    if sibling.tag != "checkpoint" or sibling.get("referedEntity") != "prev":
+                        break
+                    nodes.append((sibling, base))
+                return nodes
+    raise InvalidXMLException("entity {0} not found in template".format(entityId))
+
+class FluidTransaction(Transaction.Transaction):
+    "arrival of background car: entity (and its checkpoints) with actor initialised by mark"
+    def __init__(self, fleet, mark):
+        super().__init__(fleet.transactionNode, fleet.simulation, entities=[])
+        props = self.actor.props
+        for key, value in mark.items():
+            if key in props:
+                props[key] = value
+        factory = Transaction.EntityFactory(self.entitiesXmlNode)
+        self.entities = Transaction.linkReferedEntities(
+                            [factory.createFromXml(node, self, base) for node, base in fleet.nodes])
+
+class FluidFleet(Process):
+    """
+    Background cars represented by arrival intensity (see ArrivalProfile): arrivals
+    at entity are non-homogeneous Poisson process with intensity cars * rate(t) generated
+    by thinning. Only the entity is simulated for every arrival (by FluidTransaction),
+    state of arriving car is random mark of calibration run.
+    """
+    def __init__(self, simulation, profile, cars, template = None):
+        super().__init__(sim=simulation)
+        self.simulation = simulation
+        self.profile = profile
+        self.cars = cars
+        template = template if template is not None else profile.template
+        if template is None:
+            raise InvalidXMLException("undefined template of background cars")
+        self.transactionNode = xmlLoader(template)
+        self.nodes = entityNodes(self.transactionNode, profile.entityId)
+        self.arrivals = 0
+        #collector categories fed by arrivals (load curve of entity and its checkpoints)
+        entities = XmlSource()
+        path, base = self.transactionNode.getWithBase("entities")
+        if path is not None:
+            entities.append(xmlLoader(path, base=base))
+        loadCurve = Transaction.EntityFactory(entities).entitySource(*self.nodes[0]).get("loadCurve")
+        self.categories = set([loadCurve] if loadCurve is not None else [])
+        for node, base in self.nodes[1:]:
+            self.categories.update(measure.get("category", measure.get("property"))
+                                       for measure in node)
+
+    def run(self):
+        rates = self.cars * self.profile.rates()
+        maxRate = rates.max() if len(rates) else 0.0
+        if maxRate <= 0 or not self.profile.marks:
+            return
+        while True:
+            yield hold, self, random.expovariate(maxRate)
+            now = self.simulation.now() + self.simulation.startTime
+            if random.random() * maxRate < rates[self.profile.bin(now)]:
+                t = FluidTransaction(self, random.choice(self.profile.marks))
+                self.simulation.activate(t, t.run())
+                self.arrivals += 1
+
+def calibrate(model, template, entityIds, params, duration, cars, binSize = 900.0,
+              warmup = 0.0, seed = 0, setup = None, modules = ("ECarModel", "Pause")):
+    """
+    Arrival profiles of entities (id -> ArrivalProfile) from discrete run of model (url
+    of starting transaction) with params, cars is number of cars of the run. Template
+    is url of transaction of cars, arrivals before warmup (sec) are not recorded.
+    """
+    sim = runModel(model, params, duration, seed, setup, modules,
+                   lambda sim: sim.recordArrivals(entityIds, binSize, warmup))
+    for profile in sim.arrivalProfiles.values():
+        profile.template = template
+        profile.observe(warmup + sim.startTime, sim.now() + sim.startTime, cars)
+    return sim.arrivalProfiles
+
+def runModel(model, params, duration, seed = 0, setup = None,
+             modules = ("ECarModel", "Pause"), prepare = None):
+    "finished simulation of model (setup and prepare are functions called before start)"
+    node = Replication.compileModel(model, modules)
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    sim = Etos.Simulation()
+    sim.disableLog()
+    sim.setParameters(**params)
+    if setup is not None:
+        setup(sim)
+    if prepare is not None:
+        prepare(sim)
+    sim.start(node, duration)
+    return sim
+
+def compare(discrete, hybrid, scale = 1.0, fluidCategories = ()):
+    """
+    rows (category, metric, discrete value, hybrid value, relative error) of stat categories
+    (mean, count), counters and load curves (mean, peak) of collectors. Counts and load curves
+    of categories which are not fed by fluid fleets (only by tagged cars) are multiplied
+    by scale.
+    """
+    rows = []
+    for category, container in sorted(discrete.categories.items()):
+        other = hybrid.categories.get(category)
+        factor = 1.0 if category in fluidCategories else scale
+        if isinstance(container, Statistics):
+            other = other if isinstance(other, Statistics) else Statistics()
+            metrics = [("mean", container.mean if container.count else float('nan'),
+                        other.mean if other.count else float('nan')),
+                       ("count", container.count, other.count * factor)]
+        elif isinstance(container, LoadCurve):
+            metrics = [(name, getattr(container, name),
+                        getattr(other, name) * factor if isinstance(other, LoadCurve) else float('nan'))
+                           for name in ("mean", "peak")]
+        elif isinstance(container, collections.Counter):
+            other = other if isinstance(other, collections.Counter) else collections.Counter()
+            metrics = [(str(key), container[key], other[key] * factor)
+                           for key in sorted(set(container) | set(other))]
+        else:
+            continue
+        for name, a, b in metrics:
+            error = abs(b - a) / abs(a) if a != 0 else float('nan')
+            rows.append((category, name, a, b, error))
+    return rows
+
+def validate(model, template, entityIds, params, duration, tagged, calibration,
+             population = "cars", calibrationCars = None, binSize = 900.0, seed = 0,
+             setup = None, modules = ("ECarModel", "Pause")):
+    """
+    Accuracy of hybrid run against full discrete run of the same model (the same seed).
+    Population (number of cars) is given by parameter population; hybrid run simulates
+    tagged cars individually and the rest by fluid fleets calibrated by discrete run
+    of calibrationCars (default: full population) for calibration seconds.
+    Returns dictionary with rows of compare, wall times and arrivals at entities.
+    """
+    cars = int(params[population])
+    if not 0 < tagged <= cars:
+        raise ValueError("Number of tagged cars must be from 1 to {0}".format(cars))
+    calibrationCars = cars if calibrationCars is None else calibrationCars
+    report = dict(rows=[], times={}, arrivals={})
+    start = time.time()
+    profiles = calibrate(model, template, entityIds, dict(params, **{population : calibrationCars}),
+                         calibration, calibrationCars, binSize, 0.0, seed + 1, setup, modules)
+    report["times"]["calibration"] = time.time() - start
+    report["profiles"] = profiles
+
+    start = time.time()
+    discrete = runModel(model, params, duration, seed, setup, modules,
+                        lambda sim: sim.recordArrivals(entityIds, binSize))
+    report["times"]["discrete"] = time.time() - start
+
+    fluidCategories = set()
+    def background(sim):
+        sim.recordArrivals(entityIds, binSize)
+        for profile in profiles.values():
+            fluidCategories.update(sim.addFluidFleet(profile, cars - tagged).categories)
+
+    start = time.time()
+    hybrid = runModel(model, dict(params, **{population : tagged}), duration, seed, setup,
+                      modules, background)
+    report["times"]["hybrid"] = time.time() - start
+    report["rows"] = compare(discrete.collector, hybrid.collector, cars / tagged,
+                             fluidCategories)
+    for entityId in entityIds:
+        report["arrivals"][entityId] = (int(discrete.arrivalProfiles[entityId].counts.sum()),
+                                        int(hybrid.arrivalProfiles[entityId].counts.sum()))
+    report["events"] = (discrete.events, hybrid.events)
+    return report
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="validation of hybrid (discrete + fluid background fleet) run of ETOS model")
+    parser.add_argument("model", help="url of starting transaction")
+    parser.add_argument("template", help="url of transaction of (background) cars")
+    parser.add_argument("entities", help="ids of entities with arrival profiles (comma separated)")
+    parser.add_argument("parameters", nargs="*", help="name=value")
+    parser.add_argument("--population", default="cars", help="parameter with number of cars")
+    parser.add_argument("--tagged", type=int, required=True,
+                        help="number of individually simulated cars of hybrid run")
+    parser.add_argument("--duration", default="120:00", help="duration of runs (h:mm or sec)")
+    parser.add_argument("--calibration", default="48:00", help="duration of calibration run")
+    parser.add_argument("--calibration-cars", type=int, default=None)
+    parser.add_argument("--bin", default="0:15", help="bin of arrival profile")
+    parser.add_argument("--load-curve", action="append", default=[],
+                        help="category of load curve (declared with step of bin)")
+    parser.add_argument("--save", default=None, help="file for calibrated profiles (JSON)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.tagged < 1:
+        parser.error("at least one tagged car is required (counts are scaled by population / tagged)")
+
+    params = {}
+    for parameter in args.parameters:
+        name, value = parameter.split("=")
+        params[name] = number(value, keepInt=True)
+    duration, binSize = number(args.duration), number(args.bin)
+    setup = None
+    if args.load_curve:
+        def setup(sim):
+            for category in args.load_curve:
+                sim.collector.addLoadCurve(category, binSize, duration)
+    report = validate(args.model, args.template, args.entities.split(","), params, duration,
+                      args.tagged, number(args.calibration), args.population,
+                      args.calibration_cars, binSize, args.seed, setup)
+    if args.save is not None:
+        saveProfiles(report["profiles"], args.save)
+    print("{0:<20} {1:<10} {2:>14} {3:>14} {4:>10}".format("category", "metric", "discrete",
+                                                           "hybrid", "rel.error"))
+    for category, metric, a, b, error in report["rows"]:
+        print("{0:<20} {1:<10} {2:>14.6g} {3:>14.6g} {4:>10.2%}".format(category, metric, a, b,
+                                                                         error))
+    for entityId, (a, b) in report["arrivals"].items():
+        error = abs(b - a) / a if a else float('nan')
+        print("{0:<20} {1:<10} {2:>14} {3:>14} {4:>10.2%}".format(entityId, "arrivals", a, b,
+                                                                   error))
+    times = report["times"]
+    print("(counts and load curves of tagged cars only are scaled by population / tagged)")
+    print("time: calibration {0:.2f}s, discrete {1:.2f}s, hybrid {2:.2f}s (speedup {3:.1f}x)"
+          .format(times["calibration"], times["discrete"], times["hybrid"],
+                  times["discrete"] / times["hybrid"]))
+    print("events: discrete {0}, hybrid {1}".format(*report["events"]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,13 +1,34 @@
 #!/usr/bin/env python3
 
+import os
+import csv
+import heapq
+import bisect
 import subprocess
+import collections
+import numpy as np
+from TimeUtil import DayTime
+
+DAY = 24 * 60 * 60 #period of time profiles of weights
+
+class Constant:
+    "constant value of attribute (function of optional time)"
+    __slots__ = ("value",)
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, t = None):
+        return self.value
 
 def toFunction(value):
-    return value if callable(value) else lambda t=None: value #per key closure
+    return value if callable(value) else Constant(value)
 
 class SGDEntity:
+    modifications = 0 #counter of changes of nodes, edges and attributes (see DiGraph.compiled)
+
     def __init__(self, **kwargs):
         self.attrs = {key : toFunction(value) for key, value in kwargs.items()}
+        SGDEntity.modifications += 1
         if "id" not in self.attrs:
             self.addAttribute("id", self.getDefaultId())
                 
@@ -19,7 +40,8 @@ class SGDEntity:
     def addAttribute(self, key, value):
         if key in self.attrs:
             raise AttributeError("Unambigous attribute")
-        self.attrs[key] = value if callable(value) else lambda t=None: value
+        self.attrs[key] = toFunction(value)
+        SGDEntity.modifications += 1
             
     def __getitem__(self, key):
         return self.attrs[key]
@@ -62,6 +84,7 @@ class SGDNode(SGDEntity):
     def edgeTo(self, target, **kwargs):
         edge = SGDEdge(self, target, **kwargs)
         self.edges.append(edge)
+        SGDEntity.modifications += 1
         return edge
     
     def bidiEdgesTo(self, target, **kwargs):
@@ -69,6 +92,7 @@ class SGDNode(SGDEntity):
         self.edges.append(edge)
         backEdge = SGDEdge(target, self, **kwargs)
         target.edges.append(backEdge)
+        SGDEntity.modifications += 1
         return (edge, backEdge)   #returns pair of edges       
     
     def __str__(self):
@@ -96,12 +120,535 @@ class SGDEdge(SGDEntity):
             attrlist.append("\\n")
         return "{0} -> {1} [label=\"{2}\"]".format(self.start.id(), self.target.id(), "".join(attrlist))
 
+class CompiledGraph:
+    """
+    Directed graph with integer node ids (0..n-1) and edges in CSR arrays (edges of
+    node i are indptr[i]..indptr[i+1]-1 in targets and weight arrays). Shortest paths
+    are computed by Dijkstra algorithm with binary heap (O((V + E) log V)).
+
+    Weights can be time dependent (profile of attribute is daily periodic step function),
+    then shortest paths are computed for given departure time: weight of edge is evaluated
+    at time of arrival to its start node (FIFO property of profiles is assumed).
+
+    Attributes:
+        nodeIds -- external ids of nodes (index -> id), index -- id -> index
+        weights -- weight arrays of edges (attribute -> array in CSR order)
+        profiles -- time profiles of weights (attribute -> (sorted day times of breakpoints,
+                    edges x (breakpoints + 1) matrix), column 0 is weight before the first
+                    breakpoint, column k is weight since breakpoint k-1)
+    """
+    def __init__(self, nodeIds, sources, targets, weights, profiles = None):
+        self.nodeIds = list(nodeIds)
+        self.index = {nodeId : i for i, nodeId in enumerate(self.nodeIds)}
+        sources = np.asarray(sources, dtype=np.int64)
+        order = np.argsort(sources, kind="stable")
+        self.targets = np.asarray(targets, dtype=np.int64)[order]
+        self.indptr = np.zeros(len(self.nodeIds) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(self.nodeIds)), out=self.indptr[1:])
+        self.weights = {attr : np.asarray(values, dtype=np.float64)[order]
+                            for attr, values in weights.items()}
+        self.profiles = {attr : (np.asarray(breakpoints, dtype=np.float64),
+                                 np.asarray(values, dtype=np.float64)[order])
+                            for attr, (breakpoints, values) in (profiles or {}).items()}
+        self._lists = {}
+        self._profileLists = {}
+
+    def __len__(self):
+        return len(self.nodeIds)
+
+    @property
+    def edgeCount(self):
+        return len(self.targets)
+
+    def _adjacency(self, attr):
+        "python lists of CSR arrays (fast scalar access in inner loop)"
+        if attr not in self._lists:
+            self._lists[attr] = (self.indptr.tolist(), self.targets.tolist(),
+                                 self.weights[attr].tolist())
+        return self._lists[attr]
+
+    def _profile(self, attr):
+        if attr not in self._profileLists:
+            breakpoints, values = self.profiles[attr]
+            self._profileLists[attr] = (breakpoints.tolist(), values.tolist())
+        return self._profileLists[attr]
+
+    def timeDependent(self, attr):
+        return attr in self.profiles
+
+    def weightAt(self, attr, edge, time):
+        "weight of edge (CSR position) at given time (sec)"
+        if attr not in self.profiles:
+            return float(self.weights[attr][edge])
+        breakpoints, values = self._profile(attr)
+        return values[edge][bisect.bisect_right(breakpoints, time % DAY)]
+
+    def dijkstra(self, source, attr, targets = None, limit = float('inf'), departure = None):
+        """
+        Shortest distances from source node (index) to all nodes (or until all targets
+        are settled or distances exceed limit). Returns (distance array, predecessor
+        array), unreachable nodes have infinite distance and predecessor -1.
+        Time dependent attribute (travel time in sec) is evaluated for departure time.
+        """
+        if departure is not None and attr in self.profiles:
+            return self._timeDependentDijkstra(source, attr, targets, limit, departure)
+        indptr, adjacent, weights = self._adjacency(attr)
+        distance = [float('inf')] * len(self.nodeIds)
+        previous = [-1] * len(self.nodeIds)
+        settled = bytearray(len(self.nodeIds))
+        remaining = set(targets) if targets is not None else None
+        distance[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if settled[node]:
+                continue
+            if d > limit:
+                break
+            settled[node] = 1
+            if remaining is not None:
+                remaining.discard(node)
+                if not remaining:
+                    break
+            for i in range(indptr[node], indptr[node + 1]):
+                target = adjacent[i]
+                alt = d + weights[i]
+                if alt < distance[target]:
+                    distance[target] = alt
+                    previous[target] = node
+                    heapq.heappush(heap, (alt, target))
+        return np.array(distance), np.array(previous, dtype=np.int64)
+
+    def _timeDependentDijkstra(self, source, attr, targets, limit, departure):
+        indptr, adjacent, weights = self._adjacency(attr)
+        breakpoints, values = self._profile(attr)
+        distance = [float('inf')] * len(self.nodeIds)
+        previous = [-1] * len(self.nodeIds)
+        settled = bytearray(len(self.nodeIds))
+        remaining = set(targets) if targets is not None else None
+        distance[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if settled[node]:
+                continue
+            if d > limit:
+                break
+            settled[node] = 1
+            if remaining is not None:
+                remaining.discard(node)
+                if not remaining:
+                    break
+            slot = bisect.bisect_right(breakpoints, (departure + d) % DAY)
+            for i in range(indptr[node], indptr[node + 1]):
+                target = adjacent[i]
+                alt = d + values[i][slot]
+                if alt < distance[target]:
+                    distance[target] = alt
+                    previous[target] = node
+                    heapq.heappush(heap, (alt, target))
+        return np.array(distance), np.array(previous, dtype=np.int64)
+
+    def oneToMany(self, source, targets, attr, departure = None):
+        "distances from source to targets (indexes)"
+        distance, previous = self.dijkstra(source, attr, targets, departure=departure)
+        return distance[np.asarray(targets, dtype=np.int64)]
+
+    def manyToMany(self, sources, targets, attr, departure = None):
+        "matrix of distances (sources x targets)"
+        return np.array([self.oneToMany(source, targets, attr, departure) for source in sources])
+
+    def path(self, source, target, attr, departure = None):
+        "(distance, list of node indexes from source to target) or (inf, [])"
+        distance, previous = self.dijkstra(source, attr, [target], departure=departure)
+        return (float(distance[target]), pathFromPredecessors(previous, source, target))
+
+    def pathTotals(self, nodes, attr, departure = None):
+        """
+        Sums of all weight attributes along path (edge with minimal attr between nodes).
+        Time dependent weights are evaluated at arrival times to edges for departure time
+        (time advances by attr, i.e. attr is travel time).
+        """
+        indptr, adjacent, weights = self._adjacency(attr)
+        timed = departure is not None and attr in self.profiles
+        totals = {name : 0.0 for name in self.weights}
+        time = departure
+        for node, target in zip(nodes, nodes[1:]):
+            candidates = [i for i in range(indptr[node], indptr[node + 1]) if adjacent[i] == target]
+            if not timed:
+                edge = min(candidates, key=lambda i: weights[i])
+                for name, values in self.weights.items():
+                    totals[name] += float(values[edge])
+                continue
+            edge = min(candidates, key=lambda i: self.weightAt(attr, i, time))
+            for name in totals:
+                totals[name] += self.weightAt(name, edge, time)
+            time = departure + totals[attr]
+        return totals
+
+def loadEdgeList(path):
+    """
+    Graph from CSV edge list with header: source, target and names of weight attributes
+    (e.g. source,target,length,time). Node ids are strings.
+
+    Columns attr@daytime (e.g. time@7:00,time@9:30) define time profile of attribute:
+    weight since given day time (until next breakpoint, empty cell = base weight).
+    """
+    index = {}
+    sources, targets = [], []
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        columns = [name.strip() for name in next(reader)[2:]]
+        attrs = [name for name in columns if "@" not in name]
+        weights = {attr : [] for attr in attrs}
+        breakpoints = {} #attr -> list of (day time, column)
+        for column, name in enumerate(columns):
+            if "@" in name:
+                attr, daytime = name.split("@", 1)
+                breakpoints.setdefault(attr.strip(), []).append(
+                    (DayTime.fromString(daytime).totalSecond % DAY, column))
+        for attr in breakpoints:
+            if attr not in weights:
+                raise KeyError("profile of unknown attribute {0}".format(attr))
+            breakpoints[attr].sort()
+        profiles = {attr : [] for attr in breakpoints}
+        for row in reader:
+            if not row or row[0].startswith("#"):
+                continue
+            sources.append(index.setdefault(row[0].strip(), len(index)))
+            targets.append(index.setdefault(row[1].strip(), len(index)))
+            values = dict(zip(columns, row[2:]))
+            for attr in attrs:
+                weights[attr].append(float(values[attr]))
+            for attr, points in breakpoints.items():
+                base = weights[attr][-1]
+                profiles[attr].append([base] + [float(row[2 + column]) if row[2 + column].strip()
+                                                    else base for time, column in points])
+    return CompiledGraph(list(index), sources, targets, weights,
+                         {attr : ([time for time, column in breakpoints[attr]], profiles[attr])
+                              for attr in breakpoints})
+
+class PathCache:
+    """
+    Bounded LRU cache of shortest paths (source, target, attr) -> (node indexes, totals of
+    weight attributes along path). Distances of selected node pairs can be precomputed
+    into matrix (see precompute).
+
+    Paths by time dependent attribute are cached per time bucket (bucket seconds, e.g.
+    15 minutes), i.e. they are computed for departure at start of bucket and shared by
+    all departures in the same bucket.
+    """
+    def __init__(self, graph, maxSize = 100000, bucket = 900.0):
+        self.graph = graph
+        self.maxSize = maxSize
+        self.bucket = bucket
+        self.paths = collections.OrderedDict()
+        self.matrices = {} #attr -> (source index -> row, target index -> column, matrix)
+        self.hierarchies = {} #attr -> ContractionHierarchy (used for point to point paths)
+        self.hits = 0
+        self.misses = 0
+
+    def departure(self, attr, time):
+        "start of time bucket of time (None for static attribute or time)"
+        if time is None or not self.graph.timeDependent(attr):
+            return None
+        return (time // self.bucket) * self.bucket
+
+    def route(self, source, target, attr, time = None):
+        departure = self.departure(attr, time)
+        key = (source, target, attr, departure)
+        cached = self.paths.get(key)
+        if cached is not None:
+            self.paths.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        hierarchy = self.hierarchies.get(attr)
+        distance, nodes = (hierarchy.path(source, target)
+                              if hierarchy is not None and departure is None
+                              else self.graph.path(source, target, attr, departure))
+        cached = (nodes, self.graph.pathTotals(nodes, attr, departure) if nodes else {})
+        self.paths[key] = cached
+        if len(self.paths) > self.maxSize:
+            self.paths.popitem(last=False)
+        return cached
+
+    def precompute(self, sources, targets, attr):
+        "distance matrix of sources x targets (node indexes)"
+        self.matrices[attr] = ({source : i for i, source in enumerate(sources)},
+                               {target : j for j, target in enumerate(targets)},
+                               self.graph.manyToMany(sources, targets, attr))
+
+    def distance(self, source, target, attr, time = None):
+        if attr in self.matrices and self.departure(attr, time) is None:
+            rows, columns, matrix = self.matrices[attr]
+            if source in rows and target in columns:
+                self.hits += 1
+                return float(matrix[rows[source], columns[target]])
+        nodes, totals = self.route(source, target, attr, time)
+        return totals.get(attr, float('inf')) if nodes else float('inf')
+
+    def __str__(self):
+        return "paths: {0}, hits: {1}, misses: {2}".format(len(self.paths), self.hits,
+                                                          self.misses)
+
+class ShortestPathTree:
+    """
+    Shortest path tree from source under current weights of traffic state, repaired
+    incrementally after change of edge weight: decrease is propagated from target of
+    the edge, increase of tree edge invalidates only subtree below the edge, which is
+    reconnected from unaffected nodes (full recomputation if subtree is too large).
+    """
+    def __init__(self, traffic, source):
+        self.traffic = traffic
+        self.source = source
+        self.recompute()
+
+    def recompute(self):
+        n = len(self.traffic.graph)
+        self.distance = [float('inf')] * n
+        self.parent = [-1] * n #edge from predecessor
+        self.distance[self.source] = 0.0
+        self._relax([(0.0, self.source)])
+        self.traffic.recomputations += 1
+
+    def _relax(self, heap):
+        indptr, targets, weights = self.traffic.indptr, self.traffic.targets, self.traffic.weights
+        distance, parent = self.distance, self.parent
+        heapq.heapify(heap)
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > distance[node]:
+                continue
+            for i in range(indptr[node], indptr[node + 1]):
+                target = targets[i]
+                alt = d + weights[i]
+                if alt < distance[target]:
+                    distance[target] = alt
+                    parent[target] = i
+                    heapq.heappush(heap, (alt, target))
+
+    def _subtree(self, root):
+        indptr, targets = self.traffic.indptr, self.traffic.targets
+        nodes = [root]
+        for node in nodes: #list grows during iteration
+            for i in range(indptr[node], indptr[node + 1]):
+                if self.parent[targets[i]] == i:
+                    nodes.append(targets[i])
+        return nodes
+
+    def update(self, edge, old, new):
+        "adapts tree to changed weight of edge, returns True if tree is changed"
+        traffic = self.traffic
+        u, v = traffic.sources[edge], traffic.targets[edge]
+        if new < old:
+            alt = self.distance[u] + new
+            if alt >= self.distance[v]:
+                return False
+            self.distance[v] = alt
+            self.parent[v] = edge
+            self._relax([(alt, v)])
+            traffic.repairs += 1
+            return True
+        if self.parent[v] != edge:
+            return False
+        affected = self._subtree(v)
+        if len(affected) > traffic.maxAffected * len(self.distance):
+            self.recompute()
+            return True
+        for node in affected:
+            self.distance[node] = float('inf')
+            self.parent[node] = -1
+        heap = []
+        for node in affected:
+            for i in range(traffic.reverseIndptr[node], traffic.reverseIndptr[node + 1]):
+                incoming = traffic.reverseEdges[i]
+                alt = self.distance[traffic.sources[incoming]] + traffic.weights[incoming]
+                if alt < self.distance[node]:
+                    self.distance[node] = alt
+                    self.parent[node] = incoming
+            if self.distance[node] < float('inf'):
+                heap.append((self.distance[node], node))
+        self._relax(heap)
+        traffic.repairs += 1
+        return True
+
+    def path(self, target):
+        "(list of nodes, list of edges) from source to target or ([], []) if unreachable"
+        if self.distance[target] == float('inf'):
+            return [], []
+        edges = []
+        node = target
+        while node != self.source:
+            edges.append(self.parent[node])
+            node = self.traffic.sources[self.parent[node]]
+        edges.reverse()
+        return [self.source] + [self.traffic.targets[edge] for edge in edges], edges
+
+class TrafficState:
+    """
+    Congestion feedback of travel times: load of edge is number of cars currently
+    on the edge, travel time is given by BPR function time * (1 + alpha * (load /
+    capacity) ^ beta). Routing uses shortest path trees (per source, LRU bounded) under
+    committed weights; weight is committed (and trees are repaired incrementally, see
+    ShortestPathTree) only if it differs from committed one by more than threshold
+    (relative change).
+
+    Counters:
+        repairs -- incremental repairs of trees, recomputations -- full Dijkstra searches,
+        commits -- committed weight changes, deferred -- changes under threshold
+    """
+    def __init__(self, graph, attr = "time", capacity = "capacity", alpha = 0.15, beta = 4.0,
+                 threshold = 0.05, maxTrees = 1000, maxAffected = 0.5):
+        if capacity not in graph.weights:
+            raise KeyError("capacity attribute {0} of edges is missing".format(capacity))
+        self.graph = graph
+        self.attr = attr
+        self.alpha = alpha
+        self.beta = beta
+        self.threshold = threshold
+        self.maxTrees = maxTrees
+        self.maxAffected = maxAffected
+        self.indptr, self.targets, baseWeights = graph._adjacency(attr)
+        self.sources = np.repeat(np.arange(len(graph)), np.diff(graph.indptr)).tolist()
+        self.reverseEdges = np.argsort(graph.targets, kind="stable").tolist()
+        self.reverseIndptr = np.zeros(len(graph) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(graph.targets, minlength=len(graph)), out=self.reverseIndptr[1:])
+        self.reverseIndptr = self.reverseIndptr.tolist()
+        self.base = list(baseWeights)
+        self.capacity = graph.weights[capacity].tolist()
+        self.weights = list(baseWeights) #committed weights (used by trees)
+        self.load = [0] * graph.edgeCount
+        self.trees = collections.OrderedDict()
+        self.repairs = 0
+        self.recomputations = 0
+        self.commits = 0
+        self.deferred = 0
+
+    def travelTime(self, edge):
+        "current (not only committed) travel time of edge"
+        capacity = self.capacity[edge]
+        ratio = self.load[edge] / capacity if capacity > 0 else 0.0
+        return self.base[edge] * (1.0 + self.alpha * ratio ** self.beta)
+
+    def _changed(self, edge):
+        new, old = self.travelTime(edge), self.weights[edge]
+        if abs(new - old) <= self.threshold * old:
+            self.deferred += 1
+            return
+        self.weights[edge] = new
+        self.commits += 1
+        for tree in self.trees.values():
+            tree.update(edge, old, new)
+
+    def enter(self, edge):
+        "car enters edge, returns its travel time"
+        self.load[edge] += 1
+        self._changed(edge)
+        return self.travelTime(edge)
+
+    def leave(self, edge):
+        self.load[edge] -= 1
+        self._changed(edge)
+
+    def tree(self, source):
+        tree = self.trees.get(source)
+        if tree is None:
+            tree = ShortestPathTree(self, source)
+            self.trees[source] = tree
+            if len(self.trees) > self.maxTrees:
+                self.trees.popitem(last=False)
+        else:
+            self.trees.move_to_end(source)
+        return tree
+
+    def route(self, source, target):
+        "(list of nodes, list of edges) of the shortest path under committed weights"
+        return self.tree(source).path(target)
+
+    def clear(self):
+        "removes all cars from edges"
+        self.load = [0] * self.graph.edgeCount
+        self.weights = list(self.base)
+        self.trees.clear()
+
+    def __str__(self):
+        return "trees: {0}, repairs: {1}, recomputations: {2}, commits: {3}, deferred: {4}".format(
+                    len(self.trees), self.repairs, self.recomputations, self.commits, self.deferred)
+
+class RoadNetwork:
+    "compiled graph of network file with path cache (shared by all routes of process)"
+    def __init__(self, graph, maxPaths = 100000, path = None):
+        self.graph = graph
+        self.path = path
+        self.paths = PathCache(graph, maxPaths)
+
+    def useHierarchy(self, attr):
+        "point to point paths by contraction hierarchy (persistent index beside network file)"
+        if attr not in self.paths.hierarchies:
+            from ContractionHierarchy import ContractionHierarchy
+            self.paths.hierarchies[attr] = ContractionHierarchy.forFile(self.path, self.graph,
+                                                                        attr)
+            self.paths.paths.clear()
+
+    def useTraffic(self, simulation, attr, **kwargs):
+        """
+        congestion feedback routing by travel time attr (see TrafficState), the state
+        is shared object of simulation (it is discarded by Simulation.reset)
+        """
+        key = ("traffic", self.path, attr)
+        traffic = simulation.sharedObjects.get(key)
+        if traffic is None:
+            traffic = TrafficState(self.graph, attr, **kwargs)
+            simulation.sharedObjects[key] = traffic
+        return traffic
+
+    def node(self, nodeId):
+        "index of node given by id (numeric ids may be given as numbers)"
+        index = self.graph.index.get(nodeId)
+        if index is None and isinstance(nodeId, (int, float)):
+            index = self.graph.index.get(str(int(nodeId)), self.graph.index.get(int(nodeId)))
+        if index is None:
+            raise KeyError("unknown node {0}".format(nodeId))
+        return index
+
+    def route(self, origin, destination, attr, time = None):
+        """
+        (list of node ids, totals of weight attributes) of the shortest path by attr
+        (for departure time if attr is time dependent)
+        """
+        nodes, totals = self.paths.route(self.node(origin), self.node(destination), attr, time)
+        return [self.graph.nodeIds[node] for node in nodes], totals
+
+networks = {} #loaded networks (path -> (mtime, RoadNetwork))
+
+def loadNetwork(path):
+    "road network from CSV edge list (reloaded if the file is changed)"
+    mtime = os.path.getmtime(path)
+    cached = networks.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, RoadNetwork(loadEdgeList(path), path=path))
+        networks[path] = cached
+    return cached[1]
+
+def pathFromPredecessors(previous, source, target):
+    "list of nodes from source to target given by predecessor array ([] if unreachable)"
+    path = [target]
+    while path[-1] != source:
+        if previous[path[-1]] < 0:
+            return []
+        path.append(int(previous[path[-1]]))
+    path.reverse()
+    return path
+
 class DiGraph:
     def __init__(self, *args):
         self.nodes = list(args)
+        self.compiledGraphs = {} #attr -> (state of graph, CompiledGraph, index of nodes)
     
     def addNode(self, node):
         self.nodes.append(node)
+        SGDEntity.modifications += 1
     
     def ifTrueFilter(self, attrName):
         return [node for node in self.nodes if node.get(attrName, False)]
@@ -109,32 +656,72 @@ class DiGraph:
     def __len__(self):
         return len(self.nodes)
     
-    def getDistances(self, startNode, attr):
-        distances = {}
-        queue = []
-        
+    def compile(self, attrs):
+        "compact representation (see CompiledGraph) with weights of given attributes"
+        index = {node : i for i, node in enumerate(self.nodes)}
+        sources, targets, weights = [], [], {attr : [] for attr in attrs}
         for node in self.nodes:
-            if (node != startNode):
-                distances[node] = SGDDistance(float('inf'), None)
-            else:
-                distances[node] = SGDDistance(0, None)
-            queue.append(node)
-        
-        while (len(queue) > 0):
-            minimum = distances[min(queue, key=lambda node: distances[node].distance)].distance
-            if (minimum == float('inf')):
-                break # discontinuous graph
-            for node in [node for node in queue if distances[node].distance == minimum]:
-                queue.remove(node)
-                for edge in node.edges:
-                    # TODO: capacity of edges
-                    alt = distances[edge.start].distance + edge.attrs[attr]() + edge.start.attrs[attr]()
-                    if (distances[edge.target].distance > alt):
-                        distances[edge.target] = SGDDistance(alt, node)
-        
-        return distances
+            for edge in node.edges:
+                sources.append(index[node])
+                targets.append(index[edge.target])
+                for attr in attrs:
+                    weights[attr].append(edge.attrs[attr]() + node.attrs[attr]())
+        return CompiledGraph([node.id() for node in self.nodes], sources, targets, weights)
+
+    def compiled(self, attr):
+        """
+        (compiled graph, index of nodes) with weights of attr. It is cached until nodes,
+        edges or attributes are changed (graphs with functional weights are compiled
+        for every call, their values may change).
+        """
+        state = (SGDEntity.modifications, len(self.nodes),
+                 sum(len(node.edges) for node in self.nodes))
+        cached = self.compiledGraphs.get(attr)
+        if cached is not None and cached[0] == state:
+            return cached[1], cached[2]
+        graph = self.compile([attr])
+        index = {node : i for i, node in enumerate(self.nodes)}
+        if all(isinstance(node.attrs[attr], Constant)
+                   and all(isinstance(edge.attrs[attr], Constant) for edge in node.edges)
+                   for node in self.nodes):
+            self.compiledGraphs[attr] = (state, graph, index)
+        return graph, index
+
+    def getDistances(self, startNode, attr, departure = None):
+        """
+        Shortest distances from startNode by attr (node -> SGDDistance). If departure
+        is given, weights are evaluated at time of arrival to edge (attr is travel time).
+        """
+        if departure is not None:
+            return self.getTimeDependentDistances(startNode, attr, departure)
+        graph, index = self.compiled(attr)
+        distance, previous = graph.dijkstra(index[startNode], attr)
+        return {node : SGDDistance(float(distance[i]),
+                                   self.nodes[previous[i]] if previous[i] >= 0 else None)
+                    for i, node in enumerate(self.nodes)}
     
-    def processDistance(self, distances, finalNode):
+    def getTimeDependentDistances(self, startNode, attr, departure):
+        "time dependent Dijkstra over functions of time t (FIFO property is assumed)"
+        distances = {node : SGDDistance(float('inf'), None) for node in self.nodes}
+        distances[startNode].distance = 0.0
+        settled = set()
+        heap = [(0.0, 0, startNode)]
+        counter = 1 #tie breaker (nodes are not comparable)
+        while heap:
+            d, order, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            t = departure + d
+            for edge in node.edges:
+                alt = d + edge.attrs[attr](t) + node.attrs[attr](t)
+                if alt < distances[edge.target].distance:
+                    distances[edge.target] = SGDDistance(alt, node)
+                    heapq.heappush(heap, (alt, counter, edge.target))
+                    counter += 1
+        return distances
+
+    def processDistance(self, distances, finalNode, startNode):
         path = []
         temp = finalNode
         while (temp != startNode):
@@ -144,12 +731,12 @@ class DiGraph:
             temp = distances[temp].previous
         return path
     
-    def getPaths(self, startNode, attr, nodeFilter=lambda node: True):
-        distances = self.getDistances(startNode, attr)
+    def getPaths(self, startNode, attr, nodeFilter=lambda node: True, departure = None):
+        distances = self.getDistances(startNode, attr, departure)
         paths = []
         for finalNode in distances.keys():
             if nodeFilter(finalNode):
-                paths.append(SGDPath(startNode, finalNode, distances[finalNode].distance, self.processDistance(distances, finalNode)))
+                paths.append(SGDPath(startNode, finalNode, distances[finalNode].distance, self.processDistance(distances, finalNode, startNode)))
         return paths
     
     def toDot(self):
@@ -167,44 +754,43 @@ class DiGraph:
         code.append("}\n")
         return ''.join(code)
 
-nA = SGDNode(id="A", delay=0, final=0)
-nB = SGDNode(id="B", delay=0, final=0)
-nC = SGDNode(id="C", delay=0, final=0)
-nD = SGDNode(id="D", delay=0, final=0)
-nE = SGDNode(id="E", delay=0, final=1)
-nF = SGDNode(id="F", delay=0, final=1)
-nG = SGDNode(id="G", delay=0, final=1)
-nX = SGDNode(id="X", delay=0, final=0)
-
-graph = DiGraph(nA, nB, nC, nD, nE, nF, nG, nX)
-
-nA.edgeTo(nB, delay=1)
-nA.edgeTo(nC, delay=3)
-nA.edgeTo(nF, delay=8)
-nB.edgeTo(nD, delay=4)
-nB.edgeTo(nF, delay=9)
-nC.edgeTo(nE, delay=1)
-nC.edgeTo(nF, delay=2)
-nD.edgeTo(nG, delay=2)
-nD.edgeTo(nF, delay=5)
-nE.bidiEdgesTo(nF, delay=1)
-nG.bidiEdgesTo(nF, delay=1)
-
-# z A do A je 0
-# z A do B je 1
-# z A do C je 3
-# z A do D je 5
-# z A do E je 4
-# z A do F je 5
-# z A do G je 6
-
-print(graph.toDot())
-
-startNode = nA
-for path in graph.getPaths(startNode, "delay", lambda node: node.final()):
-    print(str(path))
-print()
-for path in graph.getPaths(startNode, "delay"):
-    print(str(path))
+if __name__ == '__main__':
+    nA = SGDNode(id="A", delay=0, final=0)
+    nB = SGDNode(id="B", delay=0, final=0)
+    nC = SGDNode(id="C", delay=0, final=0)
+    nD = SGDNode(id="D", delay=0, final=0)
+    nE = SGDNode(id="E", delay=0, final=1)
+    nF = SGDNode(id="F", delay=0, final=1)
+    nG = SGDNode(id="G", delay=0, final=1)
+    nX = SGDNode(id="X", delay=0, final=0)
+
+    graph = DiGraph(nA, nB, nC, nD, nE, nF, nG, nX)
+
+    nA.edgeTo(nB, delay=1)
+    nA.edgeTo(nC, delay=3)
+    nA.edgeTo(nF, delay=8)
+    nB.edgeTo(nD, delay=4)
+    nB.edgeTo(nF, delay=9)
+    nC.edgeTo(nE, delay=1)
+    nC.edgeTo(nF, delay=2)
+    nD.edgeTo(nG, delay=2)
+    nD.edgeTo(nF, delay=5)
+    nE.bidiEdgesTo(nF, delay=1)
+    nG.bidiEdgesTo(nF, delay=1)
+
+    # z A do A je 0
+    # z A do B je 1
+    # z A do C je 3
+    # z A do D je 5
+    # z A do E je 4
+    # z A do F je 5
+    # z A do G je 6
 
+    print(graph.toDot())
 
+    startNode = nA
+    for path in graph.getPaths(startNode, "delay", lambda node: node.final()):
+        print(str(path))
+    print()
+    for path in graph.getPaths(startNode, "delay"):
+        print(str(path))
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import random
+import hashlib
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import Etos
+import Transaction
+from UrlUtil import xmlLoader, xmlStringLoader, XmlSource
+from Collector import Collector, confidenceInterval
+
+def parameterKey(params):
+    "hash of (fully specified) parameter dictionary"
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+def replicationSeeds(n, seed = None):
+    "n independent seeds derived from (optional) master seed"
+    return [int(state[0]) for state in
+                (child.generate_state(1) for child in np.random.SeedSequence(seed).spawn(n))]
+
+compiledModels = {} #loaded models of process (model -> XmlSource), inherited by forked workers
+builtModels = set() #models with prebuilt templates (see buildTemplates)
+workerSimulation = None #simulation reused by all replications of process
+
+def compileModel(model, modules = ("ECarModel", "Pause"), params = None):
+    """
+    Registers modules and loads model (url or xml string) once per process. If params
+    are given, templates of model are prebuilt too (see buildTemplates). Models compiled
+    in parent before creation of pool are shared by forked workers (copy on write).
+    """
+    if model not in compiledModels:
+        for name in modules:
+            Etos.registerModule(importlib.import_module(name))
+        compiledModels[model] = (xmlStringLoader(model) if model.strip().startswith("<")
+                                    else xmlLoader(model))
+    if params is not None and model not in builtModels:
+        builtModels.add(model)
+        buildTemplates(compiledModels[model], params)
+    return compiledModels[model]
+
+def entityTree(entities):
+    "entities of entity tree (incl. subentities of control entities)"
+    for entity in entities:
+        yield entity
+        if isinstance(entity, Transaction.ControlEntity):
+            yield from entityTree(entity.subentities)
+
+def buildTemplates(node, params):
+    """
+    Builds transaction of model and transactions of all templates reachable from it
+    (start_transaction, transaction) in throwaway simulation with params. Parsed documents,
+    entity sources, checkpoint measures and random generators (process wide caches)
+    are then created only once and they are shared by forked workers.
+    """
+    sim = Etos.Simulation()
+    sim.disableLog()
+    sim.setParameters(**params)
+    built = set()
+    pending = [(node, XmlSource())]
+    while pending:
+        transactionNode, entitiesNode = pending.pop()
+        key = Transaction.TransactionPool.key(transactionNode, entitiesNode)
+        if key in built:
+            continue
+        built.add(key)
+        t = Transaction.Transaction(transactionNode, sim, entitiesXmlNode=entitiesNode)
+        for entity in entityTree(t.entities):
+            if isinstance(entity, Transaction.TransactionEntity):
+                pending.append((entity.transactionNode, entity.entitiesNode))
+
+def poolContext():
+    "multiprocessing context of worker pools (fork if available)"
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+def runReplication(job):
+    """
+    Runs one replication in worker process and returns snapshot of its collector.
+    job = (model, parameters, seed, module names, duration, setup function or None)
+    """
+    global workerSimulation
+    model, params, seed, modules, duration, setup = job
+    node = compileModel(model, modules)
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    if workerSimulation is None:
+        workerSimulation = Etos.Simulation()
+        workerSimulation.disableLog()
+    else:
+        workerSimulation.reset()
+    sim = workerSimulation
+    sim.setParameters(**params)
+    if setup is not None:
+        setup(sim)
+    sim.start(node, duration)
+    return sim.collector.snapshot()
+
+def replicate(model, params, n, workers = None, modules = ("ECarModel", "Pause"),
+              seed = None, duration = 0xFFFFFFFF, setup = None, cache = None):
+    """
+    Runs n independent replications of model (url or xml string) with distinct seeds
+    in pool of worker processes (workers = None -> number of CPUs, workers = 1 -> in
+    current process) and returns merged collector (see Collector.merge and
+    Collector.confidenceInterval).
+
+    setup -- optional (picklable) function called with simulation before start
+             (e.g. declaration of load curves)
+    cache -- optional ResultCache, cached replications are not simulated
+    """
+    seeds = replicationSeeds(n, seed)
+    jobs = [(model, dict(params), seed, tuple(modules), duration, setup) for seed in seeds]
+    if cache is None:
+        return Collector.merge(runReplications(jobs, workers))
+    keys = cache.keys(model, dict(params), seeds, duration, modules, setup)
+    snapshots = [cache.get(key) for key in keys]
+    missing = [i for i, snapshot in enumerate(snapshots) if snapshot is None]
+    for i, snapshot in zip(missing, runReplications([jobs[i] for i in missing], workers)):
+        cache.put(keys[i], snapshot)
+        snapshots[i] = snapshot
+    return Collector.merge(snapshots)
+
+def runReplications(jobs, workers = None):
+    "snapshots of replications (in order of jobs)"
+    if workers == 1 or len(jobs) <= 1:
+        return [runReplication(job) for job in jobs]
+    compileModel(jobs[0][0], jobs[0][3], jobs[0][1])
+    with poolContext().Pool(workers) as pool:
+        return pool.map(runReplication, jobs, chunksize=1)
+
+class Target:
+    """
+    Precision target of output metric: relative half-width of confidence interval of
+    metric (mean over replications) must be lower or equal to precision.
+    Metric is function of collector snapshot or expression over categories
+    (e.g. "charged_f.sum / charged_h.sum").
+    """
+    def __init__(self, metric, precision, level = 0.95):
+        self.metric = metric
+        self.name = metric if isinstance(metric, str) else metric.__name__
+        self.precision = precision
+        self.level = level
+
+    @staticmethod
+    def parse(spec):
+        "parses target specification in the form 'expression <= precision'"
+        metric, precision = spec.rsplit("<=", 1)
+        return Target(metric.strip(), float(precision))
+
+    def value(self, collector):
+        if callable(self.metric):
+            return float(self.metric(collector))
+        return float(eval(self.metric, {"__builtins__" : {}}, dict(collector.categories)))
+
+    def estimate(self, values):
+        "(mean, half-width) of confidence interval"
+        return confidenceInterval(values, self.level)
+
+    def ratio(self, values):
+        "relative half-width divided by precision (<= 1.0 if target is met)"
+        if len(values) < 2:
+            return float('inf')
+        mean, halfWidth = self.estimate(values)
+        if mean == 0.0:
+            return 0.0 if halfWidth == 0.0 else float('inf')
+        return halfWidth / abs(mean) / self.precision
+
+class AdaptivePoint:
+    "state of sequential replications of one point"
+    def __init__(self, point, seed, targets, minReplications, maxReplications):
+        self.point = point
+        self.seeds = np.random.SeedSequence([seed, int(parameterKey(point)[:12], 16)])
+        self.targets = targets
+        self.minReplications = minReplications
+        self.maxReplications = maxReplications
+        self.snapshots = []
+        self.values = [[] for target in targets]
+        self.running = 0
+
+    def nextSeed(self):
+        return int(self.seeds.spawn(1)[0].generate_state(1)[0])
+
+    def add(self, snapshot):
+        self.snapshots.append(snapshot)
+        for values, target in zip(self.values, self.targets):
+            values.append(target.value(snapshot))
+
+    def need(self):
+        "priority of next replication (None = no more replications)"
+        scheduled = len(self.snapshots) + self.running
+        if scheduled >= self.maxReplications or self.satisfied():
+            return None
+        if scheduled < self.minReplications:
+            return float('inf')
+        if self.running > 0 and len(self.snapshots) < self.minReplications:
+            return None #wait for initial replications
+        return max(target.ratio(values) for values, target in zip(self.values, self.targets))
+
+    def satisfied(self):
+        return (len(self.snapshots) >= self.minReplications and
+                all(target.ratio(values) <= 1.0 for values, target in zip(self.values,
+                                                                         self.targets)))
+
+    @property
+    def finished(self):
+        return self.running == 0 and (self.satisfied() or
+                                      len(self.snapshots) >= self.maxReplications)
+
+    def result(self):
+        collector = Collector.merge(self.snapshots)
+        estimates = {target.name : target.estimate(values) + (len(values),)
+                        for values, target in zip(self.values, self.targets)}
+        return self.point, collector, estimates
+
+def replicateAdaptive(model, points, targets, minReplications = 3, maxReplications = 100,
+                      workers = None, modules = ("ECarModel", "Pause"), seed = 0,
+                      duration = 0xFFFFFFFF, setup = None):
+    """
+    Sequential replications of several points (parameter dictionaries): replications of
+    every point are scheduled until all precision targets are met or maxReplications is
+    reached. Free workers always get replication of the point with the worst precision.
+    Yields (point, merged collector, {target: (mean, half-width, replications)}) as the
+    points are finished.
+    """
+    states = [AdaptivePoint(dict(point), seed, targets, minReplications, maxReplications)
+                for point in points]
+    capacity = workers if workers is not None else os.cpu_count()
+    compileModel(model, modules, states[0].point if states else None)
+    with ProcessPoolExecutor(capacity, mp_context=poolContext()) as executor:
+        running = {}
+        while True:
+            while len(running) < capacity:
+                candidates = [(state.need(), -i) for i, state in enumerate(states)]
+                candidates = [candidate for candidate in candidates if candidate[0] is not None]
+                if not candidates:
+                    break
+                state = states[-max(candidates)[1]] #the worst precision, then the first point
+                job = (model, state.point, state.nextSeed(), tuple(modules), duration, setup)
+                running[executor.submit(runReplication, job)] = state
+                state.running += 1
+            if not running:
+                break
+            done, notDone = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                state = running.pop(future)
+                state.running -= 1
+                state.add(future.result())
+                if state.finished:
+                    states.remove(state)
+                    yield state.result()
+
+def replicateUntil(model, params, targets, **kwargs):
+    "sequential replications of one point until targets are met, returns merged collector"
+    point, collector, estimates = next(replicateAdaptive(model, [params], targets, **kwargs))
+    return collector
+
+if __name__ == '__main__':
+    # usage: Replication.py model-url replications [parameter=value ...]
+    from XValue import number
+    params = {}
+    for arg in sys.argv[3:]:
+        key, value = arg.split("=")
+        params[key] = number(value, keepInt=True)
+    result = replicate(sys.argv[1], params, int(sys.argv[2]))
+    for category, (mean, halfWidth) in sorted(result.confidenceIntervals().items()):
+        print("{0}: {1} +- {2}".format(category, mean, halfWidth))
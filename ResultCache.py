@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import pickle
+import hashlib
+import importlib
+import importlib.util
+from urllib.request import urlopen
+from UrlUtil import resolveUrl, etree
+
+LINK_ATTRIBUTES = ("transactionUrl", "entityUrl", "entities", "actor")
+
+def fileAttributes(modules):
+    "attributes with urls of data files declared by entities of modules (fileAttributes)"
+    names = set()
+    for name in modules:
+        for cls in importlib.import_module(name).__dict__.values():
+            names.update(getattr(cls, "fileAttributes", ()))
+    return sorted(names)
+
+def fileDigest(target):
+    "hash of content of data file (or of url if it is not file, e.g. builtin charging curve)"
+    try:
+        with urlopen(target) as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except (OSError, ValueError):
+        return hashlib.sha256(target.encode("utf-8")).hexdigest()
+
+def modelDigest(model, modules = ("ECarModel", "Pause")):
+    """
+    Hash of fully resolved model (url or xml string): contents of all documents reachable
+    from model through link attributes (transactionUrl, entityUrl, entities, actor)
+    and of data files given by file attributes of entities of modules (e.g. network,
+    stations, curve).
+    """
+    digests = []
+    queue = []
+    visited = set()
+    files = set()
+    dataAttributes = fileAttributes(modules)
+
+    def scan(root, base):
+        for element in root.iter():
+            for name in LINK_ATTRIBUTES:
+                for url in (element.get(name) or "").split("|"):
+                    if url != "" and (base is not None or not url.startswith("#")):
+                        queue.append(resolveUrl(url, base)[0])
+            for name in dataAttributes:
+                url = element.get(name)
+                if url is not None:
+                    target = resolveUrl(url, base)[0]
+                    if target not in files:
+                        files.add(target)
+                        digests.append(fileDigest(target))
+
+    if model.strip().startswith("<"):
+        digests.append(hashlib.sha256(model.encode("utf-8")).hexdigest())
+        scan(etree.fromstring(model), None)
+        fragments = []
+    else:
+        fragments = [resolveUrl(url)[2] for url in model.split("|")]
+        queue.extend(resolveUrl(url)[0] for url in model.split("|"))
+    while queue:
+        target = queue.pop()
+        if target in visited:
+            continue
+        visited.add(target)
+        with urlopen(target) as f:
+            content = f.read()
+        digests.append(hashlib.sha256(content).hexdigest())
+        scan(etree.fromstring(content), target)
+    return hashlib.sha256(json.dumps([sorted(digests), fragments]).encode("utf-8")).hexdigest()
+
+#simulation core and model libraries, results don't depend on other (calling) modules
+CORE_MODULES = ("Etos", "Transaction", "Entity", "Model", "Actor", "XValue", "Collector",
+                "Sampler", "PropertyGetter", "UrlUtil", "TimeUtil", "Cohort", "Replication",
+                "CommonShared", "Pause", "ECarModel", "Graph", "ContractionHierarchy",
+                "SpatialIndex", "ChargingCurve", "ChargingHub")
+
+def codeVersion(modules = ()):
+    "hash of sources of core modules and of model modules (__main__ is never included)"
+    digest = hashlib.sha256()
+    for name in sorted(set(CORE_MODULES).union(modules) - {"__main__"}):
+        spec = importlib.util.find_spec(name)
+        if spec is None or spec.origin is None or not os.path.isfile(spec.origin):
+            continue
+        with open(spec.origin, "rb") as f:
+            digest.update(name.encode("utf-8") + f.read())
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    On-disk cache of collector snapshots of replications keyed by hash of resolved model,
+    parameters, seed, duration, modules, setup function and ETOS code version.
+    Total size is bounded, least recently used entries are evicted.
+    """
+    def __init__(self, directory, maxBytes = 1 << 30):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def keys(self, model, params, seeds, duration = 0xFFFFFFFF,
+             modules = ("ECarModel", "Pause"), setup = None):
+        "keys of replications of model with seeds"
+        for name in modules:
+            importlib.import_module(name)
+        setupName = (None if setup is None
+                        else "{0}.{1}".format(setup.__module__, setup.__qualname__))
+        description = dict(model=modelDigest(model, modules), params=params, duration=duration,
+                           modules=list(modules), setup=setupName,
+                           version=codeVersion(modules))
+        return [hashlib.sha256(json.dumps(dict(description, seed=seed), sort_keys=True,
+                                          default=str).encode("utf-8")).hexdigest()
+                    for seed in seeds]
+
+    def key(self, model, params, seed, *args, **kwargs):
+        return self.keys(model, params, [seed], *args, **kwargs)[0]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get(self, key):
+        "returns cached snapshot or None"
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        os.utime(path) #recently used
+        self.hits += 1
+        return snapshot
+
+    def put(self, key, snapshot):
+        path = self._path(key)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        self.evict()
+
+    def entries(self):
+        "list of (time of last use, size, path)"
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pickle"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        "removes least recently used entries above size limit"
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        for mtime, entrySize, path in entries:
+            if size <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entrySize
+
+    def invalidate(self, key = None):
+        "removes one entry or (key = None) all entries"
+        paths = [self._path(key)] if key is not None else [entry[2] for entry in self.entries()]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __str__(self):
+        entries = self.entries()
+        return "entries: {0}, size: {1}, hits: {2}, misses: {3}".format(
+                    len(entries), sum(entry[1] for entry in entries), self.hits, self.misses)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+from SimPy.Simulation import *
+from PropertyGetter import Property
+import numpy as np
+
+class Sampler(Process):
+    """
+    Simulation level process which periodically samples properties of all live actors
+    (registry Simulation.liveActors) into preallocated matrices (actors x samples).
+    Row of matrix is index of actor (Actor.index), column is index of sample. Values of
+    actors which were not alive at the time of sampling (or have not the property) are NaN.
+
+    Attributes:
+        properties -- property specifications (only a., t. and s. locators are supported,
+                      t. refers to owning transaction of actor)
+        interval -- sampling interval (sec)
+        samples -- number of samples (horizon / interval + 1)
+    """
+    def __init__(self, simulation, properties, interval, horizon):
+        super().__init__(sim=simulation)
+        self.simulation = simulation
+        self.propSpecs = list(properties)
+        self.properties = [Property(spec) for spec in self.propSpecs]
+        if any(prop.locator not in "ats" for prop in self.properties):
+            raise RuntimeError("sampler supports only actor, transaction and simulation properties")
+        self.interval = float(interval)
+        self.samples = int(float(horizon) // self.interval) + 1
+        self.rows = 0
+        self.data = np.full((len(self.properties), 64, self.samples), np.nan)
+        self.sampled = 0
+
+    def _reserve(self, rows):
+        if rows > self.data.shape[1]:
+            data = np.full((len(self.properties), max(rows, 2 * self.data.shape[1]), self.samples),
+                           np.nan)
+            data[:, :self.data.shape[1], :] = self.data
+            self.data = data
+        self.rows = max(self.rows, rows)
+
+    def sample(self):
+        column = self.sampled
+        self._reserve(self.simulation.acounter)
+        for i, prop in enumerate(self.properties):
+            if prop.locator == "a":
+                self._sampleStores(i, prop, column)
+            else:
+                self._sampleActors(i, prop, column, self.simulation.liveActors.values())
+        self.sampled += 1
+
+    def _sampleActors(self, i, prop, column, actors):
+        for actor in actors:
+            try:
+                self.data[i, actor.index, column] = float(prop.get(actor.transaction, None))
+            except (KeyError, AttributeError): #actor without property (e.g. starter)
+                pass
+
+    def _sampleStores(self, i, prop, column):
+        "vectorised sampling of actor property from actor stores"
+        for store in self.simulation.actorStores.values():
+            rows = store.liveRows()
+            if prop.propName in store.columns:
+                self.data[i, store.actorIndex[rows], column] = store.data[
+                                                        rows, store.columns[prop.propName]]
+            else:
+                actors = [self.simulation.liveActors[index] for index in store.actorIndex[rows]]
+                self._sampleActors(i, prop, column, actors)
+
+    def run(self): #SimPy PEM method
+        while self.sampled < self.samples:
+            self.sample()
+            if self.sampled < self.samples:
+                yield hold, self, self.interval
+
+    def matrix(self, propSpec):
+        "matrix of samples of property (actors x samples)"
+        return self.data[self.propSpecs.index(propSpec), :self.rows, :]
+
+    @property
+    def times(self):
+        return self.interval * np.arange(self.samples)
+
+    def mean(self, propSpec):
+        "mean value over live actors for every sample"
+        return np.nanmean(self.matrix(propSpec), axis=0)
+
+    def __str__(self):
+        return "actors: {0.rows}, samples: {0.sampled}/{0.samples}".format(self)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from multiprocessing import shared_memory
+
+attached = {} #shared results attached by current (worker) process (block name -> SharedResults)
+
+class SharedResults:
+    """
+    Result arrays of process pool (rows x width float64 matrices, NaN = not written) in one
+    block of shared memory. Parent creates the block, workers attach it by spec (pool
+    initializer, any start method) and write rows of their jobs directly, so only completion
+    token is sent through pool pipe. Worker which can not open the block returns its values
+    through the pool and parent writes them.
+
+    Attributes:
+        layout -- list of (name, width), e.g. [("result", 3), ("loadCurve", 96)]
+        rows -- number of rows (e.g. sweep points)
+        arrays -- numpy views (name -> rows x width array)
+    """
+    def __init__(self, layout, rows, name = None):
+        self.layout = [(key, int(width)) for key, width in dict(layout).items()]
+        self.rows = rows
+        size = max(8 * rows * sum(width for key, width in self.layout), 8)
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            #workers share resource tracker with parent, so the block is unlinked only once
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.arrays = {}
+        offset = 0
+        for key, width in self.layout:
+            self.arrays[key] = np.ndarray((rows, width), np.float64, buffer=self.memory.buf,
+                                          offset=offset)
+            offset += 8 * rows * width
+        if self.owner:
+            for array in self.arrays.values():
+                array.fill(np.nan)
+
+    @property
+    def spec(self):
+        "picklable specification for workers"
+        return (self.memory.name, self.layout, self.rows)
+
+    @staticmethod
+    def attach(spec):
+        "shared results of spec in current process (None if the block can not be opened)"
+        name, layout, rows = spec
+        if name not in attached:
+            try:
+                attached[name] = SharedResults(layout, rows, name)
+            except OSError:
+                attached[name] = None
+        return attached[name]
+
+    def write(self, row, values):
+        "writes values (name -> array of width or scalar) into row"
+        for key, value in values.items():
+            self.arrays[key][row, :] = value
+
+    def written(self):
+        "boolean mask of (completely) written rows"
+        mask = np.ones(self.rows, dtype=bool)
+        for array in self.arrays.values():
+            mask &= ~np.isnan(array).any(axis=1)
+        return mask
+
+    def copy(self):
+        "private copies of arrays (valid after close)"
+        return {key : array.copy() for key, array in self.arrays.items()}
+
+    def close(self):
+        self.arrays = {}
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
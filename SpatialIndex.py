@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import csv
+import math
+import heapq
+
+def loadStations(path):
+    "stations from CSV with header id,x,y,sockets (coordinates in km), returns list of rows"
+    stations = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            if row["id"].startswith("#"):
+                continue
+            stations.append((row["id"].strip(), float(row["x"]), float(row["y"]),
+                             int(float(row["sockets"]))))
+    return stations
+
+class StationGrid:
+    """
+    Uniform grid over coordinates of stations. Every cell keeps sum of free sockets
+    of its stations, so k-nearest search (rings of cells around query point) skips
+    cells of full stations without scanning them.
+
+    Attributes:
+        free -- number of free sockets per station (must be updated by setFree)
+    """
+    def __init__(self, xs, ys, capacities, cellSize = None):
+        self.xs = list(xs)
+        self.ys = list(ys)
+        self.free = list(capacities)
+        n = len(self.xs)
+        if cellSize is None: #about 4 stations per cell
+            area = (max(self.xs) - min(self.xs)) * (max(self.ys) - min(self.ys)) if n else 0.0
+            cellSize = math.sqrt(4.0 * area / n) if area > 0 else 1.0
+        self.cellSize = cellSize
+        self.cells = {} #(column, row) -> list of stations
+        self.cellFree = {}
+        for station in range(n):
+            cell = self.cell(self.xs[station], self.ys[station])
+            self.cells.setdefault(cell, []).append(station)
+            self.cellFree[cell] = self.cellFree.get(cell, 0) + self.free[station]
+        columns = [cell[0] for cell in self.cells] or [0]
+        rows = [cell[1] for cell in self.cells] or [0]
+        self.bounds = (min(columns), max(columns), min(rows), max(rows))
+
+    def cell(self, x, y):
+        return (math.floor(x / self.cellSize), math.floor(y / self.cellSize))
+
+    def setFree(self, station, free):
+        cell = self.cell(self.xs[station], self.ys[station])
+        self.cellFree[cell] += free - self.free[station]
+        self.free[station] = free
+
+    def _ring(self, column, row, r):
+        if r == 0:
+            yield (column, row)
+            return
+        for i in range(-r, r + 1):
+            yield (column + i, row - r)
+            yield (column + i, row + r)
+        for j in range(-r + 1, r):
+            yield (column - r, row + j)
+            yield (column + r, row + j)
+
+    def nearest(self, x, y, k = 1, available = True, maxDistance = float('inf')):
+        """
+        list of (distance, station) of k nearest stations sorted by distance
+        (only stations with free socket if available is True)
+        """
+        column, row = self.cell(x, y)
+        minColumn, maxColumn, minRow, maxRow = self.bounds
+        rings = max(abs(column - minColumn), abs(column - maxColumn),
+                    abs(row - minRow), abs(row - maxRow))
+        s = self.cellSize
+        margin = min(x - column * s, (column + 1) * s - x, y - row * s, (row + 1) * s - y)
+        best = [] #heap of (-distance, station)
+        for r in range(rings + 1):
+            bound = (r - 1) * s + margin if r > 0 else 0.0 #lower bound of distance in ring
+            if bound > maxDistance or (len(best) == k and bound >= -best[0][0]):
+                break
+            for cell in self._ring(column, row, r):
+                stations = self.cells.get(cell)
+                if stations is None or (available and self.cellFree[cell] <= 0):
+                    continue
+                for station in stations:
+                    if available and self.free[station] <= 0:
+                        continue
+                    d = math.hypot(self.xs[station] - x, self.ys[station] - y)
+                    if d > maxDistance:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, station))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, station))
+        return sorted((-d, station) for d, station in best)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import time
+import itertools
+import argparse
+import numpy as np
+from Collector import Collector, Statistics, LoadCurve
+import Replication
+from Replication import (runReplication, replicateAdaptive, parameterKey, Target, compileModel,
+                         poolContext)
+from CostModel import CostModel
+from SharedResults import SharedResults
+from XValue import number
+
+try:
+    from scipy.stats import qmc
+except ImportError:
+    qmc = None
+
+class Range:
+    """
+    Continuous (or integral) range of parameter for sampling designs (lhs, sobol).
+    For grid design the step must be specified.
+    """
+    def __init__(self, low, high, step = None, integer = None):
+        self.low = low
+        self.high = high
+        self.step = step
+        self.integer = (integer if integer is not None
+                           else all(isinstance(v, int) for v in (low, high, step or 0)))
+
+    def scale(self, u):
+        "maps value from <0,1> to range"
+        value = self.low + u * (self.high - self.low)
+        return int(round(value)) if self.integer else float(value)
+
+    def values(self):
+        if self.step is None:
+            raise ValueError("grid design requires step of range")
+        values = np.arange(self.low, self.high + self.step / 2, self.step)
+        return [int(v) if self.integer else round(float(v), 12) for v in values]
+
+def gridDesign(space):
+    "full factorial design; space: name -> list of values or Range with step"
+    names = sorted(space)
+    levels = [space[name].values() if isinstance(space[name], Range) else list(space[name])
+                for name in names]
+    return [dict(zip(names, point)) for point in itertools.product(*levels)]
+
+def scaleDimension(dimension, u):
+    "maps value from <0,1> to Range or to item of list of values (categorical parameter)"
+    if isinstance(dimension, Range):
+        return dimension.scale(u)
+    values = list(dimension)
+    if not values:
+        raise ValueError("empty list of parameter values")
+    return values[min(int(u * len(values)), len(values) - 1)]
+
+def latinHypercube(space, n, seed = None):
+    "latin hypercube sample of n points; space: name -> Range or list of values"
+    rng = np.random.default_rng(seed)
+    names = sorted(space)
+    columns = [(rng.permutation(n) + rng.random(n)) / n for name in names]
+    return [{name : scaleDimension(space[name], column[i])
+                 for name, column in zip(names, columns)} for i in range(n)]
+
+def sobolDesign(space, n, seed = None):
+    """
+    scrambled Sobol sequence of n points (requires scipy); space: name -> Range or list
+    of values
+    """
+    if qmc is None:
+        raise RuntimeError("sobol design requires scipy")
+    names = sorted(space)
+    sample = qmc.Sobol(d=len(names), scramble=True, seed=seed).random(n)
+    return [{name : scaleDimension(space[name], u) for name, u in zip(names, row)}
+                for row in sample]
+
+class ResultStore:
+    """
+    Append-only store of sweep results (one JSON object per line) keyed by parameter hash.
+    Lines are flushed and synced immediately, a truncated last line (crash) is removed
+    (or terminated if it is complete record) before next records are appended.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        if os.path.exists(path):
+            with open(path, "r+b") as f:
+                data = f.read()
+                for line in data.splitlines():
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        continue
+                    self.results[record["key"]] = record
+                if data and not data.endswith(b"\n"):
+                    end = data.rfind(b"\n") + 1
+                    try:
+                        json.loads(data[end:].decode("utf-8"))
+                        f.write(b"\n")
+                    except ValueError:
+                        f.truncate(end)
+        self.file = open(path, "at")
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def __len__(self):
+        return len(self.results)
+
+    def append(self, params, result, wallTime = None, **extra):
+        record = dict(key=parameterKey(params), params=params, result=result, time=wallTime)
+        record.update(extra)
+        self.file.write(json.dumps(record, sort_keys=True) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.results[record["key"]] = record
+        return record
+
+    def close(self):
+        self.file.close()
+
+def summary(collector):
+    "default JSON compatible summary of (merged) collector"
+    result = {}
+    for category, container in collector.categories.items():
+        if isinstance(container, Statistics):
+            result[category] = dict(mean=container.mean, sum=container.sum,
+                                    count=container.count)
+            if len(collector.replications) > 1:
+                result[category]["ci"] = collector.confidenceInterval(category)[1]
+        elif isinstance(container, LoadCurve):
+            result[category] = dict(peak=container.peak, mean=container.mean)
+        elif isinstance(container, dict):
+            result[category] = {str(key) : value for key, value in container.items()
+                                    if isinstance(value, (int, float))}
+        elif isinstance(container, list):
+            result[category] = len(container)
+    return result
+
+def evaluatePoint(job):
+    """
+    Evaluates one point of sweep in worker process
+    job = (model, parameters, seed, modules, duration, setup, measure, replications, shared)
+    shared = None or (spec of SharedResults, row, extract function)
+    Returns (params, result, wall time, events, values); values = None or (row, extracted
+    values) if shared results are not attached in worker.
+    """
+    model, params, seed, modules, duration, setup, measure, replications, shared = job
+    start = time.time()
+    snapshots = []
+    events = 0
+    for i in range(replications):
+        snapshots.append(runReplication((model, params, seed + i, modules, duration, setup)))
+        events += Replication.workerSimulation.events
+    collector = Collector.merge(snapshots)
+    values = None
+    if shared is not None:
+        spec, row, extract = shared
+        results = SharedResults.attach(spec)
+        if results is not None:
+            results.write(row, extract(collector))
+        else:
+            values = (row, extract(collector))
+        result = measure(collector) if measure is not None else None
+    else:
+        result = measure(collector) if measure is not None else summary(collector)
+    return params, result, time.time() - start, events, values
+
+class Sweep:
+    """
+    Resumable parameter sweep. Points (parameter dictionaries) are evaluated on process
+    pool and results are appended to ResultStore; points already present in store are
+    skipped (i.e. interrupted sweep continues after restart).
+
+    measure -- optional picklable function of merged collector returning JSON compatible
+               result (default: summary)
+    targets -- optional precision targets (see Replication.Target); if specified
+               the number of replications of every point is adaptive (from replications
+               to maxReplications)
+    costModel -- optional CostModel; points are scheduled longest expected first
+                 (idle workers take the next point) and costs of finished points are
+                 recorded
+    shared -- optional layout of shared result arrays {name: width}; function extract
+              of merged collector returns values of point {name: array or scalar}
+              which are written by workers directly into shared memory (row of point),
+              arrays are saved to storePath + ".npz" (see arrays)
+    """
+    def __init__(self, model, points, storePath, fixed = None, modules = ("ECarModel", "Pause"),
+                 duration = 0xFFFFFFFF, setup = None, measure = None, replications = 1, seed = 0,
+                 targets = None, maxReplications = 100, costModel = None, shared = None,
+                 extract = None):
+        self.model = model
+        self.fixed = dict(fixed) if fixed is not None else {}
+        self.points = [dict(self.fixed, **point) for point in points]
+        self.store = ResultStore(storePath)
+        self.modules = tuple(modules)
+        self.duration = duration
+        self.setup = setup
+        self.measure = measure
+        self.replications = replications
+        self.seed = seed
+        self.targets = targets
+        self.maxReplications = maxReplications
+        self.costModel = costModel
+        self.shared = shared
+        self.extract = extract
+        self.arrayPath = storePath + ".npz"
+        self.arrays = None #saved shared results (name -> points x width array)
+        if shared is not None:
+            self.arrays = self.loadArrays()
+
+    def loadArrays(self):
+        "saved shared results rearranged to rows of current points (missing rows are NaN)"
+        arrays = {key : np.full((len(self.points), width), np.nan)
+                    for key, width in self.shared.items()}
+        if os.path.exists(self.arrayPath):
+            with np.load(self.arrayPath) as saved:
+                rows = {key : row for row, key in enumerate(saved["keys"])}
+                for i, point in enumerate(self.points):
+                    row = rows.get(parameterKey(point))
+                    if row is not None and saved["written"][row]:
+                        for key in arrays:
+                            arrays[key][i] = saved[key][row]
+        return arrays
+
+    def saveArrays(self, results):
+        self.arrays = results.copy()
+        written = results.written()
+        with open(self.arrayPath + ".tmp", "wb") as f:
+            np.savez(f, keys=np.array([parameterKey(point) for point in self.points]),
+                     written=written, **self.arrays)
+        os.replace(self.arrayPath + ".tmp", self.arrayPath)
+
+    def pending(self):
+        keys = [parameterKey(point) for point in self.points]
+        if self.shared is not None:
+            written = ~np.isnan(np.hstack(list(self.arrays.values()))).any(axis=1)
+            return [point for point, key, done in zip(self.points, keys, written)
+                        if key not in self.store or not done]
+        return [point for point, key in zip(self.points, keys) if key not in self.store]
+
+    def jobs(self, points, results = None):
+        rows = {parameterKey(point) : row for row, point in enumerate(self.points)}
+        for point in points:
+            key = parameterKey(point)
+            seed = (int(key[:12], 16) + self.seed) % 2**48
+            shared = (results.spec, rows[key], self.extract) if results is not None else None
+            yield (self.model, point, seed, self.modules, self.duration, self.setup,
+                   self.measure, self.replications, shared)
+
+    def adaptiveResults(self, pending, workers):
+        for point, collector, estimates in replicateAdaptive(
+                    self.model, pending, self.targets, max(self.replications, 2),
+                    self.maxReplications, workers, self.modules, self.seed, self.duration,
+                    self.setup):
+            result = self.measure(collector) if self.measure is not None else summary(collector)
+            yield point, result, None, dict(estimates=estimates,
+                                            replications=len(collector.replications))
+
+    def fixedResults(self, pending, workers, results = None):
+        compileModel(self.model, self.modules, pending[0] if pending else None)
+        #workers attach shared results at start (spawned workers do not inherit them)
+        initializer = (SharedResults.attach, (results.spec,)) if results is not None else ()
+        with poolContext().Pool(workers, *initializer) as pool:
+            for params, result, wallTime, events, values in pool.imap_unordered(
+                                                        evaluatePoint,
+                                                        self.jobs(pending, results),
+                                                        chunksize=1):
+                if values is not None:
+                    results.write(*values)
+                if self.costModel is not None:
+                    self.costModel.record(self.model, params, events / self.replications,
+                                          wallTime / self.replications)
+                yield params, result, wallTime, dict(events=events)
+
+    def run(self, workers = None, progress = sys.stderr):
+        pending = self.pending()
+        if self.costModel is not None:
+            pending = self.costModel.order(self.model, pending)
+        total = len(self.points)
+        done = total - len(pending)
+        if progress is not None:
+            print("{0}/{1} points already done".format(done, total), file=progress)
+        if self.shared is None:
+            results = (self.adaptiveResults(pending, workers) if self.targets
+                          else self.fixedResults(pending, workers))
+            self.report(results, len(pending), done, total, progress)
+            return self.store
+        if self.targets:
+            raise RuntimeError("shared results are not supported with adaptive replications")
+        shared = SharedResults(self.shared, len(self.points))
+        try:
+            for key, array in self.arrays.items():
+                shared.arrays[key][:] = array
+            self.report(self.fixedResults(pending, workers, shared), len(pending), done, total,
+                        progress)
+        finally:
+            self.saveArrays(shared)
+            shared.close()
+        return self.store
+
+    def report(self, results, pending, done, total, progress):
+        "appends results to store (with progress report)"
+        start = time.time()
+        finished = 0
+        for params, result, wallTime, extra in results:
+            self.store.append(params, result, wallTime, **extra)
+            finished += 1
+            if progress is not None:
+                elapsed = time.time() - start
+                eta = elapsed / finished * (pending - finished)
+                print("{0}/{1} done, elapsed {2:.0f} s, ETA {3:.0f} s"
+                        .format(done + finished, total, elapsed, eta), file=progress)
+
+def parseSpec(spec):
+    """
+    parameter specification: value | v1,v2,... | low..high | low..high/step
+    """
+    if "," in spec:
+        return [number(v, keepInt=True) for v in spec.split(",")]
+    if ".." in spec:
+        step = None
+        if "/" in spec:
+            spec, step = spec.split("/")
+            step = number(step, keepInt=True)
+        low, high = (number(v, keepInt=True) for v in spec.split(".."))
+        return Range(low, high, step)
+    return number(spec, keepInt=True)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="resumable parameter sweep of ETOS model")
+    parser.add_argument("model", help="url of starting transaction")
+    parser.add_argument("store", help="results file (JSON lines, append-only)")
+    parser.add_argument("parameters", nargs="+",
+                        help="name=value | name=v1,v2,... | name=low..high[/step]")
+    parser.add_argument("--design", choices=["grid", "lhs", "sobol"], default="grid")
+    parser.add_argument("--points", type=int, default=100, help="number of points (lhs, sobol)")
+    parser.add_argument("--replications", type=int, default=1,
+                        help="(minimal) number of replications per point")
+    parser.add_argument("--target", action="append", default=[],
+                        help="precision target 'expression <= relative half-width'"
+                             " (e.g. 'charged_f.sum / charged_h.sum <= 0.02')")
+    parser.add_argument("--max-replications", type=int, default=100)
+    parser.add_argument("--cost-db", default=None,
+                        help="database of job costs shared by sweeps (default: etos-cost.jsonl"
+                             " in directory of store)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    space, fixed = {}, {}
+    for parameter in args.parameters:
+        name, spec = parameter.split("=")
+        value = parseSpec(spec)
+        if isinstance(value, (list, Range)):
+            space[name] = value
+        else:
+            fixed[name] = value
+    if args.design == "grid":
+        points = gridDesign(space)
+    elif args.design == "lhs":
+        points = latinHypercube(space, args.points, args.seed)
+    else:
+        points = sobolDesign(space, args.points, args.seed)
+    sweep = Sweep(args.model, points, args.store, fixed,
+                  replications=args.replications, seed=args.seed,
+                  targets=[Target.parse(spec) for spec in args.target],
+                  maxReplications=args.max_replications,
+                  costModel=CostModel(args.cost_db or os.path.join(
+                      os.path.dirname(os.path.abspath(args.store)), "etos-cost.jsonl")))
+    sweep.run(args.workers)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from SimPy.Simulation import *
-from UrlUtil import xmlLoader, XmlSource
+from UrlUtil import xmlLoader, XmlSource, NodeCache
 from XValue import *
 from PropertyGetter import Property
 import uuid
@@ -19,8 +19,11 @@ class ExceptionEvent:
         
  
 def populateEntities(factory, transaction, xmlNode):
-    entities = [factory.createFromXml(node, transaction, base)
-                    for node,base in xmlNode.iterWithBased()]
+    return linkReferedEntities([factory.createFromXml(node, transaction, base)
+                                    for node,base in xmlNode.iterWithBased()])
+
+def linkReferedEntities(entities):
+    "resolves references of checkpoints to previous or next entity"
     for i in range(len(entities)):
         if not isinstance(entities[i], Checkpoint) or entities[i].referedEntity is None:
             continue
@@ -53,12 +56,16 @@ class Transaction(Process):
         super().__init__(sim=simulation)
         self.simulation = simulation
         try:
-            self.entitiesXmlNode = entitiesXmlNode if entitiesXmlNode is not None else XmlSource()
+            self.entitiesXmlNode = XmlSource() #own copy (the source is shared by siblings)
+            if entitiesXmlNode is not None:
+                self.entitiesXmlNode.append(entitiesXmlNode)
             self.template = transactionXmlNode.get("id")
+            self.poolKey = None #key of pool for recycling (only if started from pool)
             self.pid = self.simulation.getTId()
             self.id = tid if tid is not None else self.pid
             self.ppid = ppid
 
+            self.ownActor = actor is None
             if actor is not None:
                 self.actor = actor
             else:
@@ -68,20 +75,20 @@ class Transaction(Process):
                                        xmlLoader(path, base=base), extraProperties = True)
                 else:
                     self.actor = Actor(self.simulation, XmlSource())
+                self.actor.transaction = self
 
             self.startTime = None
             if xcontext is None:
-                self.xcontext = XValueContext(lambda: self.simulation.now() - self.startTime)
+                self.xcontext = XValueContext(self.localTime)
             else:
                 self.xcontext = xcontext
-            self.t = self.xcontext.t
 
             path, base = transactionXmlNode.getWithBase("entities")
             if path is not None:
                 self.entitiesXmlNode.append(xmlLoader(path, base=base))
                 
             if entities is None:
-                self.factory = EntityFactory(entitiesXmlNode)    
+                self.factory = EntityFactory(self.entitiesXmlNode)
                 self.entities = populateEntities(self.factory, self, transactionXmlNode)
             else:
                 for entity in entities:
@@ -98,6 +105,8 @@ class Transaction(Process):
         exceptionEvent = None
         for entity in self.entities:
             entity.startTime = self.simulation.now()
+            if self.simulation.arrivalProfiles is not None:
+                self.simulation.recordArrival(entity, self)
             with entity.xcontext:
             # in Python 3.3 could be transfer to "yield from self.action"
                 generator = entity.action() 
@@ -113,18 +122,40 @@ class Transaction(Process):
                         yield event
                     except StopIteration:
                         break
+                    except GeneratorExit:
+                        return
                     except BaseException as e:
                         print("EXCEPTION : {0}".format(str(e)))
                         traceback.print_exc(file=sys.stderr)
                         self.simulation.stopSimulation()
                 if interrupted:
                     break
+        if self.ownActor:
+            self.simulation.unregisterActor(self.actor)
         if not self.topLevel:
             self.returnSignal.signal(exceptionEvent)
         else:
             if interrupted and exceptionEvent.type != "__exit__":
                 print("UNHANDLED EXCEPTION '{0}'".format(exceptionEvent.type))
-            
+            if self.poolKey is not None:
+                self.simulation.transactionPool.release(self)
+
+    def reset(self):
+        "prepares finished top level transaction (incl. entities and actor) for reuse"
+        Process.__init__(self, sim=self.simulation)
+        self.pid = self.simulation.getTId()
+        self.id = self.pid
+        self.startTime = None
+        self.xcontext.resetContext()
+        if self.ownActor:
+            self.actor.reset()
+
+    def localTime(self):
+        return self.simulation.now() - self.startTime
+
+    @property
+    def t(self):
+        return self.xcontext.t
 
     @property 
     def topLevel(self):
@@ -182,6 +213,8 @@ class ControlEntity(SimpleEntity):
             exception = None
             while self.nextSubEntity(exception):
                 entity = self.subentities[self.entityIndex]
+                if self.simulation.arrivalProfiles is not None:
+                    self.simulation.recordArrival(entity, self.transaction)
                 with entity.xcontext:
                     i = iter(entity.action())
                     while True:
@@ -424,7 +457,8 @@ class TransactionEntity(SimpleEntity):
 class StartTransaction(TransactionEntity):
     """
         New top level transaction is created and started (it runs independently on
-        parent transaction).
+        parent transaction). In cohort mode the transaction is a new member of cohort
+        of its template (see Simulation.enableCohorts).
             
          Declarative element: start_transaction   
     """
@@ -433,9 +467,77 @@ class StartTransaction(TransactionEntity):
        
         
     def action(self):
-        t = Transaction(self.transactionNode, simulation=self.simulation,
-                        entitiesXmlNode=self.entitiesNode, actor = None)
+        if self.simulation.cohorts is not None:
+            self.simulation.cohort(self.transactionNode, self.entitiesNode).add()
+            return
+        pool = self.simulation.transactionPool
+        t = None
+        if pool is not None:
+            key = pool.key(self.transactionNode, self.entitiesNode)
+            t = pool.acquire(key)
+        if t is None:
+            t = Transaction(self.transactionNode, simulation=self.simulation,
+                            entitiesXmlNode=self.entitiesNode, actor = None)
+            if pool is not None:
+                t.poolKey = key
+                pool.created += 1
         self.simulation.activate(t, t.run(), at = 0)
+
+class TransactionPool:
+    """
+    Optional pool of finished top level transactions (see Simulation.enablePooling).
+    Transactions started by start_transaction are returned to pool after finishing
+    and they are reused (with their entity trees) by next start of the same template.
+
+    Attributes:
+        created -- number of newly created transactions
+        reused -- number of recycled transactions
+        savedEntities -- number of entity objects which were not created thanks to reuse
+    """
+    def __init__(self, maxSize = 1000):
+        self.maxSize = maxSize
+        self.free = {} # key -> list of finished transactions
+        self.created = 0
+        self.reused = 0
+        self.savedEntities = 0
+
+    @staticmethod
+    def key(transactionNode, entitiesNode):
+        return (tuple(transactionNode.elements), tuple(entitiesNode.elements))
+
+    def acquire(self, key):
+        free = self.free.get(key)
+        if not free:
+            return None
+        t = free.pop()
+        t.reset()
+        self.reused += 1
+        self.savedEntities += countEntities(t.entities)
+        return t
+
+    def release(self, transaction):
+        free = self.free.setdefault(transaction.poolKey, [])
+        if len(free) < self.maxSize:
+            free.append(transaction)
+
+    @property
+    def reuseRate(self):
+        started = self.created + self.reused
+        return self.reused / started if started > 0 else 0.0
+
+    def __str__(self):
+        return "created: {0.created}, reused: {0.reused}, reuse rate: {0.reuseRate}, saved entities: {0.savedEntities}".format(self)
+
+def countEntities(entities):
+    "number of entities in entity tree (incl. subentities and entities of subtransactions)"
+    count = 0
+    for entity in entities:
+        count += 1
+        if isinstance(entity, ControlEntity):
+            count += countEntities(entity.subentities)
+        elif isinstance(entity, SubTransaction) and entity.savedEntities is not None:
+            count += countEntities(entity.savedEntities)
+    return count
         
 class SubTransaction(TransactionEntity):
     def __init__(self, transaction, xmlSource):
@@ -502,6 +604,7 @@ class SetEntity(SimpleEntity):
         self.property.set(self.transaction, self, float(self.value))
   
 class EntityFactory:
+    sources = NodeCache() #flyweight XML sources of entities (shared by all instances of template)
     stdMapping = dict({ "if" : If, "while" : While, "with" : WithProbability},
                       checkpoint = Checkpoint,
                       trace = Trace,
@@ -536,16 +639,23 @@ class EntityFactory:
                 EntityFactory.register(cls)
                 
         
+    def entitySource(self, transactionNode, base):
+        key = (transactionNode, base, tuple(self.root.elements) if self.root is not None else ())
+        source = EntityFactory.sources.get(key)
+        if source is None:
+            source = XmlSource()
+            source.append(transactionNode, base)
+            eId = transactionNode.get("id", None)
+            if eId is not None:
+                externalNode = self.root.find("{0}[@id='{1}']".format(transactionNode.tag, eId))
+                if externalNode is not None:
+                    source.append(externalNode)
+            EntityFactory.sources[key] = source
+        return source
+
     def createFromXml(self, transactionNode, transaction, base = None):
-        eType = transactionNode.tag
-        source = XmlSource()
-        source.append(transactionNode, base)
-        eId = transactionNode.get("id", None)
-        if eId is not None:
-            externalNode = self.root.find("{0}[@id='{1}']".format(eType, eId))
-            if externalNode is not None:
-                source.append(externalNode)
-        entity = self.mapping[eType](transaction, source)
+        source = self.entitySource(transactionNode, base)
+        entity = self.mapping[transactionNode.tag](transaction, source)
         if isinstance(entity, ControlEntity):
             entity.populateSubEntities(self.root)
         return entity      
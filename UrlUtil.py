@@ -2,8 +2,8 @@ from urllib.parse import urlparse, urlunparse, urljoin
 from urllib.request import urlopen
 
 import os.path
-import uuid
 import itertools
+import collections
 
 try:
   from lxml import etree
@@ -34,6 +34,9 @@ class XmlSource:
         elements, possibly to several XML documents.
         The object provide minimal API of xml.etree.ElementTree.Element objects (find and iterator)
     """
+    __slots__ = ("elements", "bases")
+    anonymousIds = itertools.count(1) #cheap sequential ids of anonymous entities
+
     def __init__(self, nodes = None):
         self.elements = []
         self.bases = []
@@ -66,7 +69,7 @@ class XmlSource:
         ids = [element.get("id", None) for element in self.elements
                  if element.get("id", None) is not None]
         if not ids:
-            return uuid.uuid4() 
+            return "~{0}".format(next(XmlSource.anonymousIds))
         return common(ids)
         
     @property
@@ -90,9 +93,10 @@ class XmlSource:
     def append(self, node, base = None):
         if isinstance(node, XmlSource):
             self.elements.extend(node.elements)
+            self.bases.extend(node.bases)
         else:
             self.elements.append(node)
-        self.bases.append(base)
+            self.bases.append(base)
     
     def __str__(self):
         return ",".join(str(element) for element in self.elements)
@@ -112,27 +116,81 @@ def xmlStringLoader(xml):
     nodes.append(root)
     return nodes
 
+class NodeCache:
+    """
+    Process wide cache keyed by XML nodes (templates, measures, generators) with bounded
+    number of items (least recently used items are removed). All node caches are cleared
+    with document cache and when a cached document is reloaded.
+    """
+    caches = []
+
+    def __init__(self, maxSize = 10000):
+        self.maxSize = maxSize
+        self.items = collections.OrderedDict()
+        NodeCache.caches.append(self)
+
+    def get(self, key, default = None):
+        value = self.items.get(key, default)
+        if key in self.items:
+            self.items.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.maxSize:
+            self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+    def clear(self):
+        self.items.clear()
+
+    @staticmethod
+    def clearAll():
+        for cache in NodeCache.caches:
+            cache.clear()
+
+documentCache = {} #parsed documents shared by all loaders (url -> (mtime, root)), read only!
+
+def clearDocumentCache():
+    documentCache.clear()
+    NodeCache.clearAll()
+
+def loadDocument(target, path):
+    mtime = os.path.getmtime(path) if target.startswith("file:") else None
+    cached = documentCache.get(target)
+    if cached is None or cached[0] != mtime:
+        if cached is not None: #nodes of old version are not used any more
+            NodeCache.clearAll()
+        cached = (mtime, etree.parse(urlopen(target)).getroot())
+        documentCache[target] = cached
+    return cached[1]
+
+def resolveUrl(url, base=None):
+    "returns (url of document, local path, fragment), relative paths are files"
+    pu = urlparse(url) if base is None else urlparse(urljoin(base, url))
+    scheme = pu.scheme
+    path = pu.path
+    if scheme == "":
+        scheme = "file"
+        if not os.path.isabs(path):
+            path = os.path.abspath(path)
+    return urlunparse((scheme, pu.netloc, path, pu.params, pu.query, "")), path, pu.fragment
+
 def xmlLoader(*args, base=None):
     urls =  []
     for url in args:
         urls.extend(url.split("|"))
     nodes = XmlSource()
     for url in urls:
-        pu = urlparse(url) if base is None else urlparse(urljoin(base, url))
-        scheme = pu.scheme
-        path = pu.path
-        if scheme == "":
-            scheme = "file"
-            if not os.path.isabs(path):
-                path = os.path.abspath(path)
-        
-        target = urlunparse((scheme, pu.netloc, path, pu.params, pu.query, ""))
-        data = urlopen(target)
-        root = etree.parse(data)
-        if pu.fragment == "":
-            node = root.getroot()
+        target, path, fragment = resolveUrl(url, base)
+        root = loadDocument(target, path)
+        if fragment == "":
+            node = root
         else:
-            node = root.getroot().find(pu.fragment)
+            node = root.find(fragment)
         nodes.append(node, base=target)
 
     return nodes        
@@ -4,6 +4,7 @@ import inspect
 import operator
 import random
 import TimeUtil
+from UrlUtil import NodeCache
 
 class InvalidXMLException(Exception):
     "invalid structure in XML input data"
@@ -44,19 +45,26 @@ class XValueHelper:
 
 class XValueContext:
     "context for x-values (support of scope and local timescale)"
+    __slots__ = ("time", "values")
+
     def __init__(self, timeFunc = None):
         self.time = timeFunc #function of timescale
-        self.values = weakref.WeakSet() #set of weak reference for all values of context
+        self.values = None #weak set of random values of context (created lazily)
         
     def addValue(self, value): 
-        "add value to context"
+        "add value to context (only random values are reset, the others are not registered)"
+        if value.type != XValueType.RANDOM:
+            return
+        if self.values is None:
+            self.values = weakref.WeakSet()
         self.values.add(value)
         
     def resetContext(self):
         "reset context in the beginning of new scope"
+        if self.values is None:
+            return self
         for value in self.values:
-            if value is not None: #if value isn't garbage-collected
-                value.reset()             
+            value.reset()             
         return self        
 
     def __enter__(self):  #implementation of context manager protocol
@@ -78,13 +86,10 @@ class XValueType:
     TIME_DEPENDENT = 2
 
 class XValue:
+    __slots__ = ("context", "type", "fval", "rval", "time", "__weakref__")
+
     def __init__(self, value, context = None):
         assert value is not None #null (undefined) values are not supported
-        if context is not None:
-            self.context =  context
-            self.context.addValue(self)
-        else:
-            self.context = None
         if isinstance(value, numbers.Real):
             self.type = XValueType.FIXED #fixed itegral or float number
             self.fval = None
@@ -100,6 +105,9 @@ class XValue:
         else:
             raise TypeError("unsupported value type")
         self.time = None
+        self.context = context
+        if context is not None:
+            self.context.addValue(self)
     
     def setContext(self, context):
         self.context =  context
@@ -196,7 +204,7 @@ def number(text, keepInt = False):
 def getXValue(xmlSource, tag, contextHelper, default = None):
     node = xmlSource.findNode(tag)
     if isinstance(contextHelper, XValueHelper):
-        contextAttr = node.get("context")
+        contextAttr = node.get("context") if node is not None else None
         context = (contextHelper.stdContext if contextAttr is None
                     else contextHelper.getContext(XValueHelper.fromAttribName(contextAttr)))
     else:
@@ -212,51 +220,56 @@ def getXValue(xmlSource, tag, contextHelper, default = None):
             return contextHelper.getParameter(ntext[1:], context)
         else:
             return number(ntext, keepInt=True)
-    if subNode.tag == "normal":
-        mu = number(subNode.get("mu", 0.0))
-        sigma = number(subNode.get("sigma", 1.0))
-        return XValue(lambda: random.normalvariate(mu, sigma), context)
-    if subNode.tag == "pnormal":
-        mu = number(subNode.get("mu", 0.0))
-        sigma = number(subNode.get("sigma", 1.0))
-        return XValue(lambda: max(random.normalvariate(mu, sigma), 0.0), context)        
-    elif subNode.tag == "uniform":
-        mn = number(subNode.get("min", 0.0)) 
-        mx = number(subNode.get("max", 1.0))
-        return XValue(lambda: random.uniform(mn, mx), context)
-    elif subNode.tag == "triangular":
-        low = number(subNode.get("low", 0.0)) 
-        high = number(subNode.get("high", 1.0))
-        mode = number(subNode.get("mode", 1.0))
-        return XValue(lambda: random.triangular(low, high, mode), context)
-    elif subNode.tag == "beta":
-        alpha = number(subNode.get("alpha", 0.0)) 
-        beta = number(subNode.get("beta", 1.0))
-        return XValue(lambda: random.betavariate(alpha, beta), context)
-    elif subNode.tag == "gamma":
-        alpha = number(subNode.get("alpha", 0.0)) 
-        beta = number(subNode.get("beta", 1.0))
-        return XValue(lambda: random.gammavariate(alpha, beta), context)
-    elif subNode.tag == "lognormal":
-        mu = number(subNode.get("mu", 0.0))
-        sigma = number(subNode.get("sigma", 1.0))
-        return XValue(lambda: random.lognormvariate(mu, sigma), context)
-    elif subNode.tag == "vonmises":
-        mu = number(subNode.get("mu", 0.0))
-        kappa = number(subNode.get("kappa", 1.0))
-        return XValue(lambda: random.vonmisesvariate(mu, kappa), context)
-    elif subNode.tag == "pareto":
-        alpha = number(subNode.get("alpha", 0.0))
-        return XValue(lambda: random.paretovariate(alpha), context)
-    elif subNode.tag == "weibull":
-        alpha = number(subNode.get("alpha", 0.0)) 
-        beta = number(subNode.get("beta", 1.0))
-        return XValue(lambda: random.weibullvariate(alpha, beta), context)
-    elif subNode.tag == "exponential":
-        lamda = number(subNode.get("lambda", 1.0))
-        return XValue(lambda: random.expovariate(lamda), context)
-    else:
-        raise InvalidXMLException("unsupported attribute value")    
+    generator = distributions.get(subNode)
+    if generator is None:
+        generator = distribution(subNode)
+        distributions[subNode] = generator
+    return XValue(generator, context)
+
+distributions = NodeCache() #generators of random values (XML node -> function), shared
+
+#parameters of distribution elements (attribute, default) in order of arguments of samplers
+distributionParameters = {
+    "normal" : (("mu", "0"), ("sigma", "1")),
+    "pnormal" : (("mu", "0"), ("sigma", "1")),
+    "uniform" : (("min", "0"), ("max", "1")),
+    "triangular" : (("low", "0"), ("high", "1"), ("mode", "1")),
+    "beta" : (("alpha", "0"), ("beta", "1")),
+    "gamma" : (("alpha", "0"), ("beta", "1")),
+    "lognormal" : (("mu", "0"), ("sigma", "1")),
+    "vonmises" : (("mu", "0"), ("kappa", "1")),
+    "pareto" : (("alpha", "0"),),
+    "weibull" : (("alpha", "0"), ("beta", "1")),
+    "exponential" : (("lambda", "1"),)
+}
+
+#scalar backend (function of parameters -> random value), see Cohort.vectorSamplers
+scalarSamplers = {
+    "normal" : random.normalvariate,
+    "pnormal" : lambda mu, sigma: max(random.normalvariate(mu, sigma), 0.0),
+    "uniform" : random.uniform,
+    "triangular" : random.triangular,
+    "beta" : random.betavariate,
+    "gamma" : random.gammavariate,
+    "lognormal" : random.lognormvariate,
+    "vonmises" : random.vonmisesvariate,
+    "pareto" : random.paretovariate,
+    "weibull" : random.weibullvariate,
+    "exponential" : random.expovariate
+}
+
+def distributionParams(subNode):
+    "list of parameters of distribution element"
+    parameters = distributionParameters.get(subNode.tag)
+    if parameters is None:
+        raise InvalidXMLException("unsupported attribute value")
+    return [number(subNode.get(name, default)) for name, default in parameters]
+
+def distribution(subNode):
+    "generator of random values of distribution element"
+    params = distributionParams(subNode)
+    sampler = scalarSamplers[subNode.tag]
+    return lambda: sampler(*params)
         
 
 
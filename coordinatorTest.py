@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import socket
+import argparse
+import tempfile
+import multiprocessing
+from Sweep import ResultStore
+from Coordinator import Coordinator, serve, work
+
+# local test of Coordinator: several worker processes on one machine, one of them is killed
+# while it holds leased jobs; its jobs must be returned to the queue and finished by others
+# (late result of expired lease is tested first without workers)
+# usage: coordinatorTest.py [--workers 3] [--jobs 40]
+
+def evaluate(params):
+    time.sleep(params["delay"])
+    return params["x"] ** 2
+
+def runWorker(port, authkey, batchSize, heartbeatInterval):
+    work("localhost", port, authkey, evaluate, batchSize, heartbeatInterval, idle=0.1)
+
+def lateDuplicateTest(path):
+    "worker A completes job after its lease expired and the job was leased to worker B"
+    store = ResultStore(path)
+    coordinator = Coordinator([dict(x=1, delay=0.0)], store, leaseTimeout=0.1)
+    (key, params), = coordinator.lease("A")
+    time.sleep(0.2)
+    leased = coordinator.lease("B")
+    coordinator.complete("A", [(key, evaluate(params), 0.0)])
+    coordinator.complete("B", [(key, evaluate(params), 0.0)])
+    status = coordinator.status()
+    store.close()
+    errors = []
+    if [job[0] for job in leased] != [key]:
+        errors.append("expired job was not leased again")
+    if not coordinator.finished:
+        errors.append("late duplicate result left lease {0}".format(status))
+    if status["done"] != 1 or store.results[key]["worker"] != "A":
+        errors.append("late result was not stored once")
+    return errors
+
+def runtest():
+    parser = argparse.ArgumentParser(description="local test of fault-tolerant coordinator")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--batch", type=int, default=4, help="jobs per lease")
+    parser.add_argument("--delay", type=float, default=0.05, help="duration of job (sec)")
+    parser.add_argument("--timeout", type=float, default=1.0, help="lease timeout (sec)")
+    parser.add_argument("--port", type=int, default=6843)
+    args = parser.parse_args()
+    if args.workers < 2:
+        parser.error("at least two workers are required")
+
+    directory = tempfile.mkdtemp()
+    errors = lateDuplicateTest(os.path.join(directory, "late.jsonl"))
+    for error in errors:
+        print("FAILED:", error, file=sys.stderr)
+    if not errors:
+        print("OK: late result of expired lease was stored and both leases ended")
+
+    authkey = b"coordinator-test"
+    path = os.path.join(directory, "results.jsonl")
+    store = ResultStore(path)
+    coordinator = Coordinator([dict(x=i, delay=args.delay) for i in range(args.jobs)], store,
+                              leaseTimeout=args.timeout)
+    serve(coordinator, args.port, authkey)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=runWorker,
+                               args=(args.port, authkey, args.batch, args.timeout / 4))
+                  for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    # the first worker is killed (without any cleanup) as soon as it holds leases
+    victim = workers[0]
+    victimId = "{0}:{1}".format(socket.gethostname(), victim.pid)
+    lost = []
+    deadline = time.time() + 30.0
+    while not lost and time.time() < deadline:
+        with coordinator.lock:
+            leased = [key for key, worker in coordinator.leases.items() if worker == victimId]
+            if leased:
+                victim.kill()
+                lost = leased
+        time.sleep(0.005)
+    if not lost:
+        print("FAILED: killed worker got no jobs", file=sys.stderr)
+        return 1
+
+    while not coordinator.finished and time.time() < deadline:
+        time.sleep(0.1)
+        coordinator.expire()
+    for worker in workers:
+        worker.join(10.0)
+    status = coordinator.status()
+    print(status)
+
+    if not coordinator.finished:
+        errors.append("jobs were not finished")
+    if len(store) != args.jobs:
+        errors.append("{0} of {1} results stored".format(len(store), args.jobs))
+    for key in lost:
+        record = store.results.get(key)
+        if record is None or record["worker"] == victimId:
+            errors.append("job {0} of killed worker was not finished".format(key))
+        elif coordinator.attempts[key] < 2:
+            errors.append("job {0} of killed worker was not requeued".format(key))
+    if any(record["result"] != record["params"]["x"] ** 2 for record in store.results.values()):
+        errors.append("invalid results")
+    for error in errors:
+        print("FAILED:", error, file=sys.stderr)
+    if not errors:
+        print("OK: {0} jobs of killed worker were requeued and finished by other workers".format(
+                  len(lost)))
+    store.close()
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(runtest())
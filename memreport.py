@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+import sys
+from Etos import *
+from XValue import number
+import ECarModel
+import Pause
+
+registerModule(ECarModel)
+registerModule(Pause)
+
+# usage: memreport.py transaction-url count duration [parameter=value ...]
+# e.g. memreport.py "XML/e-car-inwest2.xml#transaction[@id='e-car']" 1000 24:00 shoppingProbability=0.9
+sim = Simulation()
+sim.disableLog()
+for arg in sys.argv[4:]:
+    key, value = arg.split("=")
+    sim.setParameter(key, number(value, keepInt=True))
+perTransaction = sim.memoryPerTransaction(sys.argv[1], int(sys.argv[2]), number(sys.argv[3]))
+print("memory per transaction: {0:.0f} B".format(perTransaction))
+print("estimate for 100k transactions: {0:.2f} GB".format(perTransaction * 100000 / 2**30))
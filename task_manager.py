@@ -1,29 +1,20 @@
 #!/usr/bin/env python3
 
-import multiprocessing
-from Etos import *
-import ECarModel
-import Pause
-import numpy as np
 import sys
+from Sweep import Sweep, Range, gridDesign
 
-registerModule(ECarModel)
-registerModule(Pause)
+def batteryOut(collector):
+    return collector.categories["batteryOut"][1.0]
 
-
-
-def taskF(request):
-    sim = Simulation()
-    sim.disableLog()
-    sim.setParameters(**request)
-    sim.start("XML/e-car-inwest.xml#transaction[@id='starter']")
-    print("hotovo {0}".format(request["stations"]), file=sys.stderr)
-    return (request["stations"], request["shoppingProbability"], sim.batteryOut[1.0])
-
-#print(multiprocessing.cpu_count())    
-pool = multiprocessing.Pool()
-tasks = (dict(cars=200, stations=s, shoppingProbability=sp) for s in range(20, 210, 8)
-                                                            for sp in np.arange(0.0, 1.1, 0.1))
-
-for result in pool.imap_unordered(taskF, tasks):
-    print("\t".join(str(item) for item in result))
+# usage: task_manager.py results-file (interrupted sweep continues after restart)
+if __name__ == '__main__':
+    points = gridDesign(dict(stations=Range(20, 202, 8),
+                             shoppingProbability=Range(0.0, 1.0, 0.1)))
+    sweep = Sweep("XML/e-car-inwest.xml#transaction[@id='starter']", points, sys.argv[1],
+                  fixed=dict(cars=200), measure=batteryOut)
+    store = sweep.run()
+    for record in store.results.values():
+        params = record["params"]
+        print("\t".join(str(item) for item in (params["stations"],
+                                               params["shoppingProbability"],
+                                               record["result"])))